@@ -43,14 +43,15 @@ class IDDict:
         self.cleaner.start()
         self.log_system = log_system
 
-    def add_update(self, person_id, cam_id, x, y, reid_id=None):
+    def add_update(self, person_id, cam_id, x, y, reid_id=None, location=None):
         """
         添加或更新行人位置信息，并判断状态变化事件
+        :param location: 调用方已批量算好的位置类型，为None时用area_check逐点计算
         :return: 状态变化事件，如 'enter', 'exit', 'pass'，或 None
         """
         with self.lock:
             current_time = time.time()
-            new_location = self.area_check(x, y)  # 可能返回 'inside', 'outside', 'pass_area'
+            new_location = location if location is not None else self.area_check(x, y)  # 可能返回 'inside', 'outside', 'pass_area'
             entry = self.data.get(person_id)
             event = None
             if entry:
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import numpy as np
+import time
+import threading
+
+import Algorithm.libs.config.model_cfgs as cfgs
+
+
+class _Entry(object):
+    """单条轨迹的特征缓存"""
+    __slots__ = ('feat_sum', 'weight', 'best_quality', 'updated', 'count')
+
+    def __init__(self, dims):
+        self.feat_sum = np.zeros(dims, dtype=np.float32)  # 质量加权的特征和
+        self.weight = 0.0
+        self.best_quality = 0.0
+        self.updated = 0.0     # 最后一次提取特征的时间
+        self.count = 0
+
+
+class TrackFeatureCache(object):
+    """
+    按track缓存ReID特征，避免同一轨迹重复跑特征提取模型
+    - 特征为质量加权的滑动均值(归一化后返回)
+    - 超过ttl秒没有新提取的条目视为过期，需要重新提取
+    - 最多保存max_tracks条，超出按LRU淘汰
+    """
+    def __init__(self, ttl=cfgs.TRACK_FEAT_TTL, max_tracks=cfgs.TRACK_FEAT_MAX,
+                 quality_margin=cfgs.TRACK_FEAT_QUALITY_MARGIN):
+        """
+        :param ttl: 缓存有效期(秒)
+        :param max_tracks: 最多缓存的轨迹数
+        :param quality_margin: 画面质量比缓存中最好的高出该值时重新提取
+        """
+        self.ttl = ttl
+        self.max_tracks = max_tracks
+        self.quality_margin = quality_margin
+        self._entries = OrderedDict()  # {track_id: _Entry}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, track_id, now):
+        """未过期的条目，没有或已过期返回None"""
+        entry = self._entries.get(track_id)
+        if entry is None:
+            return None
+        if now - entry.updated > self.ttl:
+            del self._entries[track_id]
+            return None
+        self._entries.move_to_end(track_id)
+        return entry
+
+    def needs_extract(self, track_id, quality):
+        """没有缓存、缓存过期或当前画面质量明显高于已缓存的最好质量时才需要重新提取"""
+        with self.lock:
+            entry = self._fresh(track_id, time.time())
+            need = entry is None or quality > entry.best_quality + self.quality_margin
+            if need:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return need
+
+    def update(self, track_id, feature, quality):
+        """
+        加入一次新提取的特征
+        :param feature: 特征向量
+        :param quality: 画面质量，作为加权的权重
+        :return: 更新后的均值特征
+        """
+        feature = np.asarray(feature, dtype=np.float32).ravel()
+        weight = max(float(quality), 1e-3)
+        with self.lock:
+            now = time.time()
+            entry = self._fresh(track_id, now)
+            if entry is None:
+                entry = self._entries[track_id] = _Entry(feature.shape[0])
+                while len(self._entries) > self.max_tracks:
+                    self._entries.popitem(last=False)
+            entry.feat_sum += weight * feature
+            entry.weight += weight
+            entry.best_quality = max(entry.best_quality, float(quality))
+            entry.updated = now
+            entry.count += 1
+            return self._mean(entry)
+
+    def get(self, track_id):
+        """返回未过期的均值特征，没有则返回None"""
+        with self.lock:
+            entry = self._fresh(track_id, time.time())
+            return None if entry is None else self._mean(entry)
+
+    @staticmethod
+    def _mean(entry):
+        mean = entry.feat_sum / entry.weight
+        return mean / max(float(np.linalg.norm(mean)), 1e-12)
+
+    def remove(self, track_id):
+        with self.lock:
+            self._entries.pop(track_id, None)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
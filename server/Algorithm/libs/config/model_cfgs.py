@@ -10,6 +10,26 @@ YOLO_MODEL_PATH_PT = './models/best.pt' #yolo12s.pt
 YOLO_DEFAULT_LABEL = [0] # 0 is 'person'
 YOLO_MIN_SIZE = 0
 YOLO_TRACKER_TYPE = 'botsort.yaml' # "bytetrack.yaml"
+HEAD_CLASS = 0              # 检测模型中头肩框的类别，用于跟踪和计数
+BODY_CLASS = 2              # 检测模型中人体框的类别，用于ReID特征提取
+HEAD_BODY_MAX_REL_POS = 0.4 # 头框中心需位于人体框上部该比例以内
+
+# setting of shared detect service
+DETECT_BATCH_WINDOW = 0.01  # 多路画面攒批的等待时间(秒)
+DETECT_MAX_BATCH = 8        # 单次批量推理的最大帧数
+
+# setting of reid worker pool
+REID_ASYNC = True           # 进店ReID(人体框匹配/特征提取/检索/写库)放到线程池异步执行
+REID_WORKERS = 2            # ReID工作线程数
+REID_QUEUE_SIZE = 32        # 排队任务上限
+REID_JOB_MAX_AGE = 2.0      # 秒，排队超过该时间的任务丢弃
+REID_DROP_POLICY = 'drop_oldest'  # 队列满时 'drop_oldest' 丢弃最旧任务 | 'drop_new' 拒绝新任务
+
+# setting of stream analysis
+ANALYSIS_MODE = 'thread'    # 'thread' 各路分析在服务进程内的线程中 | 'process' 每路一个分析进程，帧经共享内存传递
+ANALYSIS_RESULT_QUEUE = 64  # 分析进程回传结果的队列上限，满了丢弃
+ANALYSIS_IN_FLIGHT = 2      # 进程模式下已发给分析进程、未归还的帧数上限
+ANALYSIS_GALLERY_TIMEOUT = 5.0  # 进程模式下分析进程等待服务进程行人库匹配结果的超时(秒)
 
 # setting of reid model
 EXTRACTOR_PERSON = './models/reid_person_0.737.onnx'
@@ -17,11 +37,70 @@ EXTRACTOR_PERSON = './models/reid_person_0.737.onnx'
 REID_IN_SIZE = [256, 128]
 DIMS = 1280
 
+# setting of search engine
+SEARCH_INDEX_TYPE = 'flat'      # 'flat' | 'hnsw' | 'ivf_flat' | 'ivf_pq'，flat为精确检索
+SEARCH_METRIC = 'l2'            # 'l2' | 'cosine'，cosine为归一化特征上的内积检索
+SEARCH_STORAGE = 'float32'      # 'float32' | 'float16' | 'int8'，索引中特征的存储精度(ivf_pq不受影响)
+SEARCH_SQ_MIN_TRAIN = 1000      # int8量化训练所需的最少人数
+SEARCH_BACKGROUND_BUILD = True  # 索引重建/重新训练放到后台线程，建好后原子替换
+SEARCH_HNSW_M = 32              # HNSW每个节点的邻居数
+SEARCH_HNSW_EF_CONSTRUCTION = 200
+SEARCH_HNSW_EF_SEARCH = 128
+SEARCH_HNSW_MAX_DEAD = 0.2      # HNSW不支持删除，已删除条目超过该比例时重建索引
+SEARCH_IVF_MIN_TRAIN = 10000    # IVF索引训练所需的最少人数，之前使用flat索引
+SEARCH_IVF_NLIST = 0            # IVF聚类中心数，0为按人数自动取 4*sqrt(N)
+SEARCH_IVF_NPROBE = 32          # 检索时访问的聚类数
+SEARCH_IVF_RETRAIN_FACTOR = 4   # 人数增长到训练时的该倍数后重新训练
+SEARCH_PQ_M = 64                # PQ子空间数，需要整除特征维度
+SEARCH_PQ_NBITS = 8
+# k-reciprocal重排序(只在faiss返回的候选上计算)
+RERANK_ENABLE = False           # 各路默认是否重排序，可在ReIDTracker(rerank=...)中单独设置
+RERANK_CANDIDATES = 30          # 参与重排序的候选数K
+RERANK_K1 = 20
+RERANK_K2 = 6
+RERANK_LAMBDA = 0.3             # 原始距离所占权重
+RERANK_BUDGET_MS = 5.0          # 每次重排序的耗时预算(毫秒)
+
+# 匹配阈值，l2模式为平方L2距离上限，cosine模式为余弦相似度下限(归一化特征上 L2^2 = 2 - 2cos)
+REID_MATCH_THRESH = 0.15
+REID_MATCH_SIM = 0.925
+# 每人多样本特征，检索索引中只放质心
+EXEMPLAR_MAX = 8                # 每人最多保存的样本数(环形缓冲)
+EXEMPLAR_CANDIDATES = 5         # 质心检索取的候选数
+EXEMPLAR_AMBIGUOUS_MARGIN = 0.05  # 前两名距离差或与阈值的差小于该值时，用样本重新比对
+# 按track缓存的ReID特征
+TRACK_FEAT_TTL = 10.0           # 秒，超过该时间没有重新提取的缓存失效
+TRACK_FEAT_MAX = 512            # 最多缓存的track数，超出按LRU淘汰
+TRACK_FEAT_QUALITY_MARGIN = 0.1 # 画面质量比缓存中最好质量高出该值时重新提取
+
 # setting of qt sql
 DB_PATH = './reid.db'
 DB_NAME = 'reid_persons'
 DB_PERSON_NAME = 'reid_persons'
 DB_PERSON_FEATURE_NAME = 'reid_person_features'
+# 数据库连接配置
+DB_CONNECTION_PROFILE = 'wal'  # 'wal' | 'default'
+DB_PROFILES = {
+    # sqlite默认配置: rollback journal，每次提交都fsync
+    'default': dict(journal_mode='DELETE', synchronous='FULL', mmap_size=0, cache_size=-2000),
+    # WAL: 读写互不阻塞，synchronous=NORMAL只在checkpoint时fsync
+    'wal': dict(journal_mode='WAL', synchronous='NORMAL', mmap_size=256 * 1024 * 1024, cache_size=-64 * 1024),
+}
+DB_POOL_SIZE = 8            # 每个数据库文件的最大连接数
+DB_BUSY_TIMEOUT = 10        # 等待写锁的超时时间(秒)
+DB_STATEMENT_CACHE = 256    # 每个连接缓存的预编译语句数
+DB_FEATURE_DTYPE = 'float32'  # 特征BLOB的存储格式 'float32' | 'float16' | 'int8'，读取时按长度自动识别
+# 特征库快照(reid.db.snapshot/)，启动时memmap快照并只读取之后的增量
+GALLERY_SNAPSHOT = True
+GALLERY_SNAPSHOT_REBUILD = 1000  # 增量变更超过该条数时重新生成快照
+# 特征库异步写入(write-behind)
+DB_WRITE_BEHIND = True      # False则每次写入都在调用线程同步提交
+DB_WRITE_INTERVAL = 0.05    # 写线程合并事务的时间窗口(秒)
+DB_WRITE_BATCH = 256        # 单个事务最多合并的写操作数
+DB_WRITE_QUEUE_SIZE = 10000 # 待写队列上限，满了之后写入方阻塞等待
+DB_WRITE_CRASH_SAFE = False # True则写线程以synchronous=FULL提交，已提交的批次断电也不丢失；队列中未提交的操作仍会丢失
+DB_WRITE_RETRIES = 5        # 数据库被锁/忙时的重试次数
+DB_WRITE_RETRY_DELAY = 0.1  # 首次重试等待(秒)，之后每次加倍，最多2秒
 # setting of ISLOG
 ISLOG_common=True  # 辅助日志
 ISLOG=True         # 必要日志
@@ -7,6 +7,9 @@
 @Date    :2025/3/11 1:31
 @Describe:
 '''
+import numpy as np
+
+LOCATION_TYPES = ('outside', 'inside', 'pass_area')
 
 class area_boundary_detect():
     def __init__(self, b1, b2, b3):
@@ -68,4 +71,17 @@ class area_boundary_detect():
         elif is_pass:
             return 'pass_area' 
         return 'outside'
-    
\ No newline at end of file
+
+    def get_location_types(self, points):
+        """
+        批量判断位置类型，结果与逐点调用get_location_type一致
+        :param points: (N, 2) 坐标点
+        :return: 长度N的列表，元素为 'inside'/'outside'/'pass_area'
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = points[:, 0], points[:, 1]
+        d1 = self.A1*x + self.B1*y + self.C1
+        d2 = self.A2*x + self.B2*y + self.C2
+        d3 = self.A3*x + self.B3*y + self.C3
+        codes = np.where((d1 * self.sign1) < 0, 1, np.where((d2 * d3) < 0, 2, 0))
+        return [LOCATION_TYPES[code] for code in codes.tolist()]
@@ -0,0 +1,126 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+import torch
+import Algorithm.libs.config.model_cfgs as cfgs
+
+os.environ['YOLO_VERBOSE'] = str(cfgs.YOLO_LOG)
+
+from ultralytics import YOLO
+
+from Algorithm.libs.logger.log import get_logger
+
+log_info = get_logger(__name__)
+ISLOG = cfgs.ISLOG
+
+
+class _DetectJob(object):
+    """一次检测请求"""
+    __slots__ = ('frame', 'conf', 'iou', 'classes', 'future')
+
+    def __init__(self, frame, conf, iou, classes):
+        self.frame = frame
+        self.conf = conf
+        self.iou = iou
+        self.classes = tuple(classes) if classes is not None else None
+        self.future = Future()
+
+
+class DetectService(object):
+    """
+    进程级共享检测服务
+    - 全进程只加载一份YOLO模型
+    - 各路视频线程提交的帧在 window 秒内攒成一批，一次前向推理后把结果分发回各路
+    - 只负责检测，跟踪由各路自己的StreamTracker完成
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """单例模式获取检测服务"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = DetectService()
+        return cls._instance
+
+    def __init__(self, window=cfgs.DETECT_BATCH_WINDOW, max_batch=cfgs.DETECT_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+        if torch.cuda.is_available():
+            self.model = YOLO(cfgs.YOLO_MODEL_PATH_PT, task="detect").to(self.device)
+            model_path = cfgs.YOLO_MODEL_PATH_PT
+        else:
+            self.model = YOLO(cfgs.YOLO_MODEL_PATH, task="detect")
+            model_path = cfgs.YOLO_MODEL_PATH
+        if ISLOG:
+            log_info.info('{} shared detect model load succeed!!!'.format(model_path))
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._loop, daemon=True)
+        self._worker.start()
+
+    def detect(self, frame, conf=0.2, iou=0.4, classes=cfgs.YOLO_DEFAULT_LABEL):
+        """
+        检测单帧（与其他路的请求合并推理）
+        :return: boxes(N,4) xyxy, clss(N,), confs(N,)
+        """
+        job = _DetectJob(frame, conf, iou, classes)
+        self._queue.put(job)
+        return job.future.result()
+
+    def _collect(self):
+        """阻塞取第一帧，然后在window时间内继续收集，最多max_batch帧"""
+        jobs = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(jobs) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return jobs
+
+    def _predict(self, jobs):
+        frames = [job.frame for job in jobs]
+        args = dict(conf=jobs[0].conf, iou=jobs[0].iou, classes=list(jobs[0].classes) if jobs[0].classes else None,
+                    verbose=False)
+        if len(frames) == 1:
+            return self.model.predict(frames[0], **args)
+        try:
+            return self.model.predict(frames, **args)
+        except Exception as e:
+            # 固定batch导出的onnx不支持批量推理，退化为逐帧推理
+            if ISLOG:
+                log_info.warning('batch predict failed, fallback to single frame: {}'.format(e))
+            self.max_batch = 1
+            return [self.model.predict(frame, **args)[0] for frame in frames]
+
+    @staticmethod
+    def _dispatch(result):
+        det = result.boxes.cpu().numpy()
+        return det.xyxy, det.cls.astype(int), det.conf
+
+    def _loop(self):
+        while True:
+            jobs = self._collect()
+            # 推理参数相同的请求才能合并为一批
+            groups = {}
+            for job in jobs:
+                groups.setdefault((job.conf, job.iou, job.classes), []).append(job)
+            for group in groups.values():
+                try:
+                    results = self._predict(group)
+                    for job, result in zip(group, results):
+                        job.future.set_result(self._dispatch(result))
+                except Exception as e:
+                    for job in group:
+                        if not job.future.done():
+                            job.future.set_exception(e)
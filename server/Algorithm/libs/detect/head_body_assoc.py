@@ -0,0 +1,37 @@
+import numpy as np
+import Algorithm.libs.config.model_cfgs as cfgs
+
+
+def associate_heads_bodies(head_boxes, body_boxes, max_rel_pos=cfgs.HEAD_BODY_MAX_REL_POS):
+    """
+    头框与人体框一次性关联，N个头 x M个人体框的打分矩阵向量化计算
+    - 头框中心的x落在人体框内，且头框中心位于人体框上部 max_rel_pos 比例以内才算候选
+    - 得分 = 0.6 * 水平对齐程度 + 0.4 * 越靠近人体框顶部越高
+    - 每个头框独立取得分最高的人体框
+    :param head_boxes: (N, 4) xyxy
+    :param body_boxes: (M, 4) xyxy
+    :return: body_idx (N,) 匹配的人体框下标，没有候选为-1; scores (N,) 对应得分，没有候选为0
+    """
+    heads = np.asarray(head_boxes, dtype=np.float32).reshape(-1, 4)
+    bodies = np.asarray(body_boxes, dtype=np.float32).reshape(-1, 4)
+    body_idx = np.full(len(heads), -1, dtype=np.int64)
+    scores = np.zeros(len(heads), dtype=np.float32)
+    if len(heads) == 0 or len(bodies) == 0:
+        return body_idx, scores
+
+    head_cx = ((heads[:, 0] + heads[:, 2]) / 2)[:, None]
+    head_cy = ((heads[:, 1] + heads[:, 3]) / 2)[:, None]
+    bx1, by1, bx2, by2 = (bodies[:, i][None, :] for i in range(4))
+    width, height = bx2 - bx1, by2 - by1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_pos = (head_cy - by1) / height
+        horizontal = 1.0 - np.abs(head_cx - (bx1 + bx2) / 2) / (width / 2)
+    valid = (head_cx >= bx1) & (head_cx <= bx2) & (rel_pos <= max_rel_pos) & (width > 0) & (height > 0)
+    score = np.where(valid, horizontal * 0.6 + (1.0 - rel_pos / max_rel_pos) * 0.4, -np.inf)
+
+    best = score.argmax(axis=1)
+    best_score = score[np.arange(len(heads)), best]
+    matched = np.isfinite(best_score)
+    body_idx[matched] = best[matched]
+    scores[matched] = best_score[matched]
+    return body_idx, scores
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def _edges(points):
+    """多边形顶点 (K, 2) -> 边的起点 (K, 2) 和终点 (K, 2)，第i条边为 点i -> 点i+1"""
+    starts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return starts, np.roll(starts, -1, axis=0)
+
+
+def points_in_polygon(points, starts, ends):
+    """
+    射线法判断 (N, 2) 个点是否在多边形内，一次计算所有点和所有边
+    与shapely的contains一致，边界上的点不算在内(误差内的点可能判为在内)
+    """
+    px = points[:, 0:1]
+    py = points[:, 1:2]
+    x1, y1 = starts[:, 0][None, :], starts[:, 1][None, :]
+    x2, y2 = ends[:, 0][None, :], ends[:, 1][None, :]
+    straddle = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross_x = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    crossings = straddle & (px < cross_x)
+    inside = (crossings.sum(axis=1) % 2) == 1
+    # 边界上的点按shapely的contains规则排除
+    return inside & ~(segment_distances(points, starts, ends).min(axis=1) < 1e-9)
+
+
+def segment_distances(points, starts, ends):
+    """(N, 2) 个点到 (E,) 条线段的距离矩阵 (N, E)"""
+    seg = ends - starts
+    seg_len2 = np.einsum('ij,ij->i', seg, seg)
+    rel = points[:, None, :] - starts[None, :, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.einsum('nej,ej->ne', rel, seg) / seg_len2[None, :]
+    t = np.clip(np.nan_to_num(t, nan=0.0), 0.0, 1.0)
+    nearest = starts[None, :, :] + t[:, :, None] * seg[None, :, :]
+    return np.linalg.norm(points[:, None, :] - nearest, axis=2)
+
+
+class RegionEngine(object):
+    """
+    区域判定，每帧所有跟踪点一次向量化计算，代替逐点的shapely Point/contains/distance
+    - area: 店前区域多边形，第0条边(点0->点1)为进店线，其余边为侧边
+    - roi: 以区域重心放大 roi_scale 倍的多边形，在其中的目标才参与状态判断
+    - boundary: 可选的 area_boundary_detect，用于计算 inside/outside/pass_area
+    """
+    def __init__(self, points, roi_scale=1.3, boundary=None):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.num_edges = len(points)
+        self._area_edges = _edges(points)
+        centroid = points.mean(axis=0)
+        self._roi_edges = _edges(centroid + (points - centroid) * roi_scale)
+        self.boundary = boundary
+
+    def classify(self, points):
+        """
+        :param points: (N, 2) 目标下框中点
+        :return: in_area (N,) bool, in_roi (N,) bool, edge_dists (N, E) 到各边距离(第0列为进店线),
+                 locations (N,) 'inside'/'outside'/'pass_area'，没有boundary时为None
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        in_area = points_in_polygon(points, *self._area_edges)
+        in_roi = points_in_polygon(points, *self._roi_edges)
+        edge_dists = segment_distances(points, *self._area_edges)
+        locations = None if self.boundary is None else self.boundary.get_location_types(points)
+        return in_area, in_roi, edge_dists, locations
+
+    def edge_distances(self, point):
+        """单个点到各边的距离 (E,)"""
+        return segment_distances(np.asarray(point, dtype=np.float64).reshape(-1, 2), *self._area_edges)[0]
+
+    @staticmethod
+    def nearest_edge(edge_dists):
+        """距离最近的边: 'entry' 或 'side_k'"""
+        idx = int(np.argmin(edge_dists))
+        return 'entry' if idx == 0 else f'side_{idx - 1}'
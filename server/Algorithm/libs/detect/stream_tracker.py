@@ -0,0 +1,82 @@
+from functools import lru_cache
+import yaml
+import numpy as np
+import Algorithm.libs.config.model_cfgs as cfgs
+
+from ultralytics.trackers.track import TRACKER_MAP
+from ultralytics.utils import IterableSimpleNamespace
+from ultralytics.utils.checks import check_yaml
+
+
+@lru_cache(maxsize=None)
+def _load_tracker_cfg(tracker_cfg):
+    """解析跟踪器yaml，同一配置只读一次"""
+    with open(check_yaml(tracker_cfg), errors='ignore', encoding='utf-8') as f:
+        cfg = IterableSimpleNamespace(**yaml.safe_load(f))
+    if cfg.tracker_type not in TRACKER_MAP:
+        raise ValueError("Only 'bytetrack' and 'botsort' are supported for now, but got '{}'".format(cfg.tracker_type))
+    return cfg
+
+
+class _Detections(object):
+    """numpy检测结果，提供跟踪器需要的conf/cls/xywh/xyxy属性，支持布尔索引切片"""
+    __slots__ = ('xyxy', 'xywh', 'conf', 'cls')
+
+    def __init__(self, xyxy, xywh, conf, cls):
+        self.xyxy = xyxy
+        self.xywh = xywh
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.conf)
+
+    def __getitem__(self, idx):
+        return _Detections(self.xyxy[idx], self.xywh[idx], self.conf[idx], self.cls[idx])
+
+
+def _empty_tracks():
+    return np.zeros((0, 4), dtype=np.float32), np.zeros((0,), dtype=int), \
+        np.zeros((0,), dtype=int), np.zeros((0,), dtype=np.float32)
+
+
+class StreamTracker(object):
+    """
+    单路视频的BoT-SORT/ByteTrack跟踪器，与检测模型解耦
+    - 输入任意检测器给出的numpy检测框，跟踪状态只保存在本对象内
+    - 检测模型可以在多路之间共享，重置跟踪只清空状态而不用重新加载模型
+    """
+    def __init__(self, tracker_cfg=cfgs.YOLO_TRACKER_TYPE):
+        self.tracker_cfg = tracker_cfg
+        cfg = _load_tracker_cfg(tracker_cfg)
+        # track_id由每个跟踪器自己计数，多路之间互不影响
+        self._tracker = TRACKER_MAP[cfg.tracker_type](args=cfg)
+
+    def update(self, boxes, confs, clss, frame=None):
+        """
+        用当前帧的检测结果更新跟踪
+        :param boxes: (N, 4) xyxy
+        :param confs: (N,)
+        :param clss: (N,)
+        :param frame: 原图，BoT-SORT的相机运动补偿需要
+        :return: boxes(M,4) xyxy, track_ids(M,), clss(M,), confs(M,)
+        """
+        # 没有检测时也要更新跟踪器，丢失的轨迹才会老化，frame_id才会前进
+        xyxy = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        xywh = np.empty_like(xyxy)
+        xywh[:, 0] = (xyxy[:, 0] + xyxy[:, 2]) / 2
+        xywh[:, 1] = (xyxy[:, 1] + xyxy[:, 3]) / 2
+        xywh[:, 2] = xyxy[:, 2] - xyxy[:, 0]
+        xywh[:, 3] = xyxy[:, 3] - xyxy[:, 1]
+        detections = _Detections(xyxy, xywh,
+                                 np.asarray(confs, dtype=np.float32).reshape(-1),
+                                 np.asarray(clss, dtype=np.float32).reshape(-1))
+        # tracks: [x1, y1, x2, y2, track_id, score, cls, idx]
+        tracks = self._tracker.update(detections, frame)
+        if len(tracks) == 0:
+            return _empty_tracks()
+        return tracks[:, :4], tracks[:, 4].astype(int), tracks[:, 6].astype(int), tracks[:, 5]
+
+    def reset(self):
+        """清空跟踪状态"""
+        self._tracker.reset()
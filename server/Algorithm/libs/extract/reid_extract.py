@@ -1,11 +1,9 @@
 import cv2
 import numpy as np
 import onnxruntime as ort
-import torch
 import pdb,sys
-import torchvision.transforms as T
-from PIL import Image
 import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.extract.reid_preprocess import ReidPreprocessor
 from Algorithm.libs.logger.log import get_logger
 
 log_info = get_logger(__name__)
@@ -23,25 +21,61 @@ class ReIdExtract(object):
         input_shape = self.model_inputs[0].shape
         self.input_width = input_shape[2]
         self.input_height = input_shape[3]
-        self.transform = T.Compose([
-                            T.Resize(IN_SIZE),
-                            T.ToTensor(),
-                            T.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
-                        ])
+        # 固定batch的模型只能按固定大小分块推理，动态batch(维度为字符串/None)则一次推理
+        self.max_batch = input_shape[0] if isinstance(input_shape[0], int) and input_shape[0] > 0 else None
+        output_shape = self.session.get_outputs()[0].shape
+        self.dims = output_shape[-1] if isinstance(output_shape[-1], int) else cfgs.DIMS
+        self.preprocess = ReidPreprocessor(IN_SIZE)
         if ISLOG:
             log_info.info("{} model loaded!!! The shape is {}_{}.".format(onnx_model, self.input_width, self.input_height))
 
-    
+    def _run(self, input_var):
+        """执行推理，固定batch模型自动分块并补齐"""
+        input_name = self.model_inputs[0].name
+        if self.max_batch is None or len(input_var) == self.max_batch:
+            return self.session.run(None, {input_name: input_var})[0]
+        outputs = []
+        for start in range(0, len(input_var), self.max_batch):
+            chunk = input_var[start:start + self.max_batch]
+            num = len(chunk)
+            if num < self.max_batch:
+                pad = np.zeros((self.max_batch - num,) + chunk.shape[1:], dtype=chunk.dtype)
+                chunk = np.concatenate([chunk, pad], axis=0)
+            outputs.append(self.session.run(None, {input_name: chunk})[0][:num])
+        return np.concatenate(outputs, axis=0)
+
+    @staticmethod
+    def _crop(frame, bbox):
+        """按框裁剪，坐标截断到画面内且保证至少1个像素"""
+        height, width = frame.shape[:2]
+        x1 = min(max(int(bbox[0]), 0), width - 1)
+        y1 = min(max(int(bbox[1]), 0), height - 1)
+        x2 = max(min(int(bbox[2]), width), x1 + 1)
+        y2 = max(min(int(bbox[3]), height), y1 + 1)
+        return frame[y1:y2, x1:x2, :]
+
     def __call__(self, image_data, norm_feat=True):
-        image_data = Image.fromarray(cv2.cvtColor(image_data,cv2.COLOR_BGR2RGB))
-        img = self.transform(image_data)
-        input_var = torch.stack([img], dim=0)
-        outputs = self.session.run(None, {self.model_inputs[0].name: input_var.numpy()})
-        features = outputs[0][0]
+        input_var = self.preprocess([image_data])
+        features = self._run(input_var)[0]
         if norm_feat:
              features = features/np.linalg.norm(features)	
         return features  # output image
 
+    def extract_batch(self, frame, bboxes, norm_feat=True):
+        """
+        批量提取一帧中多个框的特征，所有框一次预处理、一次推理
+        :param frame: BGR原图
+        :param bboxes: [[x1, y1, x2, y2], ...]
+        :return: (N, dims) float32特征矩阵，norm_feat为True时每行L2归一化
+        """
+        if len(bboxes) == 0:
+            return np.zeros((0, self.dims), dtype=np.float32)
+        input_var = self.preprocess([self._crop(frame, bbox) for bbox in bboxes])
+        features = np.ascontiguousarray(self._run(input_var), dtype=np.float32)
+        if norm_feat:
+            features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+        return features
+
 if __name__ == '__main__':
     reid_detector = ReIdExtract("../models/reid.onnx", [256,128],providers=['CPUExecutionProvider'])
     img = cv2.imread("../demo.jpg")
@@ -0,0 +1,53 @@
+import threading
+import cv2
+import numpy as np
+import Algorithm.libs.config.model_cfgs as cfgs
+
+
+class ReidPreprocessor(object):
+    """
+    ReID输入预处理，纯OpenCV/NumPy实现，不依赖torch/PIL。
+    等价于 T.Resize(IN_SIZE) -> T.ToTensor() -> T.Normalize(0.5, 0.5)，
+    crop直接resize后写入预分配的NCHW float32缓冲区，BGR->RGB与归一化在写入时一次完成。
+    缓冲区按线程独立分配，多路视频线程共享同一个提取器时互不干扰。
+    """
+    # (x / 255 - 0.5) / 0.5 == x * (2 / 255) - 1
+    _SCALE = np.float32(2.0 / 255.0)
+
+    def __init__(self, in_size=cfgs.REID_IN_SIZE, max_batch=16):
+        self.height, self.width = int(in_size[0]), int(in_size[1])
+        self.max_batch = max_batch
+        self._local = threading.local()
+
+    def _buffers(self, batch_size):
+        local = self._local
+        if getattr(local, 'blob', None) is None or len(local.blob) < batch_size:
+            capacity = max(self.max_batch, 1)
+            while capacity < batch_size:
+                capacity *= 2
+            local.blob = np.empty((capacity, 3, self.height, self.width), dtype=np.float32)
+            local.resized = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        return local.blob, local.resized
+
+    def _fill(self, dst, resized, crop):
+        crop_h, crop_w = crop.shape[:2]
+        # 缩小用INTER_AREA更接近PIL带抗锯齿的双线性插值，放大用双线性
+        if crop_h >= self.height and crop_w >= self.width:
+            interpolation = cv2.INTER_AREA
+        else:
+            interpolation = cv2.INTER_LINEAR
+        cv2.resize(crop, (self.width, self.height), dst=resized, interpolation=interpolation)
+        # HWC(BGR) -> CHW(RGB) 视图，直接写入缓冲区并归一化
+        np.multiply(resized[:, :, ::-1].transpose(2, 0, 1), self._SCALE, out=dst,
+                    dtype=np.float32, casting='unsafe')
+        np.subtract(dst, np.float32(1.0), out=dst)
+
+    def __call__(self, crops):
+        """
+        :param crops: BGR uint8图像列表
+        :return: (N, 3, H, W) float32，为线程内缓冲区的视图，下一次调用前有效
+        """
+        blob, resized = self._buffers(len(crops))
+        for idx, crop in enumerate(crops):
+            self._fill(blob[idx], resized, crop)
+        return blob[:len(crops)]
@@ -0,0 +1,157 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.logger.log import get_logger
+
+log_info = get_logger(__name__)
+ISLOG = cfgs.ISLOG
+
+DROP_POLICIES = ('drop_oldest', 'drop_new')
+
+
+class ReIDJob(object):
+    """一次ReID任务，run在工作线程执行，任务被丢弃时调用on_drop"""
+    __slots__ = ('owner', 'track_id', 'run', 'on_drop', 'submitted')
+
+    def __init__(self, owner, track_id, run, on_drop=None):
+        self.owner = owner
+        self.track_id = track_id
+        self.run = run
+        self.on_drop = on_drop
+        self.submitted = time.perf_counter()
+
+
+class ReIDWorkerPool(object):
+    """
+    进程级ReID工作线程池，特征提取/检索/写库不在检测循环里同步执行
+    - 各路把进店事件的ReID任务提交到有界队列后立即返回，结果由任务自己回写TrackManager
+    - 队列满时按 drop_policy 丢弃最旧或最新的任务，排队超过 max_age 秒的任务视为过期直接丢弃
+    - stats() 返回排队深度、丢弃数、排队/执行耗时，用于观察背压
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """单例模式获取ReID工作线程池"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = ReIDWorkerPool()
+        return cls._instance
+
+    def __init__(self, num_workers=cfgs.REID_WORKERS, max_pending=cfgs.REID_QUEUE_SIZE,
+                 max_age=cfgs.REID_JOB_MAX_AGE, drop_policy=cfgs.REID_DROP_POLICY):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError("drop_policy must be one of {}, but got '{}'".format(DROP_POLICIES, drop_policy))
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.drop_policy = drop_policy
+        self._jobs = deque()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0,
+                          'dropped_full': 0, 'dropped_stale': 0, 'cancelled': 0}
+        self._wait_ms = deque(maxlen=256)
+        self._run_ms = deque(maxlen=256)
+        self._workers = [threading.Thread(target=self._loop, name='ReIDWorker-{}'.format(i), daemon=True)
+                         for i in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, owner, track_id, run, on_drop=None):
+        """
+        提交一个ReID任务
+        :param owner: 提交方(一路视频)，cancel时按它取消
+        :return: 是否进入队列(drop_new策略下队列满时为False)
+        """
+        job = ReIDJob(owner, track_id, run, on_drop)
+        dropped = None
+        with self._cond:
+            self._counters['submitted'] += 1
+            if len(self._jobs) >= self.max_pending:
+                self._counters['dropped_full'] += 1
+                if self.drop_policy == 'drop_new':
+                    dropped = job
+                else:
+                    dropped = self._jobs.popleft()
+            if dropped is not job:
+                self._jobs.append(job)
+                self._cond.notify()
+        if dropped is not None:
+            if ISLOG:
+                log_info.warning("ReID队列已满({})，丢弃track {}的任务".format(self.max_pending, dropped.track_id))
+            self._drop(dropped)
+        return dropped is not job
+
+    def cancel(self, owner):
+        """取消某一路还在排队的任务(不调用on_drop)，返回取消的数量"""
+        with self._cond:
+            keep = [job for job in self._jobs if job.owner is not owner]
+            cancelled = len(self._jobs) - len(keep)
+            self._jobs = deque(keep)
+            self._counters['cancelled'] += cancelled
+            self._cond.notify_all()
+        return cancelled
+
+    def join(self, timeout=None):
+        """等待队列中的任务全部执行完"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._jobs and self._running == 0, timeout)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats['pending'] = len(self._jobs)
+            stats['running'] = self._running
+            wait_ms, run_ms = list(self._wait_ms), list(self._run_ms)
+        stats['wait_ms_avg'] = float(np.mean(wait_ms)) if wait_ms else 0.0
+        stats['wait_ms_max'] = float(np.max(wait_ms)) if wait_ms else 0.0
+        stats['run_ms_avg'] = float(np.mean(run_ms)) if run_ms else 0.0
+        return stats
+
+    def _drop(self, job):
+        if job.on_drop is None:
+            return
+        try:
+            job.on_drop()
+        except Exception as e:
+            if ISLOG:
+                log_info.error("ReID任务丢弃回调出错: {}".format(e))
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._jobs) > 0)
+                job = self._jobs.popleft()
+                waited = time.perf_counter() - job.submitted
+                stale = waited > self.max_age
+                self._running += 1
+                if stale:
+                    self._counters['dropped_stale'] += 1
+                else:
+                    self._wait_ms.append(waited * 1000)
+            if stale:
+                if ISLOG:
+                    log_info.warning("track {}的ReID任务排队{:.2f}s已过期，丢弃".format(job.track_id, waited))
+                self._drop(job)
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+                continue
+
+            start = time.perf_counter()
+            ok = True
+            try:
+                job.run()
+            except Exception as e:
+                ok = False
+                if ISLOG:
+                    log_info.error("track {}的ReID任务出错: {}".format(job.track_id, e))
+            with self._cond:
+                self._running -= 1
+                self._counters['completed' if ok else 'failed'] += 1
+                self._run_ms.append((time.perf_counter() - start) * 1000)
+                self._cond.notify_all()
@@ -0,0 +1,127 @@
+import threading
+import numpy as np
+import Algorithm.libs.config.model_cfgs as cfgs
+
+
+class ExemplarGallery(object):
+    """
+    每个行人保存最近K个特征(环形缓冲)并在线维护质心
+    - 检索索引里每人只放一个质心，索引规模仍是每人一条
+    - 质心检索结果不明确时，再用候选人的全部样本做精细比对
+    """
+    def __init__(self, dims, max_exemplars=cfgs.EXEMPLAR_MAX, metric=cfgs.SEARCH_METRIC):
+        self.dims = dims
+        self.metric = metric
+        self.max_exemplars = max_exemplars
+        self._lock = threading.Lock()
+        self._feats = {}  # person_id -> (K, dims) 环形缓冲
+        self._count = {}  # person_id -> 累计写入的样本数
+        self._sum = {}    # person_id -> 当前样本之和
+
+    def __contains__(self, person_id):
+        return int(person_id) in self._count
+
+    def load(self, person_ids, slots, feats, counts):
+        """
+        批量加载数据库中的样本
+        :param person_ids: (M,) 每个样本所属的person_id
+        :param slots: (M,) 样本在环形缓冲中的位置
+        :param feats: (M, dims) 样本特征
+        :param counts: {person_id: 累计样本数}，用于恢复环形缓冲的写入位置
+        """
+        feats = np.asarray(feats, dtype=np.float32).reshape(-1, self.dims)
+        with self._lock:
+            self._feats.clear()
+            self._count.clear()
+            self._sum.clear()
+            for person_id, slot, feat in zip(np.asarray(person_ids).tolist(), np.asarray(slots).tolist(), feats):
+                if slot >= self.max_exemplars:
+                    continue
+                ring = self._feats.get(person_id)
+                if ring is None:
+                    ring = self._feats[person_id] = np.zeros((self.max_exemplars, self.dims), dtype=np.float32)
+                ring[slot] = feat
+            for person_id, ring in self._feats.items():
+                filled = int(np.count_nonzero(np.any(ring != 0, axis=1)))
+                self._count[person_id] = max(int(counts.get(person_id, 0)), filled)
+                self._sum[person_id] = ring.sum(axis=0, dtype=np.float64)
+
+    def _append(self, person_id, feat):
+        ring = self._feats.get(person_id)
+        if ring is None:
+            ring = np.zeros((self.max_exemplars, self.dims), dtype=np.float32)
+            self._feats[person_id] = ring
+            self._count[person_id] = 0
+            self._sum[person_id] = np.zeros(self.dims, dtype=np.float64)
+        pos = self._count[person_id] % self.max_exemplars
+        # 环形缓冲写满后覆盖最旧的样本，质心的和同步减去被覆盖的样本
+        if self._count[person_id] >= self.max_exemplars:
+            self._sum[person_id] -= ring[pos]
+        ring[pos] = feat
+        self._sum[person_id] += feat
+        self._count[person_id] += 1
+        return pos
+
+    def add(self, person_id, feat):
+        """
+        新增一个样本
+        :return: (环形缓冲中的位置, 更新后的质心)
+        """
+        feat = np.asarray(feat, dtype=np.float32).reshape(self.dims)
+        with self._lock:
+            pos = self._append(int(person_id), feat)
+            return pos, self._centroid(int(person_id))
+
+    def _centroid(self, person_id):
+        centroid = self._sum[person_id].astype(np.float32)
+        return centroid / max(np.linalg.norm(centroid), 1e-12)
+
+    def centroid(self, person_id):
+        with self._lock:
+            return self._centroid(int(person_id))
+
+    def count(self, person_id):
+        with self._lock:
+            return self._count.get(int(person_id), 0)
+
+    def exemplars(self, person_id):
+        """返回该行人当前保存的全部样本 (n, dims)"""
+        with self._lock:
+            person_id = int(person_id)
+            if person_id not in self._count:
+                return np.zeros((0, self.dims), dtype=np.float32)
+            return self._feats[person_id][:min(self._count[person_id], self.max_exemplars)].copy()
+
+    def remove(self, person_id):
+        with self._lock:
+            person_id = int(person_id)
+            self._feats.pop(person_id, None)
+            self._count.pop(person_id, None)
+            self._sum.pop(person_id, None)
+
+    def refine(self, query, candidate_ids, candidate_dists):
+        """
+        用候选人的全部样本重新比对单个查询
+        :param query: (dims,) 查询特征
+        :param candidate_ids: (M,) 质心检索得到的候选person_id，-1为空位
+        :param candidate_dists: (M,) 对应的质心距离
+        :return: (person_id, 距离)，距离取质心距离与最近样本距离中的较小值
+            cosine模式下距离为 1 - 余弦相似度
+        """
+        best_id, best_dist = -1, np.inf
+        query = np.asarray(query, dtype=np.float32).reshape(self.dims)
+        if self.metric == 'cosine':
+            query = query / max(np.linalg.norm(query), 1e-12)
+        for person_id, dist in zip(np.asarray(candidate_ids).tolist(), np.asarray(candidate_dists).tolist()):
+            if person_id == -1:
+                continue
+            exemplars = self.exemplars(person_id)
+            if len(exemplars) > 0 and self.metric == 'cosine':
+                norms = np.maximum(np.linalg.norm(exemplars, axis=1), 1e-12)
+                dist = min(dist, float(1.0 - (exemplars @ query / norms).max()))
+            elif len(exemplars) > 0:
+                diff = exemplars - query[None, :]
+                dist = min(dist, float(np.einsum('ij,ij->i', diff, diff).min()))
+            if dist < best_dist:
+                best_id, best_dist = person_id, dist
+        return best_id, best_dist
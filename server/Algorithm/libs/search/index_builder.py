@@ -0,0 +1,140 @@
+import threading
+from Algorithm.libs.logger.log import get_logger
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.search.search_engine import SearchEngine
+log_info = get_logger(__name__)
+ISLOG=cfgs.ISLOG
+ISLOG_common=cfgs.ISLOG_common
+
+
+class IndexBuilder(object):
+    """
+    在后台线程重建检索索引，建好后整体替换引用
+    - 检索只读取 engine 引用，不加锁，重建期间继续使用旧索引，不会看到建了一半的索引
+    - 重建期间的增量注册/更新/删除会记录下来，替换前在新索引上按顺序重放
+    - 每替换一次 generation 加1
+    """
+    def __init__(self, engine, background=cfgs.SEARCH_BACKGROUND_BUILD):
+        self._engine = engine
+        self.generation = 0
+        self.background = background
+        self._cond = threading.Condition(threading.RLock())
+        self._task = None       # 等待执行的重建 (loader, dims)
+        self._target = 0        # 等待中的重建完成后 _finished 的值
+        self._finished = 0      # 已完成(含失败)的重建次数
+        self._building = False
+        self._journal = None    # 重建期间的增量修改，None表示没有重建在进行
+        self._mark = 0          # 排队中的重建提交时日志的长度，之前的修改已包含在它的数据里
+        self._closed = False
+        self._thread = None
+        engine.on_retrain = self.request_retrain
+
+    @property
+    def engine(self):
+        return self._engine
+
+    def apply(self, op, person_id, *args):
+        """对当前索引做增量修改(add/update/remove)，重建期间同时记入日志"""
+        with self._cond:
+            result = getattr(self._engine, op)(person_id, *args)
+            if self._journal is not None:
+                self._journal.append((op, person_id, args))
+        return result
+
+    def rebuild(self, base_feat_lists=None, base_idx_lists=None, dims=None, loader=None, wait=False, timeout=None):
+        """
+        用新的特征重建索引
+        :param loader: 可选，在后台线程调用，返回 (base_feat_lists, base_idx_lists)
+        :param wait: 是否等待新索引替换完成
+        :return: 是否已完成替换(不等待时为False)
+        """
+        if loader is None:
+            loader = lambda: (base_feat_lists, base_idx_lists)
+        if not self.background:
+            self._run(loader, dims or self._engine.dims)
+            return True
+        target = self._submit(loader, dims)
+        if wait:
+            return self.wait(target, timeout)
+        return False
+
+    def request_retrain(self):
+        """SearchEngine判断需要重新训练时调用，用索引中的现有特征在后台重建"""
+        if not self.background:
+            self._engine.retrain()
+            return
+        with self._cond:
+            # 已有重建在进行或排队，新索引建好后会重新判断
+            if self._building or self._task is not None:
+                return
+            self._submit(None, None)
+
+    def wait(self, target=None, timeout=None):
+        """等待第target次重建完成，默认等待当前所有重建"""
+        with self._cond:
+            target = self._target if target is None else target
+            return self._cond.wait_for(lambda: self._finished >= target, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _submit(self, loader, dims):
+        with self._cond:
+            # 排队中的重建合并为一次，只保留最新的数据
+            if self._task is None:
+                self._target = self._finished + (2 if self._building else 1)
+            self._task = (loader, dims)
+            if self._journal is None:
+                self._journal = []
+            self._mark = len(self._journal)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='index-builder', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._target
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._task is not None or self._closed)
+                if self._closed:
+                    return
+                loader, dims = self._task
+                self._task = None
+                self._building = True
+            try:
+                self._run(loader, dims)
+            except Exception as e:
+                log_info.error("Search index rebuild failed, keep the old index: {}".format(e))
+                with self._cond:
+                    self._journal = self._journal[self._mark:] if self._task is not None else None
+                    self._mark = 0
+            finally:
+                with self._cond:
+                    self._building = False
+                    self._finished += 1
+                    self._cond.notify_all()
+
+    def _run(self, loader, dims):
+        old = self._engine
+        if loader is None:
+            with old._lock:
+                base_feat_lists, base_idx_lists = old._live_features()
+        else:
+            base_feat_lists, base_idx_lists = loader()
+        engine = SearchEngine(base_feat_lists, base_idx_lists, dims=dims or old.dims,
+                              index_type=old.index_type, metric=old.metric, storage=old.storage)
+        with self._cond:
+            engine.on_retrain = self.request_retrain
+            # 重放日志，每条修改都是对单个行人的整体覆盖，与快照重叠的部分重放后结果不变
+            for op, person_id, args in self._journal or ():
+                getattr(engine, op)(person_id, *args)
+            self._engine = engine
+            self.generation += 1
+            # 还有排队的重建时，保留它提交之后的修改
+            self._journal = self._journal[self._mark:] if self._task is not None else None
+            self._mark = 0
+        if ISLOG_common:
+            log_info.info("Search index swapped, generation {}. Total num is {}".format(self.generation, len(engine)))
@@ -0,0 +1,122 @@
+import numpy as np
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.search.search_engine import SearchEngine
+from Algorithm.libs.search.exemplar_gallery import ExemplarGallery
+from Algorithm.libs.search.index_builder import IndexBuilder
+from Algorithm.libs.logger.log import get_logger
+log_info = get_logger(__name__)
+ISLOG_common = cfgs.ISLOG_common
+
+
+class ReidGallery(object):
+    """
+    行人库：检索引擎 + 每人的样本集，负责匹配和增量注册/更新/删除
+    不依赖检测和特征提取模型，可以单独放在服务进程里给各路共用
+    """
+    def __init__(self, base_feat_lists, base_idx_lists, dims=1024):
+        self.dims = dims
+        self._index_builder = IndexBuilder(SearchEngine(base_feat_lists, base_idx_lists, dims=dims))
+        self._exemplars = ExemplarGallery(dims, metric=self._search_engine.metric)
+
+    @property
+    def _search_engine(self):
+        """当前生效的检索引擎，后台重建完成后整体替换"""
+        return self._index_builder.engine
+
+    @property
+    def search_generation(self):
+        return self._index_builder.generation
+
+    def __len__(self):
+        return len(self._search_engine)
+
+    def reload_search_engine(self, base_feat_lists, base_idx_lists, dims=1024, wait=False):
+        """
+        后台重建检索引擎，建好前继续使用旧索引
+        :param wait: 是否等待新索引生效
+        """
+        if ISLOG_common:
+            log_info.info("!!!reload faiss search engine")
+        return self._index_builder.rebuild(base_feat_lists, base_idx_lists, dims=dims, wait=wait)
+
+    def load_exemplars(self, person_ids, slots, feats, counts):
+        """加载数据库中每个行人的样本特征"""
+        self._exemplars.load(person_ids, slots, feats, counts)
+
+    def add_person(self, person_id, feat):
+        """
+        增量注册单个行人特征到检索引擎，同时作为该人的第一个样本
+        :return: 需要写入数据库的样本 [(slot, feat)]
+        """
+        self._exemplars.remove(person_id)
+        slot, _ = self._exemplars.add(person_id, feat)
+        self._index_builder.apply('add', person_id, feat)
+        return [(slot, feat)]
+
+    def add_exemplar(self, person_id, feat):
+        """
+        给已注册的行人增加一个样本，检索引擎中的特征更新为样本质心
+        :return: (需要写入数据库的样本 [(slot, feat)], 新的质心)，行人已不在检索引擎中时质心为None
+        """
+        writes = []
+        if person_id not in self._search_engine:
+            # 已被清理的行人不再重新注册
+            return writes, None
+        if person_id not in self._exemplars:
+            # 旧数据没有样本记录，先把当前特征作为第一个样本，避免质心突变
+            old_feat = self._search_engine.get_feature(person_id)
+            slot, _ = self._exemplars.add(person_id, old_feat)
+            writes.append((slot, old_feat))
+        slot, centroid = self._exemplars.add(person_id, feat)
+        writes.append((slot, feat))
+        self._index_builder.apply('update', person_id, centroid)
+        return writes, centroid
+
+    def update_person(self, person_id, feat):
+        """增量更新单个行人特征"""
+        self._index_builder.apply('update', person_id, feat)
+
+    def remove_person(self, person_id):
+        """从检索引擎中删除单个行人"""
+        self._exemplars.remove(person_id)
+        return self._index_builder.apply('remove', person_id)
+
+    def dist_thresh(self, thresh):
+        """cosine模式下阈值为相似度，转为检索返回的距离(1 - 相似度)"""
+        if self._search_engine.metric == 'cosine':
+            return 1.0 - thresh
+        return thresh
+
+    def search_batch(self, feats, top_k=1):
+        return self._search_engine.search_batch(feats, top_k)
+
+    def VecPair(self, Vec, thresh=0.2, similar_thresh=0.1, rerank=False):
+        search_label, search_dist = self.VecPairBatch(Vec, thresh, similar_thresh, rerank)
+        return search_label[0], search_dist[0]
+
+    def VecPairBatch(self, Vecs, thresh=0.2, similar_thresh=0.1, rerank=False):
+        """
+        批量匹配 (N, dims) 特征，一次检索
+        :param thresh: l2模式为距离上限，cosine模式为相似度下限
+        :param rerank: 是否对候选做k-reciprocal重排序
+        :return: person_ids (N,)，未匹配为-1; dists (N,)，未匹配为1.0
+        """
+        thresh = self.dist_thresh(thresh)
+        num_candidates = cfgs.EXEMPLAR_CANDIDATES
+        if rerank:
+            cand_labels, cand_dists = self._search_engine.rerank(Vecs, num_candidates)
+        else:
+            cand_labels, cand_dists = self._search_engine.search_batch(Vecs, num_candidates)
+        search_labels, search_dists = cand_labels[:, 0].copy(), cand_dists[:, 0].copy()
+
+        # 质心检索结果不明确(前两名接近，或距离在阈值附近)时，用候选人的全部样本重新比对
+        margin = cfgs.EXEMPLAR_AMBIGUOUS_MARGIN
+        ambiguous = (search_labels != -1) & (np.abs(search_dists - thresh) < margin)
+        if num_candidates > 1:
+            ambiguous |= (cand_labels[:, 1] != -1) & (cand_dists[:, 1] - cand_dists[:, 0] < margin)
+        Vecs = np.asarray(Vecs, dtype=np.float32).reshape(len(search_labels), -1)
+        for i in np.flatnonzero(ambiguous):
+            search_labels[i], search_dists[i] = self._exemplars.refine(Vecs[i], cand_labels[i], cand_dists[i])
+
+        matched = (search_labels != -1) & (search_dists < thresh)
+        return np.where(matched, search_labels, -1), np.where(matched, search_dists, 1.0)
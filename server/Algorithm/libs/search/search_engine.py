@@ -2,52 +2,378 @@ import os
 import sys
 import pdb
 import json
+import math
+import time
+import threading
 import numpy as np
-import faiss 
+import faiss
 from Algorithm.libs.logger.log import get_logger
 import Algorithm.libs.config.model_cfgs as cfgs
 log_info = get_logger(__name__)
 ISLOG=cfgs.ISLOG
 ISLOG_common=cfgs.ISLOG_common
 
-class SearchEngine(object):
-    def __init__(self, base_feat_lists, base_idx_lists, dims=1024):
-        if len(base_idx_lists) > 0:
-            base_feat_lists = base_feat_lists
-            self._index = faiss.IndexFlatL2(dims)
+INDEX_TYPES = ('flat', 'hnsw', 'ivf_flat', 'ivf_pq')
+METRICS = ('l2', 'cosine')
+STORAGES = ('float32', 'float16', 'int8')
+_SQ_TYPES = {'float16': faiss.ScalarQuantizer.QT_fp16, 'int8': faiss.ScalarQuantizer.QT_8bit}
+
+
+def _reciprocal(rank, k):
+    """rank的前k+1个近邻互为近邻的布尔矩阵 R[i, j]"""
+    n = len(rank)
+    forward = np.zeros((n, n), dtype=bool)
+    forward[np.arange(n)[:, None], rank[:, :k + 1]] = True
+    return forward & forward.T
+
+
+def k_reciprocal_rerank(query, cand_feats, k1=20, k2=6, lambda_value=0.3):
+    """
+    k-reciprocal重排序(Zhong et al. CVPR2017)，只在 query+K个候选 组成的局部近邻图上计算，
+    开销只与K有关，与特征库大小无关
+    局部图每次查询现算、不做缓存：距离按含query的列最大值归一化，排序和互近邻集合都随query变化，
+    能跨查询复用的只有候选之间的K×K距离，K=30时现算约0.07ms，比按slot查缓存还快
+    :param query: (dims,) 查询特征
+    :param cand_feats: (K, dims) 候选特征
+    :return: (K,) 重排序后的距离，越小越相似
+    """
+    feats = np.vstack([query[None, :], cand_feats]).astype(np.float32)
+    n = len(feats)
+    k1 = min(k1, n - 1)
+    k2 = max(1, min(k2, n))
+    # 局部图上两两之间的欧氏距离平方，按列最大值归一化
+    sq = np.einsum('ij,ij->i', feats, feats)
+    dist = np.maximum(sq[:, None] + sq[None, :] - 2 * feats @ feats.T, 0)
+    dist = dist / np.maximum(dist.max(axis=0, keepdims=True), 1e-12)
+    rank = np.argsort(dist, axis=1)
 
-            self._index.add(np.array(base_feat_lists))
+    # k-reciprocal近邻集合，并用半径k1/2的近邻集合扩展(重叠超过2/3才合并)
+    recip = _reciprocal(rank, k1)
+    recip_half = _reciprocal(rank, int(round(k1 / 2)))
+    overlap = recip.astype(np.float32) @ recip_half.T.astype(np.float32)
+    expand = recip & (overlap > 2.0 / 3.0 * recip_half.sum(axis=1)[None, :])
+    recip = recip | ((expand.astype(np.float32) @ recip_half.astype(np.float32)) > 0)
+
+    weight = np.where(recip, np.exp(-dist), 0).astype(np.float32)
+    weight /= np.maximum(weight.sum(axis=1, keepdims=True), 1e-12)
+    if k2 > 1:
+        # 局部查询扩展
+        weight = weight[rank[:, :k2]].mean(axis=1)
+
+    # query与每个候选的Jaccard距离
+    inter = np.minimum(weight[0][None, :], weight[1:]).sum(axis=1)
+    jaccard = 1 - inter / (2 - inter)
+    return jaccard * (1 - lambda_value) + dist[0, 1:] * lambda_value
+
+
+class SearchEngine(object):
+    """
+    特征检索引擎，支持 flat(精确) / hnsw / ivf_flat / ivf_pq 四种索引，由 cfgs.SEARCH_INDEX_TYPE 选择。
+    每条特征在faiss中以自增的slot作为id，slot与person_id的映射由引擎维护，search直接返回person_id，
+    单人注册/更新/删除无需重建整个索引。
+    - IVF类索引人数不足 SEARCH_IVF_MIN_TRAIN 时先用flat，够了之后自动训练，人数增长后自动重新训练
+    - HNSW不支持删除，删除的条目只做标记，检索时用IDSelector在图搜索中跳过，标记过多时重建
+    - metric为cosine时特征归一化后用内积检索，返回的距离为 1 - 余弦相似度，越小越相似
+    - storage为float16/int8时索引中的特征用标量量化存储，int8人数不足 SEARCH_SQ_MIN_TRAIN 时先用float32
+    """
+    def __init__(self, base_feat_lists, base_idx_lists, dims=1024, index_type=None, metric=None, storage=None):
+        self.dims = dims
+        self.index_type = index_type or cfgs.SEARCH_INDEX_TYPE
+        self.metric = metric or cfgs.SEARCH_METRIC
+        self.storage = storage or cfgs.SEARCH_STORAGE
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError("index_type must be one of {}, but got '{}'".format(INDEX_TYPES, self.index_type))
+        if self.metric not in METRICS:
+            raise ValueError("metric must be one of {}, but got '{}'".format(METRICS, self.metric))
+        if self.storage not in STORAGES:
+            raise ValueError("storage must be one of {}, but got '{}'".format(STORAGES, self.storage))
+        self._faiss_metric = faiss.METRIC_INNER_PRODUCT if self.metric == 'cosine' else faiss.METRIC_L2
+        self._lock = threading.RLock()
+        # 需要重新训练时的回调，为None时在当前线程同步重建(见IndexBuilder)
+        self.on_retrain = None
 
-            self._register_labels = base_idx_lists
+        if len(base_idx_lists) > 0:
+            base_feats = self._prepare(base_feat_lists)
+            base_ids = np.asarray(base_idx_lists, dtype='int64')
+        else:
+            base_feats = np.zeros((0, dims), dtype='float32')
+            base_ids = np.zeros((0,), dtype='int64')
+        self._build(base_feats, base_ids)
 
+        if len(base_ids) > 0:
             if ISLOG_common:
                 log_info.info(
-                "Faiss search engine load succeed!!! The dims is {}. Total num is {}".format(dims, len(base_idx_lists)))
+                "Faiss search engine load succeed!!! The dims is {}. Total num is {}. Index is {} {} {}".format(
+                    dims, len(base_ids), self._active_type, self.metric, self._active_storage))
 
         else:
             if ISLOG_common:
-                log_info.info("No feat register.Total num is {}".format(len(base_idx_lists)))
-            self._register_labels = []
+                log_info.info("No feat register.Total num is {}".format(len(base_ids)))
 
-    def search(self, query_feat, top_k=10):
-        if len(self._register_labels) == 0:
-            return [], []
+    def __len__(self):
+        return len(self._person_slot)
+
+    def __contains__(self, person_id):
+        return int(person_id) in self._person_slot
+
+    def _prepare(self, feats):
+        """转为 (N, dims) 连续float32，cosine模式下归一化(不修改调用方的数组)"""
+        feats = np.ascontiguousarray(feats, dtype='float32').reshape(-1, self.dims)
+        if self.metric == 'cosine':
+            feats = feats.copy()
+            faiss.normalize_L2(feats)
+        return feats
+
+    def _as_query(self, feat):
+        return self._prepare(feat).reshape(1, self.dims)
+
+    def _min_train(self):
+        # PQ码本训练每个中心同样需要39个样本
+        if self.index_type == 'ivf_pq':
+            return max(cfgs.SEARCH_IVF_MIN_TRAIN, 39 * (1 << cfgs.SEARCH_PQ_NBITS))
+        return cfgs.SEARCH_IVF_MIN_TRAIN
+
+    def _nlist(self, num):
+        nlist = cfgs.SEARCH_IVF_NLIST or int(4 * math.sqrt(num))
+        # 每个聚类中心至少需要39个训练样本
+        return max(1, min(nlist, num // 39))
+
+    def _new_index(self, num):
+        """按索引类型、存储类型和人数创建空索引，返回(索引, 实际类型, 实际存储)"""
+        index_type, storage, metric = self.index_type, self.storage, self._faiss_metric
+        if index_type.startswith('ivf') and num < self._min_train():
+            index_type = 'flat'
+        if index_type == 'ivf_pq':
+            storage = 'pq'
+        elif storage == 'int8' and num < cfgs.SEARCH_SQ_MIN_TRAIN:
+            # int8需要按维度统计取值范围，人数太少时先不量化
+            storage = 'float32'
+
+        if index_type == 'flat':
+            if storage == 'float32':
+                base = faiss.IndexFlat(self.dims, metric)
+            else:
+                base = faiss.IndexScalarQuantizer(self.dims, _SQ_TYPES[storage], metric)
+            return faiss.IndexIDMap2(base), index_type, storage
+        if index_type == 'hnsw':
+            if storage == 'float32':
+                hnsw = faiss.IndexHNSWFlat(self.dims, cfgs.SEARCH_HNSW_M, metric)
+            else:
+                hnsw = faiss.IndexHNSWSQ(self.dims, _SQ_TYPES[storage], cfgs.SEARCH_HNSW_M, metric)
+            hnsw.hnsw.efConstruction = cfgs.SEARCH_HNSW_EF_CONSTRUCTION
+            hnsw.hnsw.efSearch = cfgs.SEARCH_HNSW_EF_SEARCH
+            return faiss.IndexIDMap2(hnsw), index_type, storage
+
+        # IVF原生支持自定义id和删除，不需要IndexIDMap2
+        quantizer = faiss.IndexFlat(self.dims, metric)
+        nlist = self._nlist(num)
+        if index_type == 'ivf_pq':
+            index = faiss.IndexIVFPQ(quantizer, self.dims, nlist, cfgs.SEARCH_PQ_M, cfgs.SEARCH_PQ_NBITS, metric)
+        elif storage == 'float32':
+            index = faiss.IndexIVFFlat(quantizer, self.dims, nlist, metric)
         else:
-            dist_list, idx_list = self._index.search(np.array([query_feat]), top_k)
-            #print(idx_list)
-            #print(dist_list)
-            #print(f'idx:{idx_list},dist:{dist_list}')
-            # try:
-            #     label_idx = [self._register_labels[sort_e_idx] for sort_e_idx in idx_list[0]]
-            # except Exception as e:
-            #     print(str(e))
-            #     print(self._register_labels,idx_list)
-            #
-            # return label_idx, dist_list
-            return idx_list[0],dist_list[0]
-
-    ####
-    def rerank(self):
-        ## Todo
-        pass
+            index = faiss.IndexIVFScalarQuantizer(quantizer, self.dims, nlist, _SQ_TYPES[storage], metric)
+        index.nprobe = min(cfgs.SEARCH_IVF_NPROBE, nlist)
+        # 哈希表direct map支持按id reconstruct，且不影响remove_ids
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index, index_type, storage
+
+    def _build(self, feats, person_ids):
+        """用给定特征重建整个索引，需要训练的索引在这里训练"""
+        index, active_type, active_storage = self._new_index(len(person_ids))
+        if not index.is_trained:
+            index.train(feats)
+        slots = np.arange(len(person_ids), dtype='int64')
+        if len(person_ids) > 0:
+            index.add_with_ids(feats, slots)
+
+        self._index = index
+        self._active_type = active_type
+        self._active_storage = active_storage
+        # slot -> person_id 查找表，已删除的slot为-1，search时整批映射
+        self._slot_person = np.full(max(len(person_ids), 1024), -1, dtype='int64')
+        self._slot_person[:len(person_ids)] = person_ids
+        self._person_slot = dict(zip(person_ids.tolist(), slots.tolist()))
+        self._next_slot = len(person_ids)
+        self._dead = 0  # HNSW中已删除但仍留在索引里的条目数
+        self._live_params = None  # 过滤已删除条目的检索参数，slot变化时失效
+        self._trained_size = len(person_ids)
+
+    def _live_features(self):
+        """取出当前所有人的特征(IVF-PQ为有损重建)"""
+        slots = np.fromiter(self._person_slot.values(), dtype='int64', count=len(self._person_slot))
+        person_ids = np.fromiter(self._person_slot.keys(), dtype='int64', count=len(self._person_slot))
+        if len(slots) == 0:
+            return np.zeros((0, self.dims), dtype='float32'), person_ids
+        return self._reconstruct(slots), person_ids
+
+    def _reconstruct(self, slots):
+        slots = np.asarray(slots, dtype='int64')
+        if hasattr(self._index, 'reconstruct_batch'):
+            feats = self._index.reconstruct_batch(slots)
+        else:
+            feats = np.vstack([self._index.reconstruct(int(slot)) for slot in slots])
+        return np.ascontiguousarray(feats, dtype='float32')
+
+    def retrain(self, base_feat_lists=None, base_idx_lists=None):
+        """
+        重新训练/重建索引
+        不传特征时使用索引中的现有特征；IVF-PQ的现有特征是有损的，建议传入数据库中的原始特征
+        """
+        with self._lock:
+            if base_idx_lists is None:
+                feats, person_ids = self._live_features()
+            else:
+                feats = self._prepare(base_feat_lists)
+                person_ids = np.asarray(base_idx_lists, dtype='int64')
+            self._build(feats, person_ids)
+            if ISLOG_common:
+                log_info.info("Search index rebuilt. Index is {} {}. Total num is {}".format(
+                    self._active_type, self._active_storage, len(person_ids)))
+
+    def _maybe_retrain(self):
+        num = len(self._person_slot)
+        if self.index_type.startswith('ivf'):
+            if self._active_type == 'flat':
+                need = num >= self._min_train()
+            else:
+                need = num >= self._trained_size * cfgs.SEARCH_IVF_RETRAIN_FACTOR
+        else:
+            need = self._dead > 0 and self._dead > self._index.ntotal * cfgs.SEARCH_HNSW_MAX_DEAD
+        if self.storage == 'int8' and self._active_storage == 'float32' and num >= cfgs.SEARCH_SQ_MIN_TRAIN:
+            need = True
+        if need:
+            if self.on_retrain is not None:
+                self.on_retrain()
+            else:
+                self.retrain()
+
+    def _remove_slot(self, person_id):
+        slot = self._person_slot.pop(person_id)
+        self._slot_person[slot] = -1
+        if self._active_type == 'hnsw':
+            self._dead += 1
+            self._live_params = None
+        else:
+            self._index.remove_ids(np.array([slot], dtype='int64'))
+
+    def add(self, person_id, feat):
+        """注册单个行人特征，已存在则覆盖"""
+        with self._lock:
+            person_id = int(person_id)
+            if person_id in self._person_slot:
+                self._remove_slot(person_id)
+            slot = self._next_slot
+            self._next_slot += 1
+            if slot >= len(self._slot_person):
+                self._slot_person = np.concatenate(
+                    [self._slot_person, np.full(len(self._slot_person), -1, dtype='int64')])
+            self._index.add_with_ids(self._as_query(feat), np.array([slot], dtype='int64'))
+            self._slot_person[slot] = person_id
+            self._person_slot[person_id] = slot
+            self._live_params = None
+            self._maybe_retrain()
+
+    def remove(self, person_id):
+        """删除单个行人特征，返回是否删除成功"""
+        with self._lock:
+            person_id = int(person_id)
+            if person_id not in self._person_slot:
+                return False
+            self._remove_slot(person_id)
+            self._maybe_retrain()
+            return True
+
+    def update(self, person_id, feat):
+        """更新单个行人特征"""
+        self.add(person_id, feat)
+
+    def get_feature(self, person_id):
+        """取出单个行人在索引中的特征(IVF-PQ为有损重建)"""
+        with self._lock:
+            return self._reconstruct([self._person_slot[int(person_id)]])[0]
+
+    def _hnsw_params(self):
+        """HNSW检索参数，有已删除条目时带上有效slot的位图，图搜索时直接跳过，不需要多取再过滤"""
+        if self._live_params is None:
+            if self._dead > 0:
+                live = np.packbits(self._slot_person[:self._next_slot] >= 0, bitorder='little')
+                sel = faiss.IDSelectorBitmap(self._next_slot, faiss.swig_ptr(live))
+                params = faiss.SearchParametersHNSW(sel=sel)
+                # faiss只保存指针，位图和selector要跟params一起保留
+                self._live_params = (params, sel, live)
+            else:
+                self._live_params = (None,)
+        return self._live_params[0]
+
+    def search_batch(self, query_feats, top_k=10):
+        """
+        批量检索最近邻，一次faiss调用完成所有查询
+        :param query_feats: (N, dims) 查询特征
+        :return: person_ids (N, top_k) int64，不足top_k的位置为-1; dists (N, top_k) float32，对应位置为inf
+        """
+        queries = self._prepare(query_feats)
+        person_ids = np.full((len(queries), top_k), -1, dtype='int64')
+        dists = np.full((len(queries), top_k), np.inf, dtype='float32')
+        if len(queries) == 0:
+            return person_ids, dists
+        with self._lock:
+            if len(self._person_slot) == 0:
+                return person_ids, dists
+            k = min(top_k, self._index.ntotal)
+            params = None
+            if self._active_type == 'hnsw':
+                ef_search = max(cfgs.SEARCH_HNSW_EF_SEARCH, k)
+                faiss.downcast_index(self._index.index).hnsw.efSearch = ef_search
+                params = self._hnsw_params()
+                if params is not None:
+                    params.efSearch = ef_search
+            dist_mat, slot_mat = self._index.search(queries, k, params=params)
+            if self.metric == 'cosine':
+                # 内积(相似度)转为距离，保持越小越相似
+                dist_mat = 1.0 - dist_mat
+            found = np.where(slot_mat >= 0, self._slot_person[np.maximum(slot_mat, 0)], -1)
+
+        person_ids[:, :k] = found[:, :k]
+        dists[:, :k] = np.where(found[:, :k] >= 0, dist_mat[:, :k], np.inf)
+        return person_ids, dists
+
+    def search(self, query_feat, top_k=10):
+        """
+        检索单个特征的最近邻
+        :return: (person_id列表, 距离列表)
+        """
+        person_ids, dists = self.search_batch(self._as_query(query_feat), top_k)
+        valid = person_ids[0] != -1
+        return person_ids[0][valid], dists[0][valid]
+
+    def rerank(self, query_feats, top_k=1, num_candidates=None, budget_ms=None):
+        """
+        先用faiss取每个查询的前num_candidates个候选，再做k-reciprocal重排序
+        :param budget_ms: 整批重排序的耗时预算，超出后剩余查询直接使用faiss原始排序
+        :return: 与search_batch相同，距离仍为原始L2距离，便于沿用匹配阈值
+        """
+        num_candidates = num_candidates or cfgs.RERANK_CANDIDATES
+        budget_ms = cfgs.RERANK_BUDGET_MS if budget_ms is None else budget_ms
+        queries = self._prepare(query_feats)
+        start = time.perf_counter()
+        with self._lock:
+            cand_ids, cand_dists = self.search_batch(queries, max(num_candidates, top_k))
+            cand_slots = [[self._person_slot[pid] for pid in row if pid != -1] for row in cand_ids.tolist()]
+            cand_feats = [self._reconstruct(slots) if len(slots) > 1 else None for slots in cand_slots]
 
+        person_ids, dists = cand_ids[:, :top_k].copy(), cand_dists[:, :top_k].copy()
+        for i, feats in enumerate(cand_feats):
+            if feats is None:
+                continue
+            if (time.perf_counter() - start) * 1000 > budget_ms:
+                if ISLOG:
+                    log_info.warning("rerank over budget {}ms, {} queries use faiss order".format(
+                        budget_ms, len(cand_feats) - i))
+                break
+            num = len(feats)
+            order = np.argsort(k_reciprocal_rerank(queries[i], feats, cfgs.RERANK_K1, cfgs.RERANK_K2,
+                                                   cfgs.RERANK_LAMBDA), kind='stable')[:top_k]
+            person_ids[i, :len(order)] = cand_ids[i, :num][order]
+            dists[i, :len(order)] = cand_dists[i, :num][order]
+        return person_ids, dists
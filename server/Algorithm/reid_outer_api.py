@@ -11,7 +11,7 @@ from collections import defaultdict
 import numpy as np
 from Algorithm.libs.extract.reid_extract import ReIdExtract
 from Algorithm.libs.detect.yolo_detector import YoloDetect
-from Algorithm.libs.search.search_engine import SearchEngine
+from Algorithm.libs.search.reid_gallery import ReidGallery
 import Algorithm.libs.config.model_cfgs as cfgs
 from Algorithm.libs.logger.log import get_logger
 from GUI.libs.reid_sqlV2 import delete_feature
@@ -36,7 +36,11 @@ class ReidPipeline(object):
     Pipeline to process reid.
     """
 
-    def __init__(self, base_feat_lists, base_idx_lists, dims=1024, target_class="person", device_info="cpu"):
+    def __init__(self, base_feat_lists, base_idx_lists, dims=1024, target_class="person", device_info="cpu",
+                 gallery=None):
+        """
+        :param gallery: 共用的ReidGallery，为None时用base_feat_lists/base_idx_lists新建
+        """
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
         self._target_class = target_class
@@ -45,7 +49,7 @@ class ReidPipeline(object):
         self.base_feat_lists = base_feat_lists
         self.base_idx_lists = base_idx_lists
         self.dims = dims
-        self._search_engine = SearchEngine(base_feat_lists, base_idx_lists, dims=dims)
+        self.gallery = gallery if gallery is not None else ReidGallery(base_feat_lists, base_idx_lists, dims=dims)
         self.track_method = cfgs.YOLO_TRACKER_TYPE
         if self._target_class == "person":
             self._input_size = [256, 128]
@@ -82,10 +86,33 @@ class ReidPipeline(object):
             elif "gpu" in self._device_info.lower():
                 self._extractor = ReIdExtract(self._target_class, extractor_path, self._input_size, providers=['CUDAExecutionProvider'])
 
-    def reload_search_engine(self, base_feat_lists, base_idx_lists, dims=1024):
-        if ISLOG_common:
-            log_info.info("!!!reload faiss search engine")
-        self._search_engine = SearchEngine(base_feat_lists, base_idx_lists, dims=dims)
+    # 行人库相关的接口都转给self.gallery
+    @property
+    def _search_engine(self):
+        """当前生效的检索引擎，后台重建完成后整体替换"""
+        return self.gallery._search_engine
+
+    @property
+    def search_generation(self):
+        return self.gallery.search_generation
+
+    def reload_search_engine(self, base_feat_lists, base_idx_lists, dims=1024, wait=False):
+        return self.gallery.reload_search_engine(base_feat_lists, base_idx_lists, dims=dims, wait=wait)
+
+    def load_exemplars(self, person_ids, slots, feats, counts):
+        self.gallery.load_exemplars(person_ids, slots, feats, counts)
+
+    def add_person(self, person_id, feat):
+        return self.gallery.add_person(person_id, feat)
+
+    def add_exemplar(self, person_id, feat):
+        return self.gallery.add_exemplar(person_id, feat)
+
+    def update_person(self, person_id, feat):
+        self.gallery.update_person(person_id, feat)
+
+    def remove_person(self, person_id):
+        return self.gallery.remove_person(person_id)
 
 
     def detect(self, img, class_idx_list, format='image', is_track=False):
@@ -115,20 +142,27 @@ class ReidPipeline(object):
     def extract(self, img):
         _each_img_norm_feat = self._extractor(img)
         return _each_img_norm_feat
+
+    def extract_batch(self, img, bboxs):
+        """一次推理提取多个框的特征，返回(N, dims)矩阵"""
+        return self._extractor.extract_batch(img, bboxs)
     
     def search(self, img, bboxs, thresh=0.2):
         search_labels_list, search_dist_list = [], []
         before_sort_list = []
         filter_box_list = []
-        for bbox in bboxs:
-            _each_crop_img = img[int(bbox[1]):int(bbox[3]),int(bbox[0]):int(bbox[2]),:]
-            _each_img_norm_feat = self._extractor(_each_crop_img)
-            search_labels, search_dist = self._search_engine.search(_each_img_norm_feat, 1)
-            if search_dist[0] <= thresh:
-                search_labels_list.append(search_labels[0])
-                search_dist_list.append(search_dist[0])
+        if len(bboxs) == 0:
+            return search_labels_list, search_dist_list, filter_box_list, before_sort_list
+        _batch_norm_feat = self._extractor.extract_batch(img, bboxs)
+        # 所有框一次检索
+        search_labels, search_dists = self._search_engine.search_batch(_batch_norm_feat, 1)
+        thresh = self._dist_thresh(thresh)
+        for bbox, search_label, search_dist in zip(bboxs, search_labels[:, 0], search_dists[:, 0]):
+            if search_label != -1 and search_dist <= thresh:
+                search_labels_list.append(search_label)
+                search_dist_list.append(search_dist)
                 filter_box_list.append(bbox)
-                before_sort_list.append(search_labels[0])
+                before_sort_list.append(search_label)
             else:
                 before_sort_list.append("unknown")
         return search_labels_list, search_dist_list, filter_box_list, before_sort_list
@@ -136,12 +170,14 @@ class ReidPipeline(object):
     def reset_track(self):
         self._detector.reset_track()
 
-    def VecPair(self, Vec, thresh=0.2,similar_thresh=0.1):
-        search_label, search_dist = self._search_engine.search(Vec, 1)
-        if search_dist == [] or search_dist[0] >= thresh:
-            return -1, 1.0
-        else:
-            return search_label[0], search_dist[0]
+    def _dist_thresh(self, thresh):
+        return self.gallery.dist_thresh(thresh)
+
+    def VecPair(self, Vec, thresh=0.2,similar_thresh=0.1, rerank=False):
+        return self.gallery.VecPair(Vec, thresh, similar_thresh, rerank)
+
+    def VecPairBatch(self, Vecs, thresh=0.2, similar_thresh=0.1, rerank=False):
+        return self.gallery.VecPairBatch(Vecs, thresh, similar_thresh, rerank)
 
     def SingleExtract(self, img, bbox):
         _each_crop_img = img[int(bbox[1]):int(bbox[3]),int(bbox[0]):int(bbox[2]),:]
@@ -12,21 +12,32 @@ import queue
 import threading
 import time
 import uuid
+from collections import Counter
 import cv2
 
+import Algorithm.libs.config.model_cfgs as cfgs
 from libs.rtsp_check import is_img_not_valid
+from libs.frame_ring import FrameRing
+from libs.mjpeg_hub import MjpegHub
+
+# 帧环在队列长度之外多留的槽位数: 分析线程一帧，原始画面推流编码中/待编码各一帧，解码线程正在写一帧
+FRAME_RING_EXTRA = 4
+# 最后一个订阅方离开后解码再保留的秒数，检测完马上打开预览时不用重新连接摄像头
+SOURCE_LINGER = 5.0
+# 订阅方类型
+SOURCE_HOLDERS = ('preview', 'analysis', 'snapshot')
 
 class RTSPData:
     """
     RTSPData RTSP流数据实例化
     """
-    def __init__(self ,rtsp_url,max_num=10,name=''):
+    def __init__(self ,rtsp_url,max_num=10,name='',stream_id=None):
 
         # 创建链接
         self.cap=cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 5)  # 设置缓冲区大小
         self.rtsp_url=rtsp_url
-        self.stream_id=str(uuid.uuid4()) # rtsp流的指代ip
+        self.stream_id=stream_id or str(uuid.uuid4()) # rtsp流的指代ip，由SourceRegistry创建时同一URL保持不变
 
         # 是否需要图片
         self.is_need_screen_img = False  # 是否需要图片，后面分析的时候会为True,然后拿取分析的时候的第一帧
@@ -41,12 +52,14 @@ class RTSPData:
         # 绑定到该事件循环
         asyncio.set_event_loop(self.mainloop)
 
-        self._rtsp_2_frames_thread()
         self.name=name
 
         self.origin_frame_queue=queue.Queue(maxsize=max_num)
         # self.process_frame_queue=queue.Queue(maxsize=max_num)
         self.process_frame_queue=asyncio.Queue(maxsize=max_num)
+        # MJPEG广播：原始画面由解码线程发布，标注画面由分析线程在有订阅时发布，每帧只编码一次
+        self.raw_hub = MjpegHub(name='raw-' + self.stream_id)
+        self.annotated_hub = MjpegHub(name='annotated-' + self.stream_id)
 
         # 是否更新resize
         self.is_resize = False
@@ -60,6 +73,13 @@ class RTSPData:
             print(self.min_width_px, new_h)
             self.is_resize = True
 
+        # 预分配的帧缓冲环：队列里的帧 + 分析/推流各自正在处理的帧；进程模式下放在共享内存里给分析进程直接读
+        self.frame_ring = FrameRing((self.height, self.width, 3), max_num + FRAME_RING_EXTRA,
+                                    shared=cfgs.ANALYSIS_MODE == 'process')
+        self._raw_frame = None  # 需要resize时原始分辨率的解码缓冲，同样复用
+
+        # 队列和帧环都准备好后再启动解码线程
+        self._rtsp_2_frames_thread()
 
 
     def _get_screen_frame(self):
@@ -85,38 +105,69 @@ class RTSPData:
     def _rtsp_2_frames_thread(self):
 
         def  _rtsp_2_frames():
-            while not self.stop_event.is_set():
-                ret, frame = self.cap.read()
-                if ret:
-                    try:
-                        # print('frame2',str(self.origin_frame_queue.qsize()))
-                        # cv2.imshow('frame2', frame)
-                        # cv2.waitKey(1)
-                        # 跨线程异步写入队列
-
-                        #asyncio.run_coroutine_threadsafe(self.origin_frame_queue.put(frame),self.mainloop)
-                       # await self.origin_frame_queue.put(frame, block=False)
-                       # print(f'rtsp:{self.rtsp_url} 压入一个frame，当前大小：{self.origin_frame_queue.qsize()}')
-                        if self.is_resize:
-                            frame = cv2.resize(frame, (self.width, self.height))
-                        self.origin_frame_queue.put(frame, block=False)
-
-                    except queue.Full:
-
-                        # _= asyncio.run_coroutine_threadsafe(self.origin_frame_queue.get(),self.mainloop)
-                        _=self.origin_frame_queue.get()
-                        pass  # 忽略队列满的情况
+            try:
+                while not self.stop_event.is_set():
+                    ret, frame = self._read_frame()
+                    if ret:
+                        # 有人看原始画面时交给广播编码，编码完归还槽位；没人看时publish直接归还
+                        self.raw_hub.publish(self.frame_ring.retain(frame), self.release_frame)
+                        # 队列满时丢弃最旧的一帧并归还槽位
+                        try:
+                            self.origin_frame_queue.put(frame, block=False)
+                        except queue.Full:
+                            try:
+                                self.release_frame(self.origin_frame_queue.get(block=False))
+                            except queue.Empty:
+                                pass
+                            try:
+                                self.origin_frame_queue.put(frame, block=False)
+                            except queue.Full:
+                                self.release_frame(frame)
 
-                else:
-                    print("RTSP读取失败，尝试重连...")
-                    break
-            self.cap.release()
+                    else:
+                        print("RTSP读取失败，尝试重连...")
+                        break
+            finally:
+                # 读流失败退出时也要标记为已停止，SourceRegistry.acquire会重建，分析循环也随之退出
+                self.stop_event.set()
+                self.cap.release()
+                self.raw_hub.close()
+                self.annotated_hub.close()
+                self.frame_ring.close()
         # 启动同步采集线程
         threading.Thread(target=_rtsp_2_frames,daemon=True).start()
         #asyncio.run_coroutine_threadsafe(_rtsp_2_frames(), self.mainloop)
         # thread=threading.Thread(target=_rtsp_2_frames)
         # thread.start()
 
+    def _read_frame(self):
+        """解码一帧，直接写进帧环的槽位，返回 (ret, frame)"""
+        buf = self.frame_ring.acquire()
+        if self.is_resize:
+            ret, raw = self.cap.read(self._raw_frame)
+            if ret:
+                self._raw_frame = raw
+                cv2.resize(raw, (self.width, self.height), dst=buf)
+                return True, buf
+        else:
+            ret, frame = self.cap.read(buf)
+            if ret and frame is buf:
+                return True, buf
+            if ret:
+                # 流的分辨率变了，OpenCV另分配了数组，这一帧不走帧环
+                self.release_frame(buf)
+                return True, frame
+        self.release_frame(buf)
+        return False, None
+
+    def close(self):
+        """停止解码线程，线程退出时释放VideoCapture并结束推流"""
+        self.stop_event.set()
+
+    def release_frame(self, frame):
+        """从origin_frame_queue取出的帧用完后调用，归还帧环槽位"""
+        self.frame_ring.release(frame)
+
     async def _async_put_frame(self, frame):
         """异步队列写入方法"""
         try:
@@ -130,6 +181,111 @@ class RTSPData:
             await self.origin_frame_queue.put(frame)
 
 
+class SourceRegistry:
+    """
+    按URL管理RTSPData，同一个摄像头只打开一次、只有一个解码循环
+    - 预览/分析/截图通过 acquire/release 按类型引用计数
+    - 最后一个订阅方离开 SOURCE_LINGER 秒后关闭解码；解码线程因断流退出后，下次acquire重新打开
+    - 同一URL重新打开时沿用原来的stream_id，前端已拿到的推流地址仍然有效
+    - 分析结果队列也按URL保存、重新打开时沿用，WebSocket可以在分析开始前连上，重开后也不会卡在旧队列上
+    - sources 是 URL -> RTSPData 的字典，只包含正在解码的源，可直接当作原来的rtsp_datas使用
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """单例模式获取视频源注册表"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = SourceRegistry()
+        return cls._instance
+
+    def __init__(self, linger=SOURCE_LINGER):
+        self.linger = linger
+        self.sources = {}
+        self._holders = {}
+        self._stream_ids = {}
+        self._result_queues = {}
+        self._timers = {}
+        self._lock = threading.RLock()
+
+    def acquire(self, rtsp_url, holder, **kwargs):
+        """
+        获取(必要时打开)rtsp_url对应的RTSPData，并给holder类型的引用加一
+        :param kwargs: 首次打开时传给RTSPData的参数
+        """
+        if holder not in SOURCE_HOLDERS:
+            raise ValueError("holder must be one of {}, but got '{}'".format(SOURCE_HOLDERS, holder))
+        with self._lock:
+            timer = self._timers.pop(rtsp_url, None)
+            if timer is not None:
+                timer.cancel()
+            rtsp_data = self.sources.get(rtsp_url)
+            if rtsp_data is None or rtsp_data.stop_event.is_set():
+                rtsp_data = RTSPData(rtsp_url, stream_id=self._stream_ids.get(rtsp_url), **kwargs)
+                rtsp_data.process_frame_queue = self.result_queue(rtsp_url)
+                self.sources[rtsp_url] = rtsp_data
+                self._stream_ids[rtsp_url] = rtsp_data.stream_id
+                self._holders.setdefault(rtsp_url, Counter())
+                print(f'打开视频源: {rtsp_url}')
+            self._holders[rtsp_url][holder] += 1
+            return rtsp_data
+
+    def release(self, rtsp_url, holder):
+        """holder类型的引用减一，全部归零后延迟关闭解码"""
+        with self._lock:
+            holders = self._holders.get(rtsp_url)
+            if holders is None or holders[holder] <= 0:
+                return
+            holders[holder] -= 1
+            if sum(holders.values()) > 0:
+                return
+            if self.linger > 0:
+                timer = threading.Timer(self.linger, self._teardown, args=(rtsp_url, self.sources.get(rtsp_url)))
+                timer.daemon = True
+                self._timers[rtsp_url] = timer
+                timer.start()
+            else:
+                self._teardown(rtsp_url, self.sources.get(rtsp_url))
+
+    def _teardown(self, rtsp_url, rtsp_data):
+        with self._lock:
+            # 延迟期间又被acquire或已经换成新的实例时不关闭
+            if rtsp_data is None or self.sources.get(rtsp_url) is not rtsp_data:
+                return
+            if sum(self._holders.get(rtsp_url, Counter()).values()) > 0:
+                return
+            self._timers.pop(rtsp_url, None)
+            del self.sources[rtsp_url]
+            self._holders.pop(rtsp_url, None)
+        rtsp_data.close()
+        print(f'关闭视频源: {rtsp_url}')
+
+    def get(self, rtsp_url):
+        """正在解码的RTSPData，没有返回None"""
+        with self._lock:
+            return self.sources.get(rtsp_url)
+
+    def stream_id(self, rtsp_url):
+        with self._lock:
+            return self._stream_ids.get(rtsp_url)
+
+    def result_queue(self, rtsp_url, max_num=10):
+        """rtsp_url的分析结果队列，没有时新建；源关闭/重开都不变"""
+        with self._lock:
+            result_queue = self._result_queues.get(rtsp_url)
+            if result_queue is None:
+                result_queue = self._result_queues[rtsp_url] = asyncio.Queue(maxsize=max_num)
+            return result_queue
+
+    def holders(self, rtsp_url):
+        """各类型订阅方的引用数"""
+        with self._lock:
+            return dict(self._holders.get(rtsp_url, {}))
+
+
 class HandleRTSPData:
     """已处理的RTSP流信息"""
     def __init__(self,rtsp_url='',frame_url='',mjpeg_stream='',mjpeg_url='',name='hello',stream_id=''):
@@ -343,8 +343,8 @@ class ReIDTracker:
                                               base_idx_lists=self.base_idx_lists, dims=1280)
         else:
             self.reid_pipeline.reload_search_engine(
-                base_feat_lists=np.array(self.base_feat_lists),
-                base_idx_lists=list(self.base_idx_lists),
+                base_feat_lists=self.base_feat_lists,
+                base_idx_lists=self.base_idx_lists,
                 dims=1280
             )
 
@@ -460,26 +460,28 @@ class ReIDTracker:
         self.base_feat_lists, self.base_idx_lists = load_features_from_sqlite(self.db_path, cfgs.DB_NAME, dims=1280)
         print(f'根据数据库中内容，加载行人数量{len(self.base_feat_lists)}')
         self.reid_pipeline.reload_search_engine(
-            base_feat_lists=np.array(self.base_feat_lists),
-            base_idx_lists=list(self.base_idx_lists),
+            base_feat_lists=self.base_feat_lists,
+            base_idx_lists=self.base_idx_lists,
             dims=1280
         )
         print("搜索引擎已重新加载")
 
-    def process_frame(self, frame=None, skip_frames=2, match_thresh=0.15, is_track=True):
+    def process_frame(self, frame=None, skip_frames=2, match_thresh=None, is_track=True):
         """
         处理单帧图像
 
         参数:
             frame: 要处理的帧，如果为None则从已打开的视频源读取
             skip_frames: 跳帧数
-            match_thresh: 匹配阈值
+            match_thresh: 匹配阈值，l2模式为距离上限，cosine模式为相似度下限；None时按SEARCH_METRIC取配置默认值
             is_track: 是否进行跟踪
 
         返回:
             output_frame: 处理后的帧
             info: 包含当前帧处理信息的字典
         """
+        if match_thresh is None:
+            match_thresh = cfgs.REID_MATCH_SIM if cfgs.SEARCH_METRIC == 'cosine' else cfgs.REID_MATCH_THRESH
         # 如果没有提供帧且有视频源，则从视频源读取
         if frame is None:
             if not hasattr(self, 'cap') or self.cap is None:
@@ -871,7 +873,6 @@ class ReIDTracker:
         Res = -1  # 默认为新人员
 
         if event_type == 'enter':
-            self.re_load_search_engine()
             if conf > 0.8:
                 # ReID处理
                 if not track_info.is_reid:
@@ -894,57 +895,20 @@ class ReIDTracker:
                             quality=quality_score + conf * 0.5
                         )
                         self.qualityl[track_id] = quality_score + conf * 0.5
-                        self.base_feat_lists.append(_feat_list)
-                        self.base_idx_lists.append(self.people_count)
                         add_feature(self.db_path, self.people_count, np.array([_feat_list]))
-                        self.reid_pipeline.reload_search_engine(
-                            base_feat_lists=np.array(self.base_feat_lists),
-                            base_idx_lists=list(self.base_idx_lists),
-                            dims=1280
-                        )
-                        self.pre = get_max_person_id(self.db_path)
+                        # 增量注册到检索引擎，无需重新读库和重建索引
+                        self.reid_pipeline.add_person(self.people_count, _feat_list)
+                        self.pre = self.people_count
                         print(f'当前行人库中的行人数量：{self.pre}')
                     else:
-                        # 匹配到已有人员
-                        # 检查Res索引是否有效
-                        if Res >= 0 and Res < len(self.base_idx_lists):
-                            person_id = self.base_idx_lists[Res]
-                            print(f"Track {track_id} 匹配到已有人员 {person_id}，距离: {dist:.2f}")
-                            if track_info.person_id != -1 and dist < match_thresh - 0.05:
-                                self.track_manager.update_track_info(
-                                    track_id,
-                                    person_id=self.base_idx_lists[Res],
-                                    feature=_feat_list
-                                )
-                            self.track_manager.update_track_info(
-                                track_id,
-                                person_id=self.base_idx_lists[Res],
-                                feature=_feat_list
-                            )
-                        else:
-                            print(f"警告：Res={Res}，超出base_idx_lists范围（长度={len(self.base_idx_lists)}）")
-                            # 将Res重置为-1，视为新人员
-                            Res = -1
-                            # 新人员处理逻辑
-                            self.people_count += 1
-                            self.track_manager.update_track_info(
-                                track_id,
-                                person_id=self.people_count,
-                                feature=_feat_list,
-                                is_reid=True,
-                                quality=quality_score + conf * 0.5
-                            )
-                            self.qualityl[track_id] = quality_score + conf * 0.5
-                            self.base_feat_lists.append(_feat_list)
-                            self.base_idx_lists.append(self.people_count)
-                            add_feature(self.db_path, self.people_count, np.array([_feat_list]))
-                            self.reid_pipeline.reload_search_engine(
-                                base_feat_lists=np.array(self.base_feat_lists),
-                                base_idx_lists=list(self.base_idx_lists),
-                                dims=1280
-                            )
-                            self.pre = get_max_person_id(self.db_path)
-                            print(f'当前行人库中的行人数量：{self.pre}')
+                        # 匹配到已有人员，VecPair直接返回person_id
+                        person_id = int(Res)
+                        print(f"Track {track_id} 匹配到已有人员 {person_id}，距离: {dist:.2f}")
+                        self.track_manager.update_track_info(
+                            track_id,
+                            person_id=person_id,
+                            feature=_feat_list
+                        )
                 else:
                     quality = quality_score + conf * 0.5
                     if quality > self.qualityl[track_id] + 0.1:
@@ -962,6 +926,7 @@ class ReIDTracker:
                         # 如果已经匹配到人物ID，更新特征
                         if track_info.person_id != -1:
                             update_feature(self.db_path, track_info.person_id, _feat_list)
+                            self.reid_pipeline.update_person(track_info.person_id, _feat_list)
 
             # 获取最新的track_info信息
             track_info = self.track_manager.get_track_info(track_id)
@@ -1063,17 +1028,10 @@ class ReIDTracker:
                     conn.commit()
                     print(f"已清理 {len(timeout_ids)} 条过期特征记录")
 
-                    # 重新加载特征库
-                    self.base_feat_lists, self.base_idx_lists = load_features_from_sqlite(
-                        self.db_path, cfgs.DB_NAME, dims=1280
-                    )
-                    if len(self.base_feat_lists) > 0:
-                        self.reid_pipeline.reload_search_engine(
-                            base_feat_lists=np.array(self.base_feat_lists),
-                            base_idx_lists=list(self.base_idx_lists),
-                            dims=1280
-                        )
-                    print(f'重新加载特征库完成，当前行人数量: {len(self.base_feat_lists)}')
+                    # 从检索引擎中增量删除过期特征
+                    for person_id in timeout_ids:
+                        self.reid_pipeline.remove_person(person_id)
+                    print(f'已从检索引擎移除 {len(timeout_ids)} 个过期行人')
 
         except Exception as e:
             print(f"清理特征库时出错: {e}")
@@ -1114,7 +1072,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='ReID 跟踪系统')
     parser.add_argument('--video_paths', type=str, nargs='+', help='多个视频文件路径或RTSP流地址，以空格分隔')
     parser.add_argument('--skip_frames', type=int, default=2, help='跳帧数量')
-    parser.add_argument('--match_thresh', type=float, default=0.15, help='匹配阈值')
+    parser.add_argument('--match_thresh', type=float, default=None, help='匹配阈值，不指定时按SEARCH_METRIC取配置默认值')
     parser.add_argument('--save_video', action='store_true', help='是否保存处理后的视频')
     parser.add_argument('--clear_db', action='store_true', help='是否清空数据库')
     parser.add_argument('--config', type=str, default='v1.json', help='配置文件路径')
@@ -31,13 +31,19 @@ from Algorithm.libs.IDdata.IDDict import IDDict
 import Algorithm.libs.config.model_cfgs as cfgs
 import sqlite3
 from ultralytics.utils.plotting import Annotator, colors
+from libs.roi_render import RoiRenderCache, text_size
 from libs.reid_sqlV2 import init_db, add_feature, update_feature, delete_feature, load_features_from_sqlite, \
-    get_max_person_id, clear_all_features, _get_connection_context
+    get_max_person_id, clear_all_features, _get_connection_context, flush_features
+from libs.gallery_service import GalleryService
 from body_quality import BodyCompletenessDetector
 from Algorithm.libs.IDdata.TrackManager import TrackManager, TrackInfo
-from shapely.geometry import Point, LineString, Polygon
+from Algorithm.libs.IDdata.TrackFeatureCache import TrackFeatureCache
 
-from ultralytics import YOLO
+from Algorithm.libs.detect.detect_service import DetectService
+from Algorithm.libs.detect.stream_tracker import StreamTracker
+from Algorithm.libs.detect.head_body_assoc import associate_heads_bodies
+from Algorithm.libs.detect.region_engine import RegionEngine
+from Algorithm.libs.extract.reid_worker_pool import ReIDWorkerPool
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
 import os
@@ -93,10 +99,17 @@ json.dumps = np_dumps
 
 
 class ReIDTracker:
-    def __init__(self, log_system=None,rtsp_url=''):
-        """初始化ReID跟踪器"""
+    def __init__(self, log_system=None,rtsp_url='', rerank=None, gallery=None):
+        """
+        初始化ReID跟踪器
+        gallery: 行人库，默认为服务进程内共用的GalleryService；进程模式下分析进程传入GalleryClient，本进程不加载行人库
+        """
         self.reid_pipeline = None
+        # 该路匹配时是否做k-reciprocal重排序
+        self.rerank = cfgs.RERANK_ENABLE if rerank is None else rerank
         self.track_manager = None
+        # 按track缓存的特征，同一轨迹重复ReID时不再重新提取
+        self.feature_cache = TrackFeatureCache()
         self.db_path = cfgs.DB_PATH
         self.log_system = log_system if log_system else LogSystem()
         self.torch_device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
@@ -106,10 +119,12 @@ class ReIDTracker:
         self.cuda_available = torch.cuda.is_available()
         self.device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 
-        if self.cuda_available:
-            self.model = YOLO(cfgs.YOLO_MODEL_PATH_PT, task="detect").to(self.torch_device)
-        else:
-            self.model = YOLO(cfgs.YOLO_MODEL_PATH, task="detect")
+        # 所有视频流共享同一个检测模型，跟踪器每路独立
+        self.detect_service = DetectService.get_instance()
+        self.stream_tracker = StreamTracker(cfgs.YOLO_TRACKER_TYPE)
+        # 进店ReID放到共享线程池异步执行，同一路的ReID任务串行
+        self.reid_workers = ReIDWorkerPool.get_instance() if cfgs.REID_ASYNC else None
+        self._reid_lock = threading.RLock()
 
         # 初始化数据库
         try:
@@ -132,9 +147,13 @@ class ReIDTracker:
         self.qualityl = [0.0 for _ in range(10000)]
 
         # 区域和边界定义
-        self.area_polygon = None
-        self.entry_line = None
-        self.side_lines = []
+        self.region = None
+        # ROI绘制缓存，json_data变化时重建
+        self.roi_render = None
+        self.roi_render_data = None
+        # 每路复用一个Annotator，分辨率变化时重建
+        self._annotator = None
+        self._annotator_shape = None
         self.rect_points = []
 
         # 对象状态
@@ -143,11 +162,12 @@ class ReIDTracker:
         self.last_seen = {}
         self.current_in_roi = set()
         self.previous_in_roi = set()
-        base_feat_lists, base_idx_lists = load_features_from_sqlite(self.db_path, cfgs.DB_NAME, dims=1280)
-        print(f'根据数据库中内容，加载行人数量{len(base_feat_lists)}')
+        # 匹配/注册/person_id分配都经过行人库，各路共用
+        self.gallery = gallery if gallery is not None else GalleryService.get_instance()
         self.start_time = time.time()
-        # 初始化ReID Pipeline
-        self.reid_pipeline = ReidPipeline(base_feat_lists=base_feat_lists, base_idx_lists=base_idx_lists, dims=1280)
+        # 初始化ReID Pipeline，检索用共用的行人库；远程行人库时本进程的pipeline只用来提取特征
+        local_gallery = self.gallery.gallery if isinstance(self.gallery, GalleryService) else None
+        self.reid_pipeline = ReidPipeline(base_feat_lists=[], base_idx_lists=[], dims=1280, gallery=local_gallery)
 
         # fps的队列
         self.fps_list=[]
@@ -206,59 +226,30 @@ class ReIDTracker:
         """设置区域边界"""
         self.rect_points = [(point[0], point[1]) for point in json_data["points"]]
 
-        # 创建shapely Polygon对象用于区域检测
-        self.area_polygon = Polygon(self.rect_points)
-
-        # 定义进店线(点0到点1)
-        self.entry_line = LineString([self.rect_points[0], self.rect_points[1]])
-
-        # 获取所有边，除了入口边(points[0]到points[1])
-        self.side_lines = []
-        num_points = len(self.rect_points)
-        for i in range(1, num_points):
-            # 从第二个点开始，依次连接到最后一个点和第一个点
-            next_point = self.rect_points[(i + 1) % num_points]
-            self.side_lines.append(LineString([self.rect_points[i], next_point]))
-            
-        # Create an expanded ROI polygon that is 1.3 times larger than the original area
-        # First calculate the centroid of the original polygon
-        centroid_x = sum(p[0] for p in self.rect_points) / len(self.rect_points)
-        centroid_y = sum(p[1] for p in self.rect_points) / len(self.rect_points)
-        
-        # Scale each point from the centroid by a factor of 1.3
-        expanded_points = []
-        for point in self.rect_points:
-            # Vector from centroid to point
-            vector_x = point[0] - centroid_x
-            vector_y = point[1] - centroid_y
-            
-            # Scale the vector by 1.3
-            scaled_x = centroid_x + vector_x * 1.3
-            scaled_y = centroid_y + vector_y * 1.3
-            
-            expanded_points.append((scaled_x, scaled_y))
-        
-        self.area_polygon_roi = Polygon(expanded_points)
+        # 店前区域(点0到点1为进店线，其余为侧边)和放大1.3倍的ROI，每帧所有目标一次向量化判定
+        self.region = RegionEngine(self.rect_points, roi_scale=1.3)
 
     def _draw_rois(self, frame, json_data):
-        """绘制门店前部区域"""
-        # 从一维数组转换为元组对格式
-        b3 = [tuple(p) for p in json_data['b1']]  # [(x1,y1), (x2,y2)]
-        b2 = [tuple(p) for p in json_data['b2']]
-        b1 = [tuple(p) for p in json_data['g2']]  # g2作为b3
-        points = np.array(json_data['points'], np.int32).reshape((-1, 1, 2))
-        overlay = frame.copy()
-        cv2.fillPoly(overlay, [points], color=(128, 128, 128))
-
-        alpha = 0.5
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
-
-        cv2.line(frame, b3[0], b3[1], (255, 0, 0), 2)  # B3
+        """绘制门店前部区域(半透明区域+B3线)，掩码按分辨率缓存，只在ROI外接矩形内原地混合"""
+        if self.roi_render is None or self.roi_render_data is not json_data:
+            self.roi_render = RoiRenderCache(json_data['points'], line=json_data['b1'])
+            self.roi_render_data = json_data
+        self.roi_render.draw(frame)
+
+    def _get_annotator(self, image):
+        """复用本路的Annotator，线宽/字号按分辨率计算，只在分辨率变化时重建，每帧换绑到要画的图上"""
+        if self._annotator is None or self._annotator_shape != image.shape:
+            self._annotator = Annotator(image, example=str(cfgs.YOLO_LABELS))
+            self._annotator_shape = image.shape
+        self._annotator.im = image
+        return self._annotator
 
     def _draw_match(self, image, boxes, labels, confs):
         """绘制匹配框和置信度"""
+        if len(boxes) == 0:
+            return image
+        annotator = self._get_annotator(image)
         for bbox, label, conf in zip(boxes, labels, confs):
-            annotator = Annotator(image, example=str(cfgs.YOLO_LABELS))
             # 如果label是元组,说明包含person_id和state
             if isinstance(label, tuple):
                 person_id, state = label
@@ -347,32 +338,21 @@ class ReIDTracker:
 
         # 初始化跟踪管理器
         self.track_manager = TrackManager(max_age=10)
+        self.stream_tracker.reset()
+        self.feature_cache.clear()
 
         # 初始化边界检测和ID管理
         b1, b2, b3, points = self._convert_boundary_format(self.json_data)
         self.boundary_detector = area_boundary_detect(b1, b2, b3)
+        self.region.boundary = self.boundary_detector
         self.id_dict = IDDict(max_age=5, area_boundary=self.boundary_detector.get_location_type,
                               log_system=self.log_system, b1=b1)
 
-        # 加载特征库
-        self.base_feat_lists, self.base_idx_lists = load_features_from_sqlite(self.db_path, cfgs.DB_NAME, dims=1280)
-        print(f'根据数据库中内容，加载行人数量{len(self.base_feat_lists)}')
-
-        # 初始化或更新ReID Pipeline
-        if not hasattr(self, 'reid_pipeline') or self.reid_pipeline is None:
-            self.reid_pipeline = ReidPipeline(base_feat_lists=self.base_feat_lists,
-                                              base_idx_lists=self.base_idx_lists, dims=1280)
-        else:
-            self.reid_pipeline.reload_search_engine(
-                base_feat_lists=np.array(self.base_feat_lists),
-                base_idx_lists=list(self.base_idx_lists),
-                dims=1280
-            )
+        # 数据库可能已切换，重新读库，等新索引生效后再开始处理
+        self.gallery.reload(True)
 
         # 初始化/重置计数器和状态
         self.frame_count = 0
-        self.people_count = get_max_person_id(self.db_path)
-        self.pre = self.people_count
 
         # 如果提供了视频路径，打开视频
         if video_path:
@@ -478,29 +458,27 @@ class ReIDTracker:
 
     def re_load_search_engine(self):
         """重新加载搜索引擎"""
-        self.base_feat_lists, self.base_idx_lists = load_features_from_sqlite(self.db_path, cfgs.DB_NAME, dims=1280)
-        print(f'根据数据库中内容，加载行人数量{len(self.base_feat_lists)}')
-        self.reid_pipeline.reload_search_engine(
-            base_feat_lists=np.array(self.base_feat_lists),
-            base_idx_lists=list(self.base_idx_lists),
-            dims=1280
-        )
-        print("搜索引擎已重新加载")
-
-    def process_frame(self, frame=None, skip_frames=1, match_thresh=0.15, is_track=True):
+        self.gallery.reload(False)
+        print("搜索引擎已提交后台重建，建好后自动替换")
+
+    def process_frame(self, frame=None, skip_frames=1, match_thresh=None, is_track=True, render=True):
         """
         处理单帧图像
 
         参数:
             frame: 要处理的帧，如果为None则从已打开的视频源读取
             skip_frames: 跳帧数
-            match_thresh: 匹配阈值
+            match_thresh: 匹配阈值，l2模式为距离上限，cosine模式为相似度下限；None时按SEARCH_METRIC取配置默认值
             is_track: 是否进行跟踪
+            render: 是否需要标注后的画面；只要统计结果时传False，不复制整帧也不绘制
+                    (frame可能是帧环里的槽位，分析全程只读不改)
 
         返回:
-            output_frame: 处理后的帧
+            output_frame: 处理后的帧，render为False且不存视频时直接返回未标注的frame
             info: 包含当前帧处理信息的字典
         """
+        if match_thresh is None:
+            match_thresh = cfgs.REID_MATCH_SIM if cfgs.SEARCH_METRIC == 'cosine' else cfgs.REID_MATCH_THRESH
         # 如果没有提供帧且有视频源，则从视频源读取
         if frame is None:
             if not hasattr(self, 'cap') or self.cap is None:
@@ -528,6 +506,8 @@ class ReIDTracker:
             'tracks': [],
             'events': []
         }
+        if self.reid_workers is not None:
+            info['reid_workers'] = self.reid_workers.stats()
 
 
         # 跳帧处理
@@ -551,59 +531,42 @@ class ReIDTracker:
         #     is_track=is_track
         # )
 
-        results = self.model.track(
-            frame,
-            persist=True,
-            tracker=cfgs.YOLO_TRACKER_TYPE,
-            conf=0.6,
-            iou=0.4,
-            classes=[0]
-        )
-       # print(results)
-        # Extract detection data from results
-        boxes = []
-        track_ids = []
-        labels = []
-        confs = []
-
-        if results and len(results) > 0:
-            result = results[0]  # Get the first result object
-            if result.boxes and len(result.boxes) > 0:
-                boxes = result.boxes.xyxy.cpu().numpy()  # Get bounding boxes
-                confs = result.boxes.conf.cpu().numpy()  # Get confidence scores
-                if result.boxes.cls.numel() > 0:
-                    labels = result.boxes.cls.int().cpu().numpy()  # Get class labels
-                if hasattr(result.boxes, 'id') and result.boxes.id is not None:
-                    track_ids = result.boxes.id.int().cpu().numpy()  # Get track IDs
-                else:
-                    track_ids = np.arange(len(boxes))  # Fallback if tracking IDs not available
+        # 头肩框和人体框一次推理，头肩框用于跟踪，人体框留给进店ReID
+        det_boxes, det_labels, det_confs = self.detect_service.detect(
+            frame, conf=0.6, iou=0.4, classes=[cfgs.HEAD_CLASS, cfgs.BODY_CLASS])
+        is_head = det_labels == cfgs.HEAD_CLASS
+        body_boxes = det_boxes[det_labels == cfgs.BODY_CLASS]
+        boxes, track_ids, labels, confs = self.stream_tracker.update(
+            det_boxes[is_head], det_confs[is_head], det_labels[is_head], frame)
         # 更新跟踪
         self.track_manager.update_tracks(track_ids if track_ids is not None else [])
 
         had_search_trackid_list = []
+        match_draw = None
         box_id=0
         # 如果启用了跟踪
         if is_track and track_ids is not None and len(track_ids) > 0:
-            for bbox, track_id, conf in zip(boxes, track_ids, confs):
+            body_idx, body_scores = associate_heads_bodies(boxes, body_boxes)
+            # 所有目标的下框中点一次判定: 是否在区域/ROI内、到各边距离、inside/outside/pass_area
+            points = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, boxes[:, 3]], axis=1)
+            in_area, in_roi, edge_dists, locations = self.region.classify(points)
+            for i, (bbox, track_id, conf) in enumerate(zip(boxes, track_ids, confs)):
+                body_i, body_score = body_idx[i], body_scores[i]
                 # 质量检测
                 # if bbox[3] - bbox[1] < 50 or bbox[2] - bbox[0] < 50 or conf < 0.5:
                 #     continue
 
-                # 获取ROI
-                x1, y1, x2, y2 = map(int, bbox)
-                roi_frame = frame[y1:y2, x1:x2].copy()
-
                 # 完整度检测
                 quality_score = conf
                 self.track_manager.update_track_info(track_id, quality=quality_score)
                 track_info = self.track_manager.get_track_info(track_id)
 
-                # 创建当前点坐标
-                x_center, y_center = self._get_box_center(bbox)
-                curr_point = Point(x_center, y_center)
+                # 当前点坐标
+                x_center, y_center = points[i]
+                curr_point = (x_center, y_center)
 
                 # 检查点是否在区域内
-                curr_in_area = self.area_polygon.contains(curr_point)
+                curr_in_area = bool(in_area[i])
 
                 # 如果在ROI区域内，添加到当前帧的ROI内ID集合
                 if curr_in_area:
@@ -613,16 +576,19 @@ class ReIDTracker:
                 self.last_seen[track_id] = time.time()
                 person_id = track_info.person_id if track_info.person_id != -1 else track_id
                 # 位置更新 - 使用IDDict进行状态管理
-                if self.area_polygon_roi.contains(curr_point):
-                    event = self.id_dict.add_update(track_id, 'cam1', x_center, y_center, reid_id=person_id)
-                    self._update_track_history_and_status(track_id, x_center, y_center, curr_in_area, curr_point, info)
+                if in_roi[i]:
+                    event = self.id_dict.add_update(track_id, 'cam1', x_center, y_center, reid_id=person_id,
+                                                    location=locations[i])
+                    self._update_track_history_and_status(track_id, x_center, y_center, curr_in_area, curr_point, info,
+                                                          edge_dists[i])
                 else:
                     event = None
 
                 # 处理事件和ReID
                 if event:
+                    body = (body_boxes[body_i], body_score) if body_i >= 0 else None
                     self._process_event_and_reid(event, track_id, track_info, frame, bbox,
-                                                 quality_score, conf, match_thresh, info)
+                                                 quality_score, conf, match_thresh, info, body)
                     info['events'].append(event)
 
                 # 获取最新的track_info（可能在处理事件过程中有更新）
@@ -644,15 +610,10 @@ class ReIDTracker:
                 boxes_res.append({"id":box_id,"label":"head","bbox":[int(bbox[0]),int(bbox[1]),int(bbox[2]-bbox[0]),int(bbox[3]-bbox[1])],"confidence":round(conf,2)})
                 box_id+=1
             self.had_search_trackid_list=had_search_trackid_list
-            output_frame = self._draw_match(frame.copy(),
-                                            [row[0] for row in had_search_trackid_list],  # boxes
-                                            [row[1] for row in had_search_trackid_list],  # labels(id,status)
-                                            [row[2] for row in had_search_trackid_list])  # confs
-            self.pre_data=[[row[0] for row in had_search_trackid_list],  # boxes
-                                            [row[1] for row in had_search_trackid_list],  # labels(id,status)
-                                            [row[2] for row in had_search_trackid_list]]
-        else:
-            output_frame = frame.copy()
+            match_draw = [[row[0] for row in had_search_trackid_list],  # boxes
+                          [row[1] for row in had_search_trackid_list],  # labels(id,status)
+                          [row[2] for row in had_search_trackid_list]]  # confs
+            self.pre_data = match_draw
 
         # 计算FPS
       #  self.end_time = time.time()
@@ -665,13 +626,20 @@ class ReIDTracker:
         self.start_time=time.time()
         self.fps=fps
 
-        # 绘制ROI区域 取消绘制roi
-        self._draw_rois(output_frame, self.json_data)
-        self._draw_text_info(output_frame)
-
+        # 只有需要标注画面(显示/存视频)时才复制一次整帧，分析阶段只用frame本身
+        has_writer = getattr(self, 'video_writer', None) is not None
+        if render or has_writer:
+            output_frame = frame.copy()
+            if match_draw is not None:
+                self._draw_match(output_frame, *match_draw)
+            # 绘制ROI区域
+            self._draw_rois(output_frame, self.json_data)
+            self._draw_text_info(output_frame)
+        else:
+            output_frame = frame
 
         # 保存视频
-        if hasattr(self, 'video_writer') and self.video_writer is not None:
+        if has_writer:
             self.video_writer.write(output_frame)
         # 定期执行内存清理
         current_time = time.time()
@@ -724,8 +692,8 @@ class ReIDTracker:
 
 
         for i, (text, color) in enumerate(info_texts):
-            # 计算文本尺寸
-            (text_width, text_height), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)
+            # 计算文本尺寸(缓存)
+            (text_width, text_height), baseline = text_size(text)
 
             # 计算坐标（右对齐）
             x = width - text_width - right_margin
@@ -753,8 +721,14 @@ class ReIDTracker:
 
         return frame
 
-    def _update_track_history_and_status(self, track_id, x_center, y_center, curr_in_area, curr_point, info):
-        """更新轨迹历史和区域状态"""
+    def _update_track_history_and_status(self, track_id, x_center, y_center, curr_in_area, curr_point, info,
+                                         edge_dists=None):
+        """
+        更新轨迹历史和区域状态
+        edge_dists: 当前点到各边的距离(第0个为进店线)，由RegionEngine批量算好
+        """
+        if edge_dists is None:
+            edge_dists = self.region.edge_distances(curr_point)
         if track_id in self.track_history:
             # 获取上一个状态
             if track_id in self.object_status:
@@ -784,18 +758,8 @@ class ReIDTracker:
                 status['in_area'] = True
                 status['first_in_area_point'] = curr_point
 
-                # 计算到各边的距离
-                entry_dist = self.entry_line.distance(curr_point)
-                side_dists = [line.distance(curr_point) for line in self.side_lines]
-
-                # 找到最小距离的边
-                all_dists = [entry_dist] + side_dists
-                min_dist_idx = all_dists.index(min(all_dists))
-
-                if min_dist_idx == 0:
-                    status['entered_from'] = 'entry'
-                else:
-                    status['entered_from'] = f'side_{min_dist_idx - 1}'
+                # 距离最近的边
+                status['entered_from'] = self.region.nearest_edge(edge_dists)
 
                 print(f"ID {track_id} 进入区域，从 {status['entered_from']} 进入")
                 # 添加事件到返回信息
@@ -817,18 +781,10 @@ class ReIDTracker:
                 if status['last_in_area_point'] is not None:
                     last_point = status['last_in_area_point']
 
-                    # 计算到各边的距离
-                    entry_dist = self.entry_line.distance(last_point)
-                    side_dists = [line.distance(curr_point) for line in self.side_lines]
-
-                    # 找到最小距离的边
-                    all_dists = [entry_dist] + side_dists
-                    min_dist_idx = all_dists.index(min(all_dists))
-
-                    if min_dist_idx == 0:
-                        status['exited_from'] = 'entry'
-                    else:
-                        status['exited_from'] = f'side_{min_dist_idx - 1}'
+                    # 进店线用最后一个区域内点的距离，侧边用当前点的距离
+                    exit_dists = edge_dists.copy()
+                    exit_dists[0] = self.region.edge_distances(last_point)[0]
+                    status['exited_from'] = self.region.nearest_edge(exit_dists)
 
                     print(f"ID {track_id} 离开区域，从 {status['exited_from']} 离开")
                     # 添加事件到返回信息
@@ -878,17 +834,7 @@ class ReIDTracker:
 
             if curr_in_area:
                 # 如果第一次检测就在区域内，计算最近边
-                entry_dist = self.entry_line.distance(curr_point)
-                side_dists = [line.distance(curr_point) for line in self.side_lines]
-
-
-                all_dists = [entry_dist] + side_dists
-                min_dist_idx = all_dists.index(min(all_dists))
-
-                if min_dist_idx == 0:
-                    self.object_status[track_id]['entered_from'] = 'entry'
-                else:
-                    self.object_status[track_id]['entered_from'] = f'side_{min_dist_idx - 1}'
+                self.object_status[track_id]['entered_from'] = self.region.nearest_edge(edge_dists)
 
                 print(f"新ID {track_id} 在区域内首次出现，假设从 {self.object_status[track_id]['entered_from']} 进入")
                 # 添加事件到返回信息
@@ -899,150 +845,119 @@ class ReIDTracker:
                 })
 
     def _process_event_and_reid(self, event, track_id, track_info, frame, bbox, quality_score, conf, match_thresh,
-                                info):
-        """处理事件和ReID"""
+                                info, body=None):
+        """
+        处理事件和ReID
+        body: 本帧与该头肩框关联的 (人体框, 得分)，没有为None
+        """
         event_type = event['type']
         info['events'].append(event)
 
-        Res = -1  # 默认为新人员
-
         if event_type == 'enter':
-            self.re_load_search_engine()
-            
-            # Get detected person body bounding boxes
-            body_results = self.model.predict(frame, conf=0.6, classes=[2])
-            if body_results and len(body_results) > 0:
-                body_boxes = body_results[0].boxes.xyxy.cpu().numpy() if body_results[0].boxes.xyxy is not None else []
-                confs = body_results[0].boxes.conf.cpu().numpy() if body_results[0].boxes.conf is not None else []
-                # Match head bbox with body bbox based on containment and position
-                if len(body_boxes) > 0:
-                    head_box = bbox  # Current head bbox
-                    head_center_x = (head_box[0] + head_box[2]) / 2
-                    head_center_y = (head_box[1] + head_box[3]) / 2
-                    
-                    # Find candidate body boxes that might contain this head
-                    candidate_bodies = []
-                    
-                    for body_box in body_boxes:
-                        # First check: is the head horizontally contained within the body
-                        if (head_center_x >= body_box[0] and head_center_x <= body_box[2]):
-                            # Check vertical position - head should be in top part of body
-                            body_height = body_box[3] - body_box[1]
-                            head_relative_pos = (head_center_y - body_box[1]) / body_height
-                            
-                            # Head should be in top 40% of the body
-                            if head_relative_pos <= 0.4:
-                                # Calculate match score based on position
-                                horizontal_alignment = 1.0 - abs(((head_box[0] + head_box[2]) / 2 - 
-                                                              (body_box[0] + body_box[2]) / 2)) / ((body_box[2] - body_box[0]) / 2)
-                                vertical_score = 1.0 - (head_relative_pos / 0.4)
-                                match_score = horizontal_alignment * 0.6 + vertical_score * 0.4
-                                
-                                candidate_bodies.append((body_box, match_score))
-                    
-                    # Sort candidates by score and select the best one
-                    if candidate_bodies:
-                        candidate_bodies.sort(key=lambda x: x[1], reverse=True)
-                        best_match, best_score = candidate_bodies[0]
-                        
-                        # Use the best matching body box for feature extraction
-                        bbox = best_match
-                        print(f"Matched head with body for track_id {track_id}, score: {best_score:.2f}")
+            if self.reid_workers is None:
+                self._enter_reid(event, track_id, frame, bbox, quality_score, conf, match_thresh, body)
+            else:
+                # frame可能是帧环的槽位，归还后会被解码线程覆盖，异步任务只复制要提取特征的那一块
+                crop, crop_bbox = self._reid_crop(frame, bbox if body is None else body[0])
+                crop_body = None if body is None else (crop_bbox, body[1])
+                run = lambda: self._enter_reid(event, track_id, crop, crop_bbox, quality_score, conf, match_thresh,
+                                               crop_body)
+                # 放到ReID线程池执行，检测循环不等待；任务被丢弃时按未做ReID处理，仍然记录进店
+                self.reid_workers.submit(self, track_id, run, on_drop=lambda: self._log_enter(event, track_id, -1))
+        elif event_type == 'exit':
+            print(f"人员内部编码： {event['person_id']} 出店")
+            track_info = self.track_manager.get_track_info(track_id)
+            person_id = track_info.person_id if track_info.person_id != -1 else track_id
+            self.log_system.log_business_event({
+                "event_type": "exit",
+                "person_id": event['person_id'],
+                "reid_id": person_id,
+                "camera_id": 'cam1',
+                "old_state": event['old_state'],
+                "new_state": event['new_state']
+            })
+
+    @staticmethod
+    def _reid_crop(frame, bbox):
+        """复制bbox区域，返回 (crop, crop内的bbox)"""
+        height, width = frame.shape[:2]
+        x1, y1 = min(max(int(bbox[0]), 0), width), min(max(int(bbox[1]), 0), height)
+        x2, y2 = min(max(int(bbox[2]), x1), width), min(max(int(bbox[3]), y1), height)
+        return frame[y1:y2, x1:x2].copy(), (0, 0, x2 - x1, y2 - y1)
+
+    def _enter_reid(self, event, track_id, frame, bbox, quality_score, conf, match_thresh, body=None):
+        """进店事件的ReID：匹配人体框、提取或复用特征、检索、注册/更新，结果写回TrackManager"""
+        with self._reid_lock:
+            # 异步执行时track可能已经消失，用空的TrackInfo继续走完流程
+            track_info = self.track_manager.get_track_info(track_id) or TrackInfo(track_id=track_id)
+            Res = -1  # 默认为新人员
+            # 用跟踪那次推理中关联到的人体框提取特征，不再单独跑一次人体检测
+            if body is not None:
+                bbox, best_score = body
+                print(f"Matched head with body for track_id {track_id}, score: {best_score:.2f}")
             if conf > 0.78:
                 # ReID处理
                 if not track_info.is_reid:
-                    _feat_list = self.reid_pipeline.SingleExtract(frame, bbox)
+                    quality = quality_score + conf * 0.5
+                    # 缓存未过期且质量足够时直接用缓存的均值特征，不再跑提取模型
+                    _feat_list = None
+                    if not self.feature_cache.needs_extract(track_id, quality):
+                        _feat_list = self.feature_cache.get(track_id)
+                    if _feat_list is None:
+                        _feat_list = self.feature_cache.update(
+                            track_id, self.reid_pipeline.SingleExtract(frame, bbox), quality)
                     # Save extracted person image
                     person_crop = frame[int(bbox[1]):int(bbox[3]), int(bbox[0]):int(bbox[2])]
                     os.makedirs('extracted_persons2', exist_ok=True)
                     timestamp = int(time.time() * 1000)
-                    Res, dist = self.reid_pipeline.VecPair(_feat_list, match_thresh)
+                    # 匹配不上时行人库直接注册为新人员并分配person_id(库中last_used的刷新也在这里)
+                    person_id, dist, is_new = self.gallery.match(_feat_list, match_thresh, self.rerank)
                     # save_path = f'extracted_persons2/person_{track_id}_{timestamp}_{Res}.jpg'
                     # cv2.imwrite(save_path, person_crop)
-                    if Res == -1:
+                    if is_new:
                         # 新人员
-                        self.people_count += 1
                         self.track_manager.update_track_info(
                             track_id,
-                            person_id=self.people_count,
+                            person_id=person_id,
                             feature=_feat_list,
                             is_reid=True,
                             quality=quality_score + conf * 0.5
                         )
                         self.qualityl[track_id] = quality_score + conf * 0.5
-                        self.base_feat_lists.append(_feat_list)
-                        self.base_idx_lists.append(self.people_count)
-                        add_feature(self.db_path, self.people_count, np.array([_feat_list]))
-                        self.reid_pipeline.reload_search_engine(
-                            base_feat_lists=np.array(self.base_feat_lists),
-                            base_idx_lists=list(self.base_idx_lists),
-                            dims=1280
-                        )
-                        self.pre = get_max_person_id(self.db_path)
-                        print(f'当前行人库中的行人数量：{self.pre}')
-                    else:
+                    elif person_id != -1:
                         # 匹配到已有人员
-                        # 检查Res索引是否有效
-                        if Res >= 0 and Res < len(self.base_idx_lists):
-                            person_id = self.base_idx_lists[Res]
-                            print(f"Track {track_id} 匹配到已有人员 {person_id}，距离: {dist:.2f}")
-                            if track_info.person_id != -1 and dist < match_thresh - 0.05:
-                                self.track_manager.update_track_info(
-                                    track_id,
-                                    person_id=self.base_idx_lists[Res],
-                                    feature=_feat_list
-                                )
-                            self.track_manager.update_track_info(
-                                track_id,
-                                person_id=self.base_idx_lists[Res],
-                                feature=_feat_list
-                            )
-                        else:
-                            print(f"警告：Res={Res}，超出base_idx_lists范围（长度={len(self.base_idx_lists)}）")
-                            # 将Res重置为-1，视为新人员
-                            Res = -1
-                            # 新人员处理逻辑
-                            self.people_count += 1
-                            self.track_manager.update_track_info(
-                                track_id,
-                                person_id=self.people_count,
-                                feature=_feat_list,
-                                is_reid=True,
-                                quality=quality_score + conf * 0.5
-                            )
-                            self.qualityl[track_id] = quality_score + conf * 0.5
-                            self.base_feat_lists.append(_feat_list)
-                            self.base_idx_lists.append(self.people_count)
-                            add_feature(self.db_path, self.people_count, np.array([_feat_list]))
-                            self.reid_pipeline.reload_search_engine(
-                                base_feat_lists=np.array(self.base_feat_lists),
-                                base_idx_lists=list(self.base_idx_lists),
-                                dims=1280
-                            )
-                            self.pre = get_max_person_id(self.db_path)
-                            print(f'当前行人库中的行人数量：{self.pre}')
+                        Res = person_id
+                        print(f"Track {track_id} 匹配到已有人员 {person_id}，距离: {dist:.2f}")
+                        self.track_manager.update_track_info(
+                            track_id,
+                            person_id=person_id,
+                            feature=_feat_list
+                        )
                 else:
                     quality = quality_score + conf * 0.5
-                    if quality > self.qualityl[track_id] + 0.1:
+                    # 只有缓存过期或当前画面质量明显更好时才重新提取
+                    if self.feature_cache.needs_extract(track_id, quality):
                         _feat_list = self.reid_pipeline.SingleExtract(frame, bbox)
-                        track_info = self.track_manager.get_track_info(track_id)
-                        quality = quality_score + conf * 0.5
+                        track_info = self.track_manager.get_track_info(track_id) or track_info
 
                         # 更新track信息
                         self.track_manager.update_track_info(
                             track_id,
-                            feature=_feat_list,
+                            feature=self.feature_cache.update(track_id, _feat_list, quality),
                             quality=quality
                         )
                         self.qualityl[track_id] = quality
-                        # 如果已经匹配到人物ID，更新特征
+                        # 如果已经匹配到人物ID，加入该人的样本集，库中特征更新为样本质心
                         if track_info.person_id != -1:
-                            update_feature(self.db_path, track_info.person_id, _feat_list)
+                            self.gallery.add_exemplar(track_info.person_id, _feat_list)
 
-            # 获取最新的track_info信息
-            track_info = self.track_manager.get_track_info(track_id)
-            person_id = track_info.person_id if track_info.person_id != -1 else track_id
+            self._log_enter(event, track_id, Res)
 
+    def _log_enter(self, event, track_id, Res):
+        """记录进店/重复进店事件"""
+        with self._reid_lock:
+            track_info = self.track_manager.get_track_info(track_id)
+            person_id = track_info.person_id if track_info is not None and track_info.person_id != -1 else track_id
             if Res == -1:
                 print(f"人员内部编码： {event['person_id']} 进店")
                 self.log_system.log_business_event({
@@ -1063,18 +978,6 @@ class ReIDTracker:
                     "old_state": event['old_state'],
                     "new_state": event['new_state']
                 })
-        elif event_type == 'exit':
-            print(f"人员内部编码： {event['person_id']} 出店")
-            track_info = self.track_manager.get_track_info(track_id)
-            person_id = track_info.person_id if track_info.person_id != -1 else track_id
-            self.log_system.log_business_event({
-                "event_type": "exit",
-                "person_id": event['person_id'],
-                "reid_id": person_id,
-                "camera_id": 'cam1',
-                "old_state": event['old_state'],
-                "new_state": event['new_state']
-            })
 
     def _cleanup_old_data(self):
         """清理长时间未见的数据以节省内存及未使用的特征"""
@@ -1104,6 +1007,7 @@ class ReIDTracker:
                 self.current_in_roi.remove(track_id)
             if track_id in self.previous_in_roi:
                 self.previous_in_roi.remove(track_id)
+            self.feature_cache.remove(track_id)
             # self.track_manager.remove_track(track_id)
 
         # 如果有移除的轨迹，打印信息
@@ -1112,6 +1016,8 @@ class ReIDTracker:
 
         # 清理长时间未使用的特征
         try:
+            # 先落库排队中的last_used刷新，避免刚匹配到的人被当成过期
+            flush_features()
             # 使用连接上下文管理器而非直接连接
             with _get_connection_context(self.db_path) as conn:
                 cursor = conn.cursor()
@@ -1139,17 +1045,10 @@ class ReIDTracker:
                     conn.commit()
                     print(f"已清理 {len(timeout_ids)} 条过期特征记录")
 
-                    # 重新加载特征库
-                    self.base_feat_lists, self.base_idx_lists = load_features_from_sqlite(
-                        self.db_path, cfgs.DB_NAME, dims=1280
-                    )
-                    if len(self.base_feat_lists) > 0:
-                        self.reid_pipeline.reload_search_engine(
-                            base_feat_lists=np.array(self.base_feat_lists),
-                            base_idx_lists=list(self.base_idx_lists),
-                            dims=1280
-                        )
-                    print(f'重新加载特征库完成，当前行人数量: {len(self.base_feat_lists)}')
+                    # 从检索引擎中增量删除过期特征
+                    for person_id in timeout_ids:
+                        self.gallery.remove_person(person_id)
+                    print(f'已从检索引擎移除 {len(timeout_ids)} 个过期行人')
 
         except Exception as e:
             print(f"清理特征库时出错: {e}")
@@ -1167,11 +1066,15 @@ class ReIDTracker:
 
         # 不要在这里直接关闭所有数据库连接
         # 因为其他线程可能还在使用
-        # 只清除对象自身引用
-
-        # 释放GPU资源
-        if hasattr(self, 'model'):
-            del self.model
+        # 只清除对象自身引用，取消该路还在排队的ReID任务，并等待该路排队中的特征写入落库
+        if self.reid_workers is not None:
+            self.reid_workers.cancel(self)
+        flush_features()
+
+        # 释放该路的跟踪状态，共享检测模型不随单路释放
+        if hasattr(self, 'stream_tracker'):
+            self.stream_tracker.reset()
+        self.feature_cache.clear()
         if hasattr(self, 'reid_pipeline'):
             del self.reid_pipeline
 
@@ -1190,7 +1093,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='ReID 跟踪系统')
     parser.add_argument('--video_paths', type=str, nargs='+', help='多个视频文件路径或RTSP流地址，以空格分隔')
     parser.add_argument('--skip_frames', type=int, default=2, help='跳帧数量')
-    parser.add_argument('--match_thresh', type=float, default=0.15, help='匹配阈值')
+    parser.add_argument('--match_thresh', type=float, default=None, help='匹配阈值，默认按SEARCH_METRIC取配置值')
     parser.add_argument('--save_video', action='store_true', help='是否保存处理后的视频')
     parser.add_argument('--clear_db', action='store_true', help='是否清空数据库')
     parser.add_argument('--config', type=str, default='v1.json', help='配置文件路径')
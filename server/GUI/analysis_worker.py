@@ -0,0 +1,165 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: 进程模式下的单路分析进程 (cfgs.ANALYSIS_MODE = 'process')
+    服务进程的解码线程把帧写进共享内存帧环，只通过队列传槽位下标；
+    本进程直接在共享内存上做检测/跟踪/计数，用完把下标发回去归还槽位，
+    统计结果和(/video_feed有人看时)编码好的标注画面经同一个队列回传服务进程
+    行人库只在服务进程里(GalleryService)：本进程提取特征后经GalleryClient请求匹配/注册，
+    各摄像头共用同一个检索引擎和person_id分配
+'''
+import itertools
+import queue
+import threading
+import cv2
+
+import Algorithm.libs.config.model_cfgs as cfgs
+
+from libs.frame_ring import attach_shared_frames
+from libs.mjpeg_hub import MJPEG_QUALITY
+
+# 回传消息类型
+MSG_FREE = 'free'      # (MSG_FREE, 槽位下标)
+MSG_RESULT = 'result'  # (MSG_RESULT, outresult, 标注画面的JPEG或None)
+MSG_GALLERY = 'gallery'  # (MSG_GALLERY, 请求id或None, 方法名, 参数)，服务进程按请求id在reply_q上回复 (请求id, 结果)
+
+
+class GalleryClient(object):
+    """
+    分析进程里的行人库代理，接口与GalleryService相同，请求发回服务进程执行
+    - match/reload 等待回复，超时按未匹配处理
+    - add_exemplar/remove_person 只发送不等待
+    """
+    def __init__(self, out_q, reply_q, timeout=cfgs.ANALYSIS_GALLERY_TIMEOUT):
+        self.out_q = out_q
+        self.reply_q = reply_q
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._pending = {}  # {请求id: [Event, 结果]}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_replies, name='gallery-replies', daemon=True)
+        self._reader.start()
+
+    def _read_replies(self):
+        while not self._closed:
+            try:
+                req_id, result = self.reply_q.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                waiter = self._pending.pop(req_id, None)
+            if waiter is not None:
+                waiter[1] = result
+                waiter[0].set()
+
+    def _call(self, method, args, timeout):
+        req_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._pending[req_id] = waiter
+        self.out_q.put((MSG_GALLERY, req_id, method, args))
+        if not waiter[0].wait(timeout):
+            with self._lock:
+                self._pending.pop(req_id, None)
+            raise TimeoutError(f"行人库请求 {method} 超时({timeout}s)")
+        return waiter[1]
+
+    def _send(self, method, args):
+        self.out_q.put((MSG_GALLERY, None, method, args))
+
+    def match(self, feat, match_thresh, rerank=False):
+        try:
+            result = self._call('match', (feat, match_thresh, rerank), self.timeout)
+        except TimeoutError as e:
+            print(f"{e}，按未匹配处理")
+            return -1, 1.0, False
+        # 服务进程执行出错时回复None
+        return (-1, 1.0, False) if result is None else result
+
+    def add_exemplar(self, person_id, feat):
+        self._send('add_exemplar', (person_id, feat))
+
+    def remove_person(self, person_id):
+        self._send('remove_person', (person_id,))
+
+    def reload(self, wait=True):
+        try:
+            # 重建索引可能要较长时间
+            return self._call('reload', (wait,), max(self.timeout, 60))
+        except TimeoutError as e:
+            # 服务进程的行人库仍可使用，只是可能还是旧索引
+            print(e)
+            return None
+
+    def close(self):
+        self._closed = True
+
+
+def run_analysis_worker(rtsp_url, temp_data, shm_name, shape, size, ready_q, out_q, reply_q, render_flag, stop_event,
+                        match_thresh=None, is_track=True):
+    """
+    分析进程入口
+    :param shm_name/shape/size: 服务进程中FrameRing的共享内存名、单帧形状和槽位数
+    :param ready_q: 服务进程发来的待处理槽位下标
+    :param out_q: 回传 MSG_FREE / MSG_RESULT / MSG_GALLERY 消息；归还槽位和行人库请求阻塞发送，结果队列满时丢弃
+    :param reply_q: 服务进程对行人库请求的回复
+    :param render_flag: 共享的布尔值，服务进程按/video_feed是否有订阅设置
+    """
+    # 跟踪器依赖的模型在子进程里才导入和加载
+    from log.log import LogSystem
+    from Reid_module3 import ReIDTracker
+
+    shm, frames = attach_shared_frames(shm_name, shape, size)
+    gallery = GalleryClient(out_q, reply_q)
+    tracker = None
+    try:
+        tracker = ReIDTracker(log_system=LogSystem(), rtsp_url=rtsp_url, gallery=gallery)
+        if not tracker.setup_processing(None, temp_data):
+            print(f"{rtsp_url} 分析进程无法设置视频处理环境")
+            return
+        while not stop_event.is_set():
+            try:
+                idx = ready_q.get(timeout=1)
+            except queue.Empty:
+                continue
+            # 处理不过来时只分析最新的一帧，积压的旧帧直接归还
+            while True:
+                try:
+                    newer = ready_q.get_nowait()
+                except queue.Empty:
+                    break
+                out_q.put((MSG_FREE, idx))
+                idx = newer
+
+            render = bool(render_flag.value)
+            output_frame, result = None, None
+            try:
+                output_frame, _, result = tracker.process_frame(frames[idx], 0, match_thresh, is_track, render=render)
+            except Exception as e:
+                print(f"{rtsp_url} 分析进程处理帧出错: {e}")
+            finally:
+                out_q.put((MSG_FREE, idx))
+
+            jpeg = None
+            if render and output_frame is not None:
+                # 标注画面是process_frame复制出来的，归还槽位后仍然有效；在这里编码一次，服务进程只扇出
+                ok, buffer = cv2.imencode('.jpg', output_frame, [int(cv2.IMWRITE_JPEG_QUALITY), MJPEG_QUALITY])
+                jpeg = buffer.tobytes() if ok else None
+            output_frame = None
+            if result is not None:
+                try:
+                    out_q.put_nowait((MSG_RESULT, result, jpeg))
+                except queue.Full:
+                    pass
+    finally:
+        if tracker is not None:
+            try:
+                tracker.release()
+            except Exception as e:
+                print(f"{rtsp_url} 分析进程释放资源出错: {e}")
+        gallery.close()
+        del frames
+        try:
+            shm.close()
+        except BufferError:
+            pass
@@ -31,7 +31,7 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # 自定义的类
 from base_models import RTSP,VideoConfig
-from RTSPData import RTSPData
+from RTSPData import SourceRegistry
 
 from fastapi import FastAPI
 from logs_server.db.database import engine
@@ -55,8 +55,9 @@ async def lifespan(app:FastAPI):
     # 四个算法处理的生成者队列队列
    # app.state.stream_manager = StreamManager(mjpeg_server_port=8554, max_reconnect=10,frame_queue=frame_queue)
     # app.state.stream_manager.custumer_analysis()
-    # 存储实例化的RTSP流对象
-    app.state.rtsp_datas={}
+    # 存储实例化的RTSP流对象，由注册表统一打开/关闭，每个摄像头只解码一次
+    app.state.source_registry = SourceRegistry.get_instance()
+    app.state.rtsp_datas=app.state.source_registry.sources
     app.state.stream_manager = StreamManager(mjpeg_server_port=8554, max_reconnect=10,rtsp_datas=app.state.rtsp_datas)
 
     # 知道stream_id 返回rtsp_url
@@ -71,7 +72,7 @@ async def lifespan(app:FastAPI):
 
     # wsmanage
     app.state.rtsp_stream_id={}
-    app.state.ws_manager = ConnectionManager(app.state.rtsp_datas)
+    app.state.ws_manager = ConnectionManager(app.state.source_registry)
     yield
     # 清理资源
     pass
@@ -100,150 +101,34 @@ stream_objects = {}
 target_width = 1280
 # 全局变量存储推流状态
 stream_objects_rtsp = {}
-def _encode_frame( frame):
-    """独立编码函数"""
-    # 可在此处添加硬件加速逻辑
-    # if is_resize:
-    #     frame=cv2.resize(frame,(width,height))
-    _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-    return buffer.tobytes()
-# 创建编码线程池（根据CPU核心数调整）
-encode_executor = ThreadPoolExecutor(max_workers=4)
-async def rtsp_generate_mjpeg(rtsp_url):
-    # 优化视频捕获参数
-    cap = cv2.VideoCapture(rtsp_url+'?tcp', cv2.CAP_FFMPEG)
-
-    # 强制使用 TCP 传输协议
-    # cap.set(cv2.CAP_PROP_FFMPEG_TRANSPORT_OPT, "tcp")
-
-    # 减少缓冲区大小（默认值：500ms）
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)  # 单位：帧数
-
-    # 设置超时时间（单位：毫秒）
-    #cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MS, 5000)
-
-    # 配置解码参数
-    cap.set(cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY)  # 启用硬件加速
-    loop = asyncio.get_event_loop()
-
-    # is_resize = False
-    # # 如果画面大于1920则进行resize
-    # min_width_px = 1280
-    #
-    # ret, frame = cap.read()
-    # height, width = frame.shape[:2]
-    #
-    # if width > min_width_px:
-    #     new_h = height * min_width_px // width
-    #     width, height = min_width_px, new_h
-    #     is_resize = True
-
-    while True:
-        try:
-            ret, frame = cap.read()
-            if not ret:
-                # 自动重连机制
-                print("Connection lost, reconnecting...")
-                cap.release()
-                cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
-                continue
-
-            # 将编码任务提交到线程池
-            _frame_cache = await loop.run_in_executor(
-                encode_executor,
-                _encode_frame,  # 独立编码函数
-                frame
-            )
-
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + _frame_cache + b'\r\n\r\n')
-        except Exception as e:
-            print('rtsp_generate_mjpeg',str(e))
-    cap.release()
-
-queue_rtsp_map={}
-queue_list=[asyncio.Queue(maxsize=5)for i in range(12)]
-queue_valid_map={}
-for i in range(len(queue_list)):
-    queue_valid_map[i]=True
-def getvalid_queue():
-    for key,value in queue_valid_map.items():
-        if value:
-            queue_valid_map[key]=False
-            return key
-
-async def read_rtsp(rtsp_url):
-    cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
-    cap.set(cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY)
-    cap.set(cv2.CAP_PROP_BUFFERSIZE, 2)
-    cap.set(cv2.CAP_PROP_FPS, 25)
-    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('H', '2', '6', '5'))
-
-    valid_index = getvalid_queue()
-    queue_rtsp_map[rtsp_url] = valid_index
-
-    loop = asyncio.get_event_loop()
+async def generate_mjpegV3(rtsp_url):
+    """原始画面推流，从该路的广播订阅，所有客户端共用一次编码，不再和分析线程抢origin_frame_queue里的帧"""
+    rtsp_data = app.state.source_registry.acquire(rtsp_url, 'preview')
     try:
-        while True:
-            # 异步执行阻塞的 read()
-            ret, frame = await loop.run_in_executor(None, cap.read)
-            if not ret:
-                break
-            await queue_list[valid_index].put(frame)
-            await asyncio.sleep(0.02)
+        async for chunk in rtsp_data.raw_hub.stream():
+            yield chunk
     finally:
-        cap.release()
-        queue_valid_map[valid_index] = True
-        del queue_rtsp_map[rtsp_url]
-async def generate_mjpegV2(rtsp_url):
-    """专门一个队列用于获取和推流"""
-    queue_index=queue_rtsp_map[rtsp_url]
-    import time
-    start=time.time()
-    while True:
-        frame=await queue_list[queue_index].get()
-        fps=1/(time.time()-start)
-        print(f'rtsp:{rtsp_url},{fps:.2f}')
-        ret, jpeg = cv2.imencode('.jpg', frame)
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n\r\n')
-
-async def generate_mjpegV3(rtsp_url):
-    rtsp_data = app.state.rtsp_datas[rtsp_url]
-    """专门一个队列用于获取和推流"""
-    origin_frame_queue=rtsp_data.origin_frame_queue
-    import time
-    prestart=time.time()-2
-    while True:
-        frame= origin_frame_queue.get()
-        div=min(0.002,time.time()-prestart)
-        fps=1/div
-        prestart=time.time()
-        print(f'rtsp:{rtsp_url},{fps:.2f}')
-        ret, jpeg = cv2.imencode('.jpg', frame)
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n\r\n')
+        # 客户端断开，最后一个订阅方离开后注册表关闭解码
+        app.state.source_registry.release(rtsp_url, 'preview')
 
 
 
 from RTSPData import HandleRTSPData
 @app.post('/customer-flow/check-rtsp')
 async def check_rtsp(rtsp:RTSP,db:Session=Depends(get_db)):
-    # 实例化rtsp对象
-    rtsp_data=RTSPData(rtsp.rtsp_url)
-
+    # 从注册表取这一路的解码(已在预览/分析的直接复用，不再重复打开)，存完首帧就归还截图引用
+    rtsp_data=app.state.source_registry.acquire(rtsp.rtsp_url, 'snapshot')
+    try:
+        # 保存首帧图片
+        os.makedirs("static/frames", exist_ok=True)
+        frame_path = f"static/frames/{rtsp_data.stream_id}.jpg"
+        cv2.imwrite(frame_path,rtsp_data.screen_img)
+    finally:
+        app.state.source_registry.release(rtsp.rtsp_url, 'snapshot')
 
     # 通过stream_id查询rtsp
     app.state.stream_2_rtsp_dict[rtsp_data.stream_id]=rtsp_data.rtsp_url
 
-    # 在全局变量中存储rtsp数据便于不同变量访问
-    app.state.rtsp_datas[rtsp.rtsp_url] = rtsp_data
-
-    # 保存首帧图片
-    os.makedirs("static/frames", exist_ok=True)
-    frame_path = f"static/frames/{rtsp_data.stream_id}.jpg"
-    cv2.imwrite(frame_path,rtsp_data.screen_img)
-
     # 创建rtsptt
     #app.state.stream_manager.rtsp_2_frames(rtsp_data.rtsp_url)
 
@@ -255,8 +140,6 @@ async def check_rtsp(rtsp:RTSP,db:Session=Depends(get_db)):
     #     media_type="multipart/x-mixed-replace;boundary=frame"
     # )).start()
 
-    asyncio.create_task(read_rtsp(rtsp_data.rtsp_url))
-
     # 存储已处理信息
     hanle_rtsp_data=HandleRTSPData(rtsp_url=rtsp.rtsp_url,frame_url=f"/static/frames/{rtsp_data.stream_id}.jpg",mjpeg_stream=f"/customer-flow/video-stream/{rtsp_data.stream_id}",name=rtsp_data.name,stream_id=rtsp_data.stream_id)
     app.state.handleRTSPData[rtsp.rtsp_url]=hanle_rtsp_data
@@ -302,8 +185,9 @@ async def video_stream(stream_id: str):
     """推流默认视频流"""
     if stream_id not in stream_objects:
         raise HTTPException(status_code=404, detail="推流不存在")
+    # 复用该路已有的解码和广播，不再每个请求单独打开一次VideoCapture
     return StreamingResponse(
-        rtsp_generate_mjpeg(stream_objects[stream_id]),
+        generate_mjpegV3(stream_objects[stream_id]),
         media_type="multipart/x-mixed-replace;boundary=frame"
     )
 
@@ -320,24 +204,31 @@ async def video_feed(stream_id):
         app.state.stream_manager.consume_frame(rtsp_url),
         media_type='multipart/x-mixed-replace; boundary=frame'
     )
+@app.get('/customer-flow/mjpeg-stats')
+async def mjpeg_stats():
+    """各路MJPEG广播的编码耗时、扇出次数和丢帧统计"""
+    return app.state.stream_manager.mjpeg_stats()
+
+
 @app.post('/customer-flow/custome-analysisV2')
 async def custome_analysisV2(video_config:VideoConfig):
     # 获取传入的视频
     config = video_config.dict()['videos']
     print("videoData:", str(config))
 
-    rtsp_data=app.state.rtsp_datas[config[0]['rtsp_url']]
-
-    print(rtsp_data)
+    # 同一URL的stream_id在注册表中保持不变，解码由分析线程按需打开
+    stream_id=app.state.source_registry.stream_id(config[0]['rtsp_url'])
+    if stream_id is None:
+        raise HTTPException(status_code=404, detail="请先检测RTSP流")
 
     # index=
     index=0
-    mjpeg_list = app.state.stream_manager.setup_streams(config, index, stream_id=rtsp_data.stream_id,show_windows=True)
+    mjpeg_list = app.state.stream_manager.setup_streams(config, index, stream_id=stream_id,show_windows=True)
     print('f返回数据：',str(mjpeg_list))
     #app.state.rtsp_datas[rtsp_url]
 
-    # 启动处理线程 ，存储处理线程的信息,队列信息
-    app.state.video_thread_info[rtsp_data.stream_id] =await app.state.stream_manager.process_video_in_thread(config[0]['rtsp_url'],config[0])
+    # 启动处理线程(或按ANALYSIS_MODE启动分析进程)，存储处理线程的信息,队列信息
+    app.state.video_thread_info[stream_id] =await app.state.stream_manager.start_analysis(config[0]['rtsp_url'],config[0])
 
     # 存储rtsp流信息
     app.state.handleRTSPData[config[0]['rtsp_url']].mjpeg_url=mjpeg_list[0]['mjpeg_url']
@@ -0,0 +1,104 @@
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class FrameRing(object):
+    """
+    每路视频预分配的帧缓冲环
+    - 解码/缩放直接写进槽位 (cap.read(buf) / cv2.resize(dst=buf))，每帧不再新分配整帧数组
+    - 槽位从acquire到release期间被占用，不会被解码线程覆盖；消费方处理完要release
+    - 所有槽位都被占用时临时分配一帧(计入misses)，保证画面不被改写，只是退化成原来的逐帧分配
+    - shared=True 时缓冲区放在共享内存里，分析进程按 shm_name 和槽位下标直接读取，不复制
+    """
+    def __init__(self, shape, size, dtype=np.uint8, shared=False):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.shm = None
+        if shared:
+            nbytes = int(np.prod((size,) + self.shape)) * self.dtype.itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+            self._buffer = np.ndarray((size,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        else:
+            self._buffer = np.empty((size,) + self.shape, dtype=self.dtype)
+        # 每个槽位固定一个视图对象，按id反查槽位
+        self._slots = [self._buffer[i] for i in range(size)]
+        self._index = {id(view): i for i, view in enumerate(self._slots)}
+        self._refs = [0] * size
+        self._cursor = 0
+        self._lock = threading.Lock()
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    @property
+    def shm_name(self):
+        return None if self.shm is None else self.shm.name
+
+    def acquire(self):
+        """取一个空闲槽位(引用计数置1)，从上次的位置往后找；没有空闲槽位时返回新分配的数组"""
+        with self._lock:
+            size = len(self._slots)
+            for step in range(size):
+                i = (self._cursor + step) % size
+                if self._refs[i] == 0:
+                    self._refs[i] = 1
+                    self._cursor = (i + 1) % size
+                    return self._slots[i]
+            self.misses += 1
+        return np.empty(self.shape, dtype=self.dtype)
+
+    def retain(self, frame):
+        """帧要交给多个消费方时增加引用"""
+        i = self._index.get(id(frame))
+        if i is not None:
+            with self._lock:
+                self._refs[i] += 1
+        return frame
+
+    def release(self, frame):
+        """消费方用完后归还槽位，非池内的帧直接忽略"""
+        i = self._index.get(id(frame))
+        if i is None:
+            return
+        with self._lock:
+            if self._refs[i] > 0:
+                self._refs[i] -= 1
+
+    def slot_index(self, frame):
+        """帧在环中的槽位下标，非池内的帧返回None"""
+        return self._index.get(id(frame))
+
+    def slot(self, i):
+        return self._slots[i]
+
+    def in_use(self):
+        with self._lock:
+            return sum(1 for ref in self._refs if ref > 0)
+
+    def close(self):
+        """释放共享内存；还有帧视图没被回收时只删除名字，映射随最后一个引用释放"""
+        if self.shm is None:
+            return
+        shm, self.shm = self.shm, None
+        self._slots, self._index, self._buffer = [], {}, None
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def attach_shared_frames(shm_name, shape, size, dtype=np.uint8):
+    """
+    在分析进程中按名字打开FrameRing的共享内存
+    :return: (shm, frames)，frames[i] 为第i个槽位的视图；用完先丢掉视图再 shm.close()
+    """
+    # spawn出来的子进程和服务进程共用同一个resource_tracker，这里不能unregister，unlink由服务进程负责
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray((size,) + tuple(shape), dtype=dtype, buffer=shm.buf)
+    return shm, frames
@@ -0,0 +1,98 @@
+import threading
+import numpy as np
+
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.search.reid_gallery import ReidGallery
+from libs.reid_sqlV2 import init_db, load_features_from_sqlite, load_exemplars, get_max_person_id, add_feature, \
+    update_feature, touch_feature
+from libs.reid_sqlV2 import add_exemplar as db_add_exemplar
+
+
+class GalleryService(object):
+    """
+    服务进程内唯一的行人库：匹配、注册、样本更新，连同person_id分配和数据库写入
+    - 线程模式下各路ReIDTracker直接调用
+    - 进程模式下分析进程只提取特征，经GalleryClient把请求发回服务进程在这里处理，
+      各摄像头共用同一个检索引擎，person_id也只在这里分配，不会重复
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+    # 分析进程可以远程调用的方法
+    REMOTE_METHODS = ('match', 'add_exemplar', 'remove_person', 'reload')
+
+    @classmethod
+    def get_instance(cls):
+        """单例模式获取行人库，第一次调用时读库"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = GalleryService()
+        return cls._instance
+
+    def __init__(self, db_path=cfgs.DB_PATH, dims=1280):
+        self.db_path = db_path
+        self.dims = dims
+        # 匹配和注册在同一把锁内完成，两路同时看到同一个新人时，后到的会匹配到先注册的
+        self._lock = threading.RLock()
+        init_db(db_path)
+        base_feat_lists, base_idx_lists = load_features_from_sqlite(db_path, cfgs.DB_NAME, dims=dims)
+        print(f'根据数据库中内容，加载行人数量{len(base_feat_lists)}')
+        self.gallery = ReidGallery(base_feat_lists, base_idx_lists, dims=dims)
+        self.gallery.load_exemplars(*load_exemplars(db_path, dims=dims))
+        self.people_count = get_max_person_id(db_path)
+
+    def reload(self, wait=True):
+        """
+        重新读库，后台重建检索引擎并重新加载样本(数据库可能已切换)
+        :param wait: 是否等待新索引生效
+        :return: 库中行人数
+        """
+        with self._lock:
+            base_feat_lists, base_idx_lists = load_features_from_sqlite(self.db_path, cfgs.DB_NAME, dims=self.dims)
+            print(f'根据数据库中内容，加载行人数量{len(base_feat_lists)}')
+            self.gallery.reload_search_engine(base_feat_lists, base_idx_lists, dims=self.dims, wait=wait)
+            self.gallery.load_exemplars(*load_exemplars(self.db_path, dims=self.dims))
+            self.people_count = get_max_person_id(self.db_path)
+            return len(base_idx_lists)
+
+    def match(self, feat, match_thresh, rerank=False):
+        """
+        在行人库中匹配，没有匹配上时注册为新人员
+        :param rerank: 是否做k-reciprocal重排序
+        :return: (person_id, 距离, 是否新注册)
+        """
+        with self._lock:
+            person_id, dist = self.gallery.VecPair(feat, match_thresh, rerank=rerank)
+            if person_id != -1:
+                person_id = int(person_id)
+                # 刷新库中的last_used，常客不会被过期清理删掉
+                touch_feature(self.db_path, person_id)
+                return person_id, float(dist), False
+            self.people_count += 1
+            person_id = self.people_count
+            add_feature(self.db_path, person_id, np.array([feat]))
+            # 增量注册到检索引擎，无需重新读库和重建索引
+            for slot, exemplar in self.gallery.add_person(person_id, feat):
+                db_add_exemplar(self.db_path, person_id, slot, exemplar)
+            print(f'当前行人库中的行人数量：{person_id}')
+            return person_id, float(dist), True
+
+    def add_exemplar(self, person_id, feat):
+        """已注册的行人加入一个样本，库中特征更新为样本质心"""
+        with self._lock:
+            writes, centroid = self.gallery.add_exemplar(person_id, feat)
+            for slot, exemplar in writes:
+                db_add_exemplar(self.db_path, person_id, slot, exemplar)
+            if centroid is not None:
+                update_feature(self.db_path, person_id, centroid)
+
+    def remove_person(self, person_id):
+        """从检索引擎中删除(数据库中的记录由调用方删除)"""
+        with self._lock:
+            return self.gallery.remove_person(person_id)
+
+    def handle(self, method, args):
+        """执行分析进程发来的请求"""
+        if method not in self.REMOTE_METHODS:
+            raise ValueError("method must be one of {}, but got '{}'".format(self.REMOTE_METHODS, method))
+        return getattr(self, method)(*args)
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+MJPEG_BOUNDARY = b'--frame\r\n'
+MJPEG_QUALITY = 70
+
+
+class _Subscriber(object):
+    """一个MJPEG客户端的最新帧槽位，只保留最新一帧，没来得及发送的旧帧直接覆盖"""
+    __slots__ = ('loop', 'event', 'chunk', 'sent', 'dropped')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.chunk = None
+        self.sent = 0
+        self.dropped = 0
+
+
+def _chunk(jpeg):
+    return MJPEG_BOUNDARY + b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+
+
+def _wake(sub):
+    """跨线程唤醒订阅者，客户端的事件循环已关闭时忽略"""
+    try:
+        sub.loop.call_soon_threadsafe(sub.event.set)
+    except RuntimeError:
+        pass
+
+
+class MjpegHub(object):
+    """
+    每路视频的MJPEG广播
+    - 生产方publish帧后立即返回，编码线程只编码最新的一帧，每帧只编码一次
+    - 编码结果(整段multipart数据)放进每个订阅者自己的最新帧槽位，慢的客户端只会丢帧，不拖慢其他客户端
+    - 没有订阅者时publish直接返回，不编码
+    - stats() 返回编码耗时、扇出次数、各类丢帧数
+    """
+    def __init__(self, name='', quality=MJPEG_QUALITY):
+        self.name = name
+        self.quality = quality
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending = None  # (frame, release)
+        self._closed = False
+        self._thread = None
+        self._counters = {'published': 0, 'encoded': 0, 'superseded': 0, 'fanout': 0, 'dropped_slow': 0}
+        self._encode_ms = deque(maxlen=256)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, frame, release=None):
+        """
+        提交一帧，编码在hub的编码线程里进行
+        :param release: 帧用完后的回调(如归还帧环槽位)，不编码或被更新的帧顶替时也会调用
+        :return: 是否被接收(没有订阅者时为False)
+        """
+        superseded = None
+        with self._cond:
+            if self._closed or not self._subscribers:
+                accepted = False
+            else:
+                accepted = True
+                superseded = self._pending
+                self._pending = (frame, release)
+                self._counters['published'] += 1
+                if superseded is not None:
+                    self._counters['superseded'] += 1
+                self._cond.notify()
+        if not accepted:
+            superseded = (frame, release)
+        if superseded is not None and superseded[1] is not None:
+            superseded[1](superseded[0])
+        return accepted
+
+    def publish_encoded(self, jpeg):
+        """发布已经编码好的JPEG(如分析进程里编码的标注画面)，在调用线程里直接扇出，不再编码"""
+        with self._lock:
+            if self._closed or not self._subscribers:
+                return False
+            self._counters['published'] += 1
+        self._fanout(_chunk(jpeg))
+        return True
+
+    async def stream(self):
+        """单个客户端的MJPEG生成器，连接期间计入订阅者"""
+        sub = _Subscriber(asyncio.get_running_loop())
+        with self._cond:
+            self._subscribers.add(sub)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='MjpegHub-{}'.format(self.name), daemon=True)
+                self._thread.start()
+        try:
+            while not self._closed:
+                await sub.event.wait()
+                sub.event.clear()
+                with self._lock:
+                    chunk, sub.chunk = sub.chunk, None
+                if chunk is not None:
+                    sub.sent += 1
+                    yield chunk
+        finally:
+            with self._lock:
+                self._subscribers.discard(sub)
+
+    def close(self):
+        """停止编码线程并结束所有客户端的生成器"""
+        with self._cond:
+            self._closed = True
+            pending, self._pending = self._pending, None
+            subscribers = list(self._subscribers)
+            self._cond.notify_all()
+        if pending is not None and pending[1] is not None:
+            pending[1](pending[0])
+        for sub in subscribers:
+            _wake(sub)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['subscribers'] = len(self._subscribers)
+            stats['dropped_by_subscriber'] = [sub.dropped for sub in self._subscribers]
+            encode_ms = list(self._encode_ms)
+        stats['encode_ms_avg'] = float(np.mean(encode_ms)) if encode_ms else 0.0
+        stats['encode_ms_max'] = float(np.max(encode_ms)) if encode_ms else 0.0
+        return stats
+
+    def _encode(self, frame):
+        _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        return _chunk(buffer.tobytes())
+
+    def _fanout(self, chunk):
+        """把一段multipart数据放进每个订阅者的槽位，旧的没发出去就算这个客户端丢帧"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            for sub in subscribers:
+                if sub.chunk is not None:
+                    sub.dropped += 1
+                    self._counters['dropped_slow'] += 1
+                sub.chunk = chunk
+            self._counters['fanout'] += len(subscribers)
+        for sub in subscribers:
+            _wake(sub)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    return
+                (frame, release), self._pending = self._pending, None
+            start = time.perf_counter()
+            try:
+                chunk = self._encode(frame)
+            except Exception as e:
+                print('MjpegHub {} 编码出错: {}'.format(self.name, e))
+                continue
+            finally:
+                if release is not None:
+                    release(frame)
+            encode_ms = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self._counters['encoded'] += 1
+                self._encode_ms.append(encode_ms)
+            self._fanout(chunk)
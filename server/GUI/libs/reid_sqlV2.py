@@ -8,11 +8,17 @@
 @Describe: 改进版本，添加连接池管理
 '''
 
+import os
+import glob
+import json
+import uuid
 import numpy as np
 import sqlite3
 from Algorithm.libs.logger.log import get_logger
 import Algorithm.libs.config.model_cfgs as cfgs
 import time
+import queue
+import atexit
 import threading
 from contextlib import contextmanager
 
@@ -20,6 +26,23 @@ log_info = get_logger(__name__)
 ISLOG = cfgs.ISLOG
 
 
+def open_connection(db_path, profile=None, synchronous=None):
+    """
+    按连接配置打开数据库连接
+    :param profile: cfgs.DB_PROFILES中的配置名，默认cfgs.DB_CONNECTION_PROFILE
+    :param synchronous: 覆盖配置中的synchronous
+    """
+    settings = cfgs.DB_PROFILES[profile or cfgs.DB_CONNECTION_PROFILE]
+    conn = sqlite3.connect(db_path, timeout=cfgs.DB_BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=cfgs.DB_STATEMENT_CACHE)
+    conn.execute(f"PRAGMA journal_mode={settings['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous={synchronous or settings['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size={int(settings['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size={int(settings['cache_size'])}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
 # 定义连接池类
 class ConnectionPool:
     _instance = None
@@ -36,104 +59,74 @@ class ConnectionPool:
 
     def __init__(self):
         """初始化连接池"""
-        self.pool = {}  # 格式: {db_path: {conn: connection, lock: lock, last_used: timestamp}}
+        self.pool = {}  # 格式: {db_path: {connections: [conn], in_use: set(conn), db_lock: lock}}
         self.pool_lock = threading.Lock()
-        self.max_connections = 5  # 每个数据库文件的最大连接数
+        self.max_connections = cfgs.DB_POOL_SIZE  # 每个数据库文件的最大连接数
         self.connection_timeout = 60  # 连接空闲超时时间（秒）
 
-    # 改进连接池释放连接的逻辑
-    def release_connection(self, db_path, conn):
-        """释放连接回连接池"""
+    def release_connection(self, db_path, conn, broken=False):
+        """
+        释放连接回连接池
+        不再每次执行SELECT 1检查，只有使用过程中出错(broken)的连接才关闭丢弃
+        """
         with self.pool_lock:
-            if db_path not in self.pool:
-                # 如果连接池中没有这个数据库的条目，直接关闭连接
-                conn.close()
+            pool_entry = self.pool.get(db_path)
+            if pool_entry is None or conn not in pool_entry["in_use"]:
+                # 连接池已清空或不属于连接池，直接关闭连接
+                try:
+                    conn.close()
+                except:
+                    pass
                 return
 
-            pool_entry = self.pool[db_path]
-            if conn in pool_entry["in_use"]:
-                # 检查连接是否仍然有效
+            pool_entry["in_use"].remove(conn)
+            if broken:
                 try:
-                    # 执行一个简单的查询来测试连接
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT 1")
-                    cursor.fetchone()
-
-                    # 连接有效，添加回池中
-                    pool_entry["in_use"].remove(conn)
-                    pool_entry["connections"].append(conn)
-                    if ISLOG:
-                        log_info.info(
-                            f"释放连接到连接池: {db_path}, 可用连接: {len(pool_entry['connections'])}, 使用中连接: {len(pool_entry['in_use'])}")
-                except sqlite3.Error:
-                    # 连接已无效，从使用中移除但不添加回池
-                    pool_entry["in_use"].remove(conn)
-                    try:
-                        conn.close()
-                    except:
-                        pass
-                    if ISLOG:
-                        log_info.warning(f"移除无效连接: {db_path}")
+                    conn.close()
+                except:
+                    pass
+                if ISLOG:
+                    log_info.warning(f"移除无效连接: {db_path}")
+            else:
+                pool_entry["connections"].append(conn)
 
-    # 改进连接获取逻辑，确保返回有效连接
     def get_connection(self, db_path):
-        """获取数据库连接"""
-        with self.pool_lock:
-            # 初始化数据库连接池条目
-            if db_path not in self.pool:
-                self.pool[db_path] = {
-                    "connections": [],
-                    "in_use": set(),
-                    "db_lock": threading.Lock()
-                }
-
-            pool_entry = self.pool[db_path]
-
-            # 尝试获取现有连接并验证其有效性
-            while pool_entry["connections"]:
-                conn = pool_entry["connections"].pop()
-                try:
-                    # 验证连接是否有效
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT 1")
-                    cursor.fetchone()
-
-                    # 连接有效，可以使用
+        """获取数据库连接，空闲连接直接复用，不足时按连接配置新建"""
+        warned = False
+        while True:
+            with self.pool_lock:
+                # 初始化数据库连接池条目
+                if db_path not in self.pool:
+                    self.pool[db_path] = {
+                        "connections": [],
+                        "in_use": set(),
+                        "db_lock": threading.Lock()
+                    }
+
+                pool_entry = self.pool[db_path]
+                if pool_entry["connections"]:
+                    conn = pool_entry["connections"].pop()
                     pool_entry["in_use"].add(conn)
                     return conn
-                except sqlite3.Error:
-                    # 连接已失效，忽略并尝试下一个
-                    try:
-                        conn.close()
-                    except:
-                        pass
-                    if ISLOG:
-                        log_info.warning(f"移除池中无效连接: {db_path}")
 
-            # 如果没有可用连接且未达到最大连接数，创建新连接
-            if len(pool_entry["in_use"]) < self.max_connections:
-                try:
-                    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+                # 如果没有可用连接且未达到最大连接数，创建新连接
+                if len(pool_entry["in_use"]) < self.max_connections:
+                    try:
+                        conn = open_connection(db_path)
+                    except sqlite3.Error as e:
+                        if ISLOG:
+                            log_info.error(f"创建数据库连接错误: {e}")
+                        raise
                     pool_entry["in_use"].add(conn)
                     if ISLOG:
                         log_info.info(f"创建新数据库连接: {db_path}, 当前连接数: {len(pool_entry['in_use'])}")
                     return conn
-                except sqlite3.Error as e:
-                    if ISLOG:
-                        log_info.error(f"创建数据库连接错误: {e}")
-                    raise
 
-            # 如果已达到最大连接数，等待并重试
-            if ISLOG:
+            # 如果已达到最大连接数，等待可用连接后重试
+            if ISLOG and not warned:
                 log_info.warning(f"已达到最大连接数 {self.max_connections}，等待可用连接...")
-
-            # 释放连接池锁，等待一个连接被释放
-            self.pool_lock.release()
-            time.sleep(0.1)
-            self.pool_lock.acquire()
-
-            # 再次尝试获取连接
-            return self.get_connection(db_path)
+                warned = True
+            time.sleep(0.01)
 
     def close_all_connections(self):
         """关闭所有连接"""
@@ -178,16 +171,207 @@ _connection_pool = ConnectionPool.get_instance()
 _db_lock = threading.Lock()
 
 
+# 特征库异步写入
+class FeatureWriter:
+    """
+    特征库写入队列(write-behind)
+    - add/update/delete只把操作放入有界队列，立即返回，不在帧处理线程上等待commit
+    - 单个写线程在 interval 秒内或攒够 batch_size 条后，把同一数据库的操作合并为一个事务提交
+    - 读操作前调用flush保证能读到之前的写入，进程退出时自动flush
+    - 数据库被锁/忙时按退避重试；其他错误把批次对半拆开重提，只丢弃出错的那一条
+    - 队列只在内存里，进程崩溃或断电时还没提交的操作会丢失；crash_safe只保证已提交的批次落盘
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    _SQL = {
+        'add': f"INSERT INTO {cfgs.DB_NAME} (person_id, feature_vector, last_used, is_locked) VALUES (?, ?, ?, 0)",
+        'update': f"UPDATE {cfgs.DB_NAME} SET feature_vector=?, last_used=? WHERE person_id=?",
+        'delete': f"DELETE FROM {cfgs.DB_NAME} WHERE person_id=?",
+        'touch': f"UPDATE {cfgs.DB_NAME} SET last_used=? WHERE person_id=?",
+        'exemplar': f"INSERT OR REPLACE INTO {cfgs.DB_NAME}_exemplars (person_id, slot, feature_vector, created) "
+                    f"VALUES (?, ?, ?, ?)",
+        'exemplar_count': f"UPDATE {cfgs.DB_NAME} SET num_exemplars=num_exemplars+1 WHERE person_id=?",
+    }
+
+    @classmethod
+    def get_instance(cls):
+        """单例模式获取写入队列"""
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = FeatureWriter()
+        return cls._instance
+
+    def __init__(self, interval=cfgs.DB_WRITE_INTERVAL, batch_size=cfgs.DB_WRITE_BATCH,
+                 max_pending=cfgs.DB_WRITE_QUEUE_SIZE, crash_safe=cfgs.DB_WRITE_CRASH_SAFE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.crash_safe = crash_safe
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._conns = {}  # 写线程专用连接 {db_path: connection}
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='FeatureWriter', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, op, db_path, person_id, feature=None, slot=None):
+        """提交一次写操作，feature在这里转成bytes，调用方之后修改数组不影响写入内容"""
+        item = (op, db_path, int(person_id), None if feature is None else encode_feature(feature), int(time.time()), slot)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if ISLOG:
+                log_info.warning(f"特征写入队列已满({self._queue.maxsize})，等待写线程")
+            self._queue.put(item)
+
+    def flush(self, timeout=None):
+        """等待此前提交的写操作全部提交到数据库"""
+        if self._closed or threading.current_thread() is self._thread:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """写完队列中剩余操作后停止写线程"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        """阻塞取第一条，然后在interval内继续收集，遇到flush/stop标记立即提交"""
+        items = [self._queue.get()]
+        deadline = time.perf_counter() + self.interval
+        while len(items) < self.batch_size and isinstance(items[-1], tuple):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _connection(self, db_path):
+        conn = self._conns.get(db_path)
+        if conn is None:
+            conn = open_connection(db_path, synchronous='FULL' if self.crash_safe else None)
+            self._conns[db_path] = conn
+        return conn
+
+    def _execute(self, conn, ops):
+        """在一个事务里执行一批操作，主键重复的插入只记录日志"""
+        with conn:
+            for op, _, person_id, blob, ts, slot in ops:
+                if op == 'add':
+                    params = (person_id, blob, ts)
+                elif op == 'update':
+                    params = (blob, ts, person_id)
+                elif op == 'touch':
+                    params = (ts, person_id)
+                elif op == 'exemplar':
+                    params = (person_id, slot, blob, ts)
+                    conn.execute(self._SQL['exemplar_count'], (person_id,))
+                else:
+                    params = (person_id,)
+                try:
+                    conn.execute(self._SQL[op], params)
+                except sqlite3.IntegrityError as e:
+                    if ISLOG:
+                        log_info.warning(f"person_id {person_id} already exists. {e}")
+
+    @staticmethod
+    def _is_busy(e):
+        """数据库被其他连接锁住/忙，属于可重试的错误"""
+        msg = str(e).lower()
+        return isinstance(e, sqlite3.OperationalError) and ('locked' in msg or 'busy' in msg)
+
+    def _write(self, db_path, ops):
+        conn = self._connection(db_path)
+        delay = cfgs.DB_WRITE_RETRY_DELAY
+        for attempt in range(cfgs.DB_WRITE_RETRIES + 1):
+            try:
+                self._execute(conn, ops)
+                if ISLOG:
+                    log_info.info(f"特征库批量提交: {db_path}, 操作数: {len(ops)}")
+                return
+            except sqlite3.Error as e:
+                error = e
+                if not self._is_busy(e) or attempt == cfgs.DB_WRITE_RETRIES:
+                    break
+                if ISLOG:
+                    log_info.warning(f"特征库被锁，{delay:.2f}秒后重试({attempt + 1}/{cfgs.DB_WRITE_RETRIES}): {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+        if self._is_busy(error):
+            # 重试用完仍被锁，拆批也没用
+            if ISLOG:
+                log_info.error(f"特征库持续被锁，丢弃 {len(ops)} 条操作: {error}")
+            return
+        if len(ops) == 1:
+            if ISLOG:
+                log_info.error(f"特征写入失败，丢弃 {ops[0][0]} person_id={ops[0][2]}: {error}")
+            return
+        # 对半拆开重提，一条坏数据不连累同批的其他操作
+        mid = len(ops) // 2
+        self._write(db_path, ops[:mid])
+        self._write(db_path, ops[mid:])
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            groups = {}
+            for item in items:
+                if isinstance(item, tuple):
+                    groups.setdefault(item[1], []).append(item)
+            for db_path, ops in groups.items():
+                self._write(db_path, ops)
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if items[-1] is None:
+                break
+        for conn in self._conns.values():
+            try:
+                conn.close()
+            except:
+                pass
+        self._conns.clear()
+
+
+def _flush_pending_writes():
+    """读取/清空数据库前先把排队中的写操作落库"""
+    if FeatureWriter._instance is not None:
+        FeatureWriter._instance.flush()
+
+
+def flush_features(timeout=None):
+    """等待排队中的特征写入完成"""
+    if FeatureWriter._instance is None:
+        return True
+    return FeatureWriter._instance.flush(timeout)
+
+
 @contextmanager
 def _get_connection_context(db_path):
     """连接上下文管理器，自动释放连接"""
-    conn = None
+    conn = _connection_pool.get_connection(db_path)
+    broken = False
     try:
-        conn = _connection_pool.get_connection(db_path)
         yield conn
+    except sqlite3.Error:
+        # 出错后回滚，回滚失败说明连接已不可用
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            broken = True
+        raise
     finally:
-        if conn:
-            _connection_pool.release_connection(db_path, conn)
+        _connection_pool.release_connection(db_path, conn, broken)
 
 
 def _get_connection(db_path):
@@ -229,7 +413,8 @@ def init_db(db_path):
                 person_id INTEGER NOT NULL UNIQUE,
                 feature_vector BLOB NOT NULL,
                 last_used INTEGER DEFAULT {int(time.time())},
-                is_locked INTEGER DEFAULT 0
+                is_locked INTEGER DEFAULT 0,
+                num_exemplars INTEGER DEFAULT 0
             )
             """)
             conn.commit()
@@ -252,8 +437,114 @@ def init_db(db_path):
                 if ISLOG:
                     log_info.info(f"为表 {cfgs.DB_NAME} 添加了 is_locked 列")
 
+            # 如果缺少num_exemplars列，添加它
+            if 'num_exemplars' not in columns:
+                cursor.execute(f"ALTER TABLE {cfgs.DB_NAME} ADD COLUMN num_exemplars INTEGER DEFAULT 0")
+                if ISLOG:
+                    log_info.info(f"为表 {cfgs.DB_NAME} 添加了 num_exemplars 列")
+
             conn.commit()
 
+        _init_change_log(conn)
+        _init_exemplars(conn)
+
+
+def _init_exemplars(conn):
+    """每人最多EXEMPLAR_MAX个样本特征，slot为环形缓冲中的位置；主表只存质心"""
+    table = cfgs.DB_NAME
+    conn.executescript(f"""
+    CREATE TABLE IF NOT EXISTS {table}_exemplars (
+        person_id INTEGER NOT NULL,
+        slot INTEGER NOT NULL,
+        feature_vector BLOB NOT NULL,
+        created INTEGER,
+        PRIMARY KEY (person_id, slot)
+    );
+    CREATE TRIGGER IF NOT EXISTS {table}_drop_exemplars AFTER DELETE ON {table}
+    BEGIN DELETE FROM {table}_exemplars WHERE person_id = OLD.person_id; END;
+    """)
+    conn.commit()
+
+
+def _init_change_log(conn):
+    """
+    创建变更日志表和触发器，记录每次增删改的person_id，快照据此只读取增量。
+    meta表中的gallery_id标识这个数据库，避免删库重建后误用旧快照。
+    """
+    table = cfgs.DB_NAME
+    conn.executescript(f"""
+    CREATE TABLE IF NOT EXISTS {table}_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        person_id INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS {table}_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TRIGGER IF NOT EXISTS {table}_log_insert AFTER INSERT ON {table}
+    BEGIN INSERT INTO {table}_changes (person_id) VALUES (NEW.person_id); END;
+    -- 只记录特征和person_id的变化，last_used/num_exemplars这类刷新不进日志；旧库里的触发器先删掉重建
+    DROP TRIGGER IF EXISTS {table}_log_update;
+    CREATE TRIGGER {table}_log_update AFTER UPDATE OF feature_vector, person_id ON {table}
+    BEGIN
+        INSERT INTO {table}_changes (person_id) VALUES (OLD.person_id);
+        INSERT INTO {table}_changes (person_id) SELECT NEW.person_id WHERE NEW.person_id != OLD.person_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {table}_log_delete AFTER DELETE ON {table}
+    BEGIN INSERT INTO {table}_changes (person_id) VALUES (OLD.person_id); END;
+    """)
+    conn.execute(f"INSERT OR IGNORE INTO {table}_meta (key, value) VALUES ('gallery_id', ?)", (uuid.uuid4().hex,))
+    conn.commit()
+
+
+def encode_feature(feature, dtype=None):
+    """
+    特征转为BLOB，格式由 DB_FEATURE_DTYPE 决定
+    - float32: dims*4 字节
+    - float16: dims*2 字节
+    - int8: 4字节float32缩放系数 + dims字节，feature ≈ int8 * scale
+    """
+    dtype = dtype or cfgs.DB_FEATURE_DTYPE
+    feature = np.asarray(feature, dtype=np.float32).ravel()
+    if dtype == 'float32':
+        return feature.tobytes()
+    if dtype == 'float16':
+        return feature.astype(np.float16).tobytes()
+    if dtype == 'int8':
+        scale = np.float32(max(float(np.abs(feature).max()), 1e-12) / 127.0)
+        codes = np.clip(np.rint(feature / scale), -127, 127).astype(np.int8)
+        return scale.tobytes() + codes.tobytes()
+    raise ValueError(f"不支持的特征存储格式: {dtype}")
+
+
+def _decode_same_size(data, count, size, dims):
+    if size == dims * 4:
+        return np.frombuffer(data, dtype=np.float32).reshape(count, dims)
+    if size == dims * 2:
+        return np.frombuffer(data, dtype=np.float16).reshape(count, dims).astype(np.float32)
+    if size == dims + 4:
+        rows = np.frombuffer(data, dtype=np.dtype([('scale', '<f4'), ('codes', 'i1', (dims,))]))
+        return rows['codes'].astype(np.float32) * rows['scale'][:, None]
+    raise ValueError(f"特征维度与dims={dims}不一致")
+
+
+def decode_features(blobs, dims):
+    """
+    批量解码特征BLOB为 (N, dims) float32，按长度识别 float32/float16/int8 格式
+    切换 DB_FEATURE_DTYPE 后新旧格式可以混存在同一张表里
+    """
+    blobs = list(blobs)
+    if not blobs:
+        return np.empty((0, dims), dtype=np.float32)
+    sizes = np.fromiter((len(blob) for blob in blobs), dtype=np.int64, count=len(blobs))
+    if (sizes == sizes[0]).all():
+        return _decode_same_size(b''.join(blobs), len(blobs), int(sizes[0]), dims)
+    features = np.empty((len(blobs), dims), dtype=np.float32)
+    for size in np.unique(sizes).tolist():
+        rows = np.flatnonzero(sizes == size)
+        features[rows] = _decode_same_size(b''.join(blobs[i] for i in rows), len(rows), size, dims)
+    return features
+
 
 # 存储多个特征向量
 def save_features_to_sqlite(db_path, data, person_ids):
@@ -263,12 +554,13 @@ def save_features_to_sqlite(db_path, data, person_ids):
     :param data: NumPy 数组，形状为 (n_samples, n_features)
     :param person_ids: 对应的行人 ID 列表
     """
+    _flush_pending_writes()
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
         current_time = int(time.time())
 
         for i, feature in enumerate(data):
-            feature_blob = feature.tobytes()  # 将 NumPy 数组转换为二进制数据
+            feature_blob = encode_feature(feature)
             try:
                 cursor.execute(
                     f"INSERT INTO {cfgs.DB_NAME} (person_id, feature_vector, last_used, is_locked) VALUES (?, ?, ?, ?)",
@@ -289,54 +581,202 @@ def load_features_from_file(db_path):
     :param db_path: 数据库文件路径
     :return: (feat_list, label_list) 特征向量列表和对应的行人 ID 列表
     """
+    _flush_pending_writes()
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
 
         cursor.execute(f"SELECT person_id, feature_vector FROM {cfgs.DB_NAME}")
-        feat_list, label_list = [], []
-
-        for row in cursor.fetchall():
-            person_id = row[0]
-            feature_blob = row[1]
-            label_list.append(person_id)
-            feat_list.append(np.frombuffer(feature_blob, dtype=np.float32))
+        rows = cursor.fetchall()
+        label_list = [row[0] for row in rows]
+        feat_list = list(decode_features((row[1] for row in rows), cfgs.DIMS))
 
         return feat_list, label_list
 
 
-# 读取特征向量
-# 修改load_features_from_sqlite函数
-def load_features_from_sqlite(db_path, db_name, dims):
+def _read_gallery(conn, db_name, dims, chunk_size=1024, where='', params=()):
+    """在调用方的读事务内，把查询到的特征按块解码写入预分配的连续数组"""
+    total = conn.execute(f"SELECT COUNT(*) FROM {db_name} {where}", params).fetchone()[0]
+    features = np.empty((total, dims), dtype=np.float32)
+    person_ids = np.empty((total,), dtype=np.int64)
+
+    cursor = conn.execute(f"SELECT person_id, feature_vector FROM {db_name} {where}", params)
+    start = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        ids, blobs = zip(*rows)
+        end = start + len(rows)
+        features[start:end] = decode_features(blobs, dims)
+        person_ids[start:end] = ids
+        start = end
+    return features, person_ids
+
+
+@contextmanager
+def _read_transaction(db_path):
+    """读事务，事务内多条查询看到同一份数据"""
+    with _get_connection_context(db_path) as conn:
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+
+# 批量读取特征库
+def load_gallery(db_path, db_name, dims, chunk_size=1024):
     """
-    从数据库中读取所有特征向量及其对应的 person_id。
+    一次性读取整个特征库到连续内存
+    先按行数预分配 (N, dims) float32 数组，再按块把BLOB拼接后直接写入，
+    不生成逐行的numpy对象，也不会修改数据库(last_used不变)。
     :param db_path: 数据库文件路径
     :param db_name: 数据库表名
     :param dims: 特征向量维度
-    :return: (features, person_ids) 特征向量列表和对应的行人 ID 列表
+    :param chunk_size: 每次fetch的行数
+    :return: (features, person_ids) (N, dims) float32数组 和 (N,) int64数组
     """
-    with _get_connection_context(db_path) as conn:
-        cursor = conn.cursor()
+    _flush_pending_writes()
+    with _read_transaction(db_path) as conn:
+        return _read_gallery(conn, db_name, dims, chunk_size)
 
-        # 检查last_used列是否存在
-        cursor.execute(f"PRAGMA table_info({db_name})")
-        columns = [column[1] for column in cursor.fetchall()]
 
-        # 如果存在last_used列，更新时间戳
-        if 'last_used' in columns:
-            current_time = int(time.time())
-            cursor.execute(f"UPDATE {db_name} SET last_used=?", (current_time,))
-            conn.commit()
+# 特征库快照
+_SNAPSHOT_VERSION = 1
+_snapshot_lock = threading.Lock()
 
-        # 读取特征数据
-        cursor.execute(f"SELECT person_id, feature_vector FROM {db_name}")
-        feat_list, label_list = [], []
 
-        for row in cursor.fetchall():
-            label_list.append(row[0])
-            feature = np.frombuffer(row[1], dtype='float32').reshape(dims)
-            feat_list.append(feature)
+def _snapshot_dir(db_path):
+    return db_path + '.snapshot'
 
-        return feat_list, label_list
+
+def _gallery_id(conn, db_name):
+    row = conn.execute(f"SELECT value FROM {db_name}_meta WHERE key='gallery_id'").fetchone()
+    return row[0] if row else None
+
+
+def _last_change(conn, db_name):
+    return conn.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {db_name}_changes").fetchone()[0]
+
+
+def _read_snapshot_header(db_path):
+    try:
+        with open(os.path.join(_snapshot_dir(db_path), 'header.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_gallery_snapshot(db_path, db_name, dims):
+    """
+    把当前特征库写成快照: feats_<seq>.npy (N, dims) float32, ids_<seq>.npy (N,) int64,
+    header.json记录行数/维度/版本/对应的变更序号，最后原子替换header完成切换
+    :return: 快照对应的变更序号
+    """
+    _flush_pending_writes()
+    with _snapshot_lock:
+        with _read_transaction(db_path) as conn:
+            seq = _last_change(conn, db_name)
+            gallery_id = _gallery_id(conn, db_name)
+            features, person_ids = _read_gallery(conn, db_name, dims)
+
+        snapshot_dir = _snapshot_dir(db_path)
+        os.makedirs(snapshot_dir, exist_ok=True)
+        for name, array in (('feats', features), ('ids', person_ids)):
+            path = os.path.join(snapshot_dir, f'{name}_{seq}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+
+        old_header = _read_snapshot_header(db_path)
+        header = dict(version=_SNAPSHOT_VERSION, gallery_id=gallery_id, seq=seq,
+                      rows=int(len(person_ids)), dims=int(dims), created=int(time.time()))
+        header_path = os.path.join(snapshot_dir, 'header.json')
+        with open(header_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+        os.replace(header_path + '.tmp', header_path)
+
+        # 保留上一代快照之后的变更日志，正在读取旧header的进程仍能拿到完整增量
+        if old_header and old_header.get('gallery_id') == gallery_id:
+            with _get_connection_context(db_path) as conn:
+                conn.execute(f"DELETE FROM {db_name}_changes WHERE seq <= ?", (min(old_header['seq'], seq),))
+                conn.commit()
+        for path in glob.glob(os.path.join(snapshot_dir, '*.npy')):
+            if not path.endswith(f'_{seq}.npy'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Windows下仍被其他进程映射的文件删不掉，下次再清理
+                    pass
+
+    if ISLOG:
+        log_info.info(f"特征库快照已更新: {snapshot_dir}, 行数: {len(person_ids)}, seq: {seq}")
+    return seq
+
+
+def load_gallery_snapshot(db_path, db_name, dims):
+    """
+    从快照加载特征库: memmap快照文件，再只从SQLite读取快照之后变更过的person_id。
+    没有增量时直接返回只读memmap，多进程共享同一份页缓存；
+    快照缺失/版本不符时退回全量读取，增量过多时重新生成快照。
+    :return: (features, person_ids)，与load_gallery相同
+    """
+    _flush_pending_writes()
+    header = _read_snapshot_header(db_path)
+    try:
+        with _read_transaction(db_path) as conn:
+            gallery_id = _gallery_id(conn, db_name)
+            valid = header is not None and header.get('version') == _SNAPSHOT_VERSION \
+                and header.get('gallery_id') == gallery_id and header.get('dims') == dims
+            if valid:
+                seq = header['seq']
+                num_changes = conn.execute(f"SELECT COUNT(*) FROM {db_name}_changes WHERE seq > ?",
+                                           (seq,)).fetchone()[0]
+                valid = num_changes <= cfgs.GALLERY_SNAPSHOT_REBUILD
+            if valid:
+                changed_ids = np.array([row[0] for row in conn.execute(
+                    f"SELECT DISTINCT person_id FROM {db_name}_changes WHERE seq > ?", (seq,))], dtype=np.int64)
+                delta_feats, delta_ids = _read_gallery(
+                    conn, db_name, dims,
+                    where=f"WHERE person_id IN (SELECT person_id FROM {db_name}_changes WHERE seq > ?)",
+                    params=(seq,))
+    except sqlite3.OperationalError as e:
+        # 旧数据库还没有变更日志表(未执行init_db)
+        if ISLOG:
+            log_info.warning(f"特征库无变更日志，改为全量读取: {e}")
+        return load_gallery(db_path, db_name, dims)
+
+    if not valid:
+        save_gallery_snapshot(db_path, db_name, dims)
+        return load_gallery_snapshot(db_path, db_name, dims)
+
+    snapshot_dir = _snapshot_dir(db_path)
+    try:
+        features = np.load(os.path.join(snapshot_dir, f'feats_{seq}.npy'), mmap_mode='r')
+        person_ids = np.load(os.path.join(snapshot_dir, f'ids_{seq}.npy'))
+    except (OSError, ValueError) as e:
+        if ISLOG:
+            log_info.warning(f"读取特征库快照失败，改为全量读取: {e}")
+        return load_gallery(db_path, db_name, dims)
+
+    if len(changed_ids) == 0:
+        return features, person_ids
+    keep = ~np.isin(person_ids, changed_ids)
+    return np.concatenate([features[keep], delta_feats]), np.concatenate([person_ids[keep], delta_ids])
+
+
+# 读取特征向量
+def load_features_from_sqlite(db_path, db_name, dims):
+    """
+    从数据库中读取所有特征向量及其对应的 person_id。
+    :param db_path: 数据库文件路径
+    :param db_name: 数据库表名
+    :param dims: 特征向量维度
+    :return: (features, person_ids) (N, dims) float32数组和对应的行人 ID 数组
+    """
+    if cfgs.GALLERY_SNAPSHOT:
+        return load_gallery_snapshot(db_path, db_name, dims)
+    return load_gallery(db_path, db_name, dims)
 
 
 # 获取最大person_id
@@ -346,6 +786,7 @@ def get_max_person_id(db_path):
     :param db_path: 数据库文件路径
     :return: 最大行人 ID（整数）。如果数据库为空，返回 None。
     """
+    _flush_pending_writes()
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
 
@@ -360,15 +801,19 @@ def get_max_person_id(db_path):
 # 添加特征向量
 def add_feature(db_path, person_id, feature):
     """
-    添加单条特征向量到数据库。
+    添加单条特征向量到数据库（默认进入写入队列异步提交）。
     :param db_path: 数据库文件路径
     :param person_id: 行人 ID
     :param feature: NumPy 数组（特征向量）
     """
+    if cfgs.DB_WRITE_BEHIND:
+        FeatureWriter.get_instance().submit('add', db_path, person_id, feature)
+        return
+
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
 
-        feature_blob = feature.tobytes()  # 将 NumPy 数组转换为二进制数据
+        feature_blob = encode_feature(feature)
         current_time = int(time.time())  # 获取当前时间戳
 
         try:
@@ -385,15 +830,19 @@ def add_feature(db_path, person_id, feature):
 # 更新特征向量
 def update_feature(db_path, person_id, feature):
     """
-    更新特征向量
+    更新特征向量（默认进入写入队列异步提交）
     :param db_path: 数据库文件路径
     :param person_id: 行人 ID
     :param feature: 新的特征向量
     """
+    if cfgs.DB_WRITE_BEHIND:
+        FeatureWriter.get_instance().submit('update', db_path, person_id, feature)
+        return
+
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
 
-        feature_blob = feature.tobytes()
+        feature_blob = encode_feature(feature)
         current_time = int(time.time())
 
         cursor.execute(
@@ -403,13 +852,33 @@ def update_feature(db_path, person_id, feature):
         conn.commit()
 
 
+# 刷新最近使用时间
+def touch_feature(db_path, person_id):
+    """
+    匹配到已有人员时刷新last_used，避免常客被过期清理删除（默认进入写入队列，随批次一起提交）
+    :param db_path: 数据库文件路径
+    :param person_id: 行人 ID
+    """
+    if cfgs.DB_WRITE_BEHIND:
+        FeatureWriter.get_instance().submit('touch', db_path, person_id)
+        return
+
+    with _get_connection_context(db_path) as conn:
+        conn.execute(FeatureWriter._SQL['touch'], (int(time.time()), person_id))
+        conn.commit()
+
+
 # 删除特征向量
 def delete_feature(db_path, person_id):
     """
-    从数据库中删除特征向量
+    从数据库中删除特征向量（默认进入写入队列异步提交）
     :param db_path: 数据库文件路径
     :param person_id: 要删除的行人 ID
     """
+    if cfgs.DB_WRITE_BEHIND:
+        FeatureWriter.get_instance().submit('delete', db_path, person_id)
+        return
+
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
 
@@ -417,6 +886,54 @@ def delete_feature(db_path, person_id):
         conn.commit()
 
 
+# 添加样本特征
+def add_exemplar(db_path, person_id, slot, feature):
+    """
+    写入行人的一个样本特征到环形缓冲的slot位置（默认进入写入队列异步提交）
+    :param db_path: 数据库文件路径
+    :param person_id: 行人 ID
+    :param slot: 环形缓冲中的位置
+    :param feature: NumPy 数组（特征向量）
+    """
+    if cfgs.DB_WRITE_BEHIND:
+        FeatureWriter.get_instance().submit('exemplar', db_path, person_id, feature, slot)
+        return
+
+    with _get_connection_context(db_path) as conn:
+        conn.execute(FeatureWriter._SQL['exemplar'], (person_id, slot, encode_feature(feature), int(time.time())))
+        conn.execute(FeatureWriter._SQL['exemplar_count'], (person_id,))
+        conn.commit()
+
+
+# 读取全部样本特征
+def load_exemplars(db_path, dims, chunk_size=1024):
+    """
+    读取所有行人的样本特征
+    :return: (person_ids (M,), slots (M,), features (M, dims), {person_id: 累计样本数})
+    """
+    _flush_pending_writes()
+    table = cfgs.DB_NAME
+    with _read_transaction(db_path) as conn:
+        counts = dict(conn.execute(f"SELECT person_id, num_exemplars FROM {table} WHERE num_exemplars > 0"))
+        total = conn.execute(f"SELECT COUNT(*) FROM {table}_exemplars").fetchone()[0]
+        person_ids = np.empty((total,), dtype=np.int64)
+        slots = np.empty((total,), dtype=np.int64)
+        features = np.empty((total, dims), dtype=np.float32)
+        cursor = conn.execute(f"SELECT person_id, slot, feature_vector FROM {table}_exemplars")
+        start = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            ids, row_slots, blobs = zip(*rows)
+            end = start + len(rows)
+            features[start:end] = decode_features(blobs, dims)
+            person_ids[start:end] = ids
+            slots[start:end] = row_slots
+            start = end
+    return person_ids, slots, features, counts
+
+
 # 清空特征库
 def clear_all_features(db_path, db_name):
     """
@@ -424,6 +941,7 @@ def clear_all_features(db_path, db_name):
     :param db_path: 数据库文件路径
     :param db_name: 数据库表名
     """
+    _flush_pending_writes()
     with _get_connection_context(db_path) as conn:
         cursor = conn.cursor()
 
@@ -434,4 +952,5 @@ def clear_all_features(db_path, db_name):
 # 关闭所有连接
 def close_all_connections():
     """关闭连接池中所有数据库连接"""
+    _flush_pending_writes()
     _connection_pool.close_all_connections()
\ No newline at end of file
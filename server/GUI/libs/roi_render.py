@@ -0,0 +1,60 @@
+from functools import lru_cache
+import cv2
+import numpy as np
+
+
+@lru_cache(maxsize=1024)
+def text_size(text, font_face=cv2.FONT_HERSHEY_SIMPLEX, font_scale=1, thickness=2):
+    """cv2.getTextSize的缓存版本，计数文字变化不频繁，大部分帧直接命中"""
+    return cv2.getTextSize(text, font_face, font_scale, thickness)
+
+
+class _Layer(object):
+    """某一分辨率下预计算好的ROI图层，只覆盖ROI外接矩形"""
+    __slots__ = ('y0', 'y1', 'x0', 'x1', 'mask', 'color_crop')
+
+
+class RoiRenderCache(object):
+    """
+    每路视频的ROI绘制缓存
+    - 多边形掩码和纯色填充层按分辨率预计算一次，ROI配置只在setup_processing时变化
+    - 绘制时只在ROI外接矩形内原地混合，不复制整帧
+    - 结果与 frame.copy + fillPoly + addWeighted + line 的逐帧绘制一致
+    """
+    def __init__(self, points, line=None, color=(128, 128, 128), alpha=0.5, line_color=(255, 0, 0), thickness=2):
+        self.points = np.array(points, np.int32).reshape((-1, 2))
+        self.line = None if line is None else [tuple(int(v) for v in p) for p in line]
+        self.color = color
+        self.alpha = alpha
+        self.line_color = line_color
+        self.thickness = thickness
+        self._layers = {}
+
+    def _build(self, height, width):
+        layer = _Layer()
+        layer.x0 = int(np.clip(self.points[:, 0].min(), 0, width))
+        layer.x1 = int(np.clip(self.points[:, 0].max() + 1, 0, width))
+        layer.y0 = int(np.clip(self.points[:, 1].min(), 0, height))
+        layer.y1 = int(np.clip(self.points[:, 1].max() + 1, 0, height))
+        h, w = layer.y1 - layer.y0, layer.x1 - layer.x0
+        layer.mask = np.zeros((h, w), np.uint8)
+        if h > 0 and w > 0:
+            cv2.fillPoly(layer.mask, [self.points.reshape((-1, 1, 2))], 255, offset=(-layer.x0, -layer.y0))
+        layer.color_crop = np.empty((h, w, 3), np.uint8)
+        layer.color_crop[:] = self.color
+        return layer
+
+    def draw(self, frame):
+        """在frame上原地绘制半透明ROI和标识线"""
+        height, width = frame.shape[:2]
+        layer = self._layers.get((height, width))
+        if layer is None:
+            layer = self._layers[(height, width)] = self._build(height, width)
+        crop = frame[layer.y0:layer.y1, layer.x0:layer.x1]
+        if crop.size > 0:
+            # 混合结果只有外接矩形大小，按掩码原地拷回frame
+            blended = cv2.addWeighted(layer.color_crop, self.alpha, crop, 1 - self.alpha, 0)
+            cv2.copyTo(blended, layer.mask, crop)
+        if self.line is not None:
+            cv2.line(frame, self.line[0], self.line[1], self.line_color, self.thickness)
+        return frame
@@ -368,7 +368,7 @@ class StreamManager:
 
 
     def process_video_in_thread(self, video_source, temp_data={},
-                                skip_frames=2, match_thresh=0.15, is_track=True, save_video=False,
+                                skip_frames=2, match_thresh=None, is_track=True, save_video=False,
                                 stream_manager=None, show_window=True, window_name=None, queue_index=0):
         """
         在单独的线程中处理视频源（可以是OpenCV的VideoCapture对象或RTSP URL）
@@ -377,7 +377,7 @@ class StreamManager:
             video_source: 视频源，可以是OpenCV的VideoCapture对象或RTSP URL字符串
             temp_data: 临时数据
             skip_frames: 跳帧数
-            match_thresh: 匹配阈值
+            match_thresh: 匹配阈值，None时由process_frame按SEARCH_METRIC取配置默认值
             is_track: 是否启用跟踪
             save_video: 是否保存结果视频
             stream_manager: 流管理器实例，用于更新状态
@@ -60,15 +60,16 @@ import json
 import time
 from typing import Union, List
 from Reid_module3 import ReIDTracker
+from RTSPData import SourceRegistry
+import multiprocessing as mp
+from collections import Counter
+from analysis_worker import run_analysis_worker, MSG_FREE, MSG_GALLERY
+from libs.gallery_service import GalleryService
 from libs.rtsp_check import is_img_not_validV2
 # 获取主事件循环
 mainloop = asyncio.get_event_loop()
 asyncio.set_event_loop(mainloop)
 
-from concurrent.futures import ThreadPoolExecutor
-
-# 创建编码线程池（根据CPU核心数调整）
-encode_executor = ThreadPoolExecutor(max_workers=4)
 # 添加自定义JSON编码器
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -152,11 +153,25 @@ class StreamManager:
         self.origin_video_rtsp_dict = {}
 
         self.rtsp_datas=rtsp_datas
+        # 每个摄像头只有一个解码循环，分析线程按'analysis'引用
+        self.sources = SourceRegistry.get_instance()
+        # 每路分析线程自己的停止事件，停止分析不影响同一路的预览
+        self.analysis_stop = {}
 
         from ws_manager import ConnectionManager
         # WebSocket输出
-        self.manager = ConnectionManager(rtsp_datas)
+        self.manager = ConnectionManager(self.sources)
+
 
+    def has_subscribers(self, rtsp_url):
+        """/video_feed是否有人在看，只有有订阅时分析线程才绘制标注画面并编码"""
+        rtsp_data = self.rtsp_datas.get(rtsp_url)
+        return rtsp_data is not None and rtsp_data.annotated_hub.subscriber_count() > 0
+
+    def mjpeg_stats(self):
+        """各路原始/标注画面MJPEG广播的编码耗时和扇出统计"""
+        return {rtsp_url: {'raw': rtsp_data.raw_hub.stats(), 'annotated': rtsp_data.annotated_hub.stats()}
+                for rtsp_url, rtsp_data in list(self.rtsp_datas.items())}
 
     def is_rtsp_url(self, url: str) -> bool:
         """
@@ -285,7 +300,7 @@ class StreamManager:
 
 
     async def process_video_in_thread(self, video_source, temp_data={},
-                                skip_frames=2, match_thresh=0.15, is_track=True, save_video=False,
+                                skip_frames=2, match_thresh=None, is_track=True, save_video=False,
                                 stream_manager=None, show_window=True, window_name=None, queue_index=0):
         """
         在单独的线程中处理视频源（可以是OpenCV的VideoCapture对象或RTSP URL）
@@ -294,7 +309,7 @@ class StreamManager:
             video_source: 视频源，可以是OpenCV的VideoCapture对象或RTSP URL字符串
             temp_data: 临时数据
             skip_frames: 跳帧数
-            match_thresh: 匹配阈值
+            match_thresh: 匹配阈值，None时按SEARCH_METRIC取配置默认值
             is_track: 是否启用跟踪
             save_video: 是否保存结果视频
             stream_manager: 流管理器实例，用于更新状态
@@ -308,10 +323,13 @@ class StreamManager:
         import threading
         import cv2
         print("process_video_in_thread")
-        # 创建停止事件
-        print(len(self.rtsp_datas))
-        print(self.rtsp_datas)
-        current_rtsp_data=self.rtsp_datas[video_source]
+        # 从注册表取这一路的解码(没有则打开)，线程结束时归还
+        current_rtsp_data = self.sources.acquire(video_source, 'analysis')
+        # 同一路只保留一个分析线程
+        previous = self.analysis_stop.get(video_source)
+        if previous is not None:
+            previous.set()
+        stop_event = self.analysis_stop[video_source] = threading.Event()
 
         asyncio.set_event_loop(current_rtsp_data.mainloop)
         print('...11')
@@ -330,7 +348,7 @@ class StreamManager:
             frame_count=0
             #current_rtsp_data.origin_frame_queue=asyncio.Queue(maxsize=1)
 
-            while not current_rtsp_data.stop_event.is_set():
+            while not (stop_event.is_set() or current_rtsp_data.stop_event.is_set()):
                 try:
                     # 尝试读取帧
                     # 同步队列获取，（使用线程池避免阻塞）
@@ -341,7 +359,10 @@ class StreamManager:
                    #      asyncio.sleep(0.05)
 
 
-                    frame = current_rtsp_data.origin_frame_queue.get()
+                    try:
+                        frame = current_rtsp_data.origin_frame_queue.get(timeout=1)
+                    except queue.Empty:
+                        continue
                     # frame_count+=1
                     # # 跳帧塞入待处理队列
                     # if frame_count%2:
@@ -385,10 +406,18 @@ class StreamManager:
 
                     # 处理帧（使用线程池）
                     main_loop=asyncio.get_event_loop()
-                    processed_frame, info,result = await main_loop.run_in_executor(
-                        None,
-                        lambda: tracker.process_frame(frame, 0, match_thresh, is_track)
-                    )
+                    # 只有/video_feed有订阅时才需要标注画面，否则只出统计结果；frame是帧环的槽位，处理完归还
+                    render = self.has_subscribers(current_rtsp_data.rtsp_url)
+                    try:
+                        processed_frame, info,result = await main_loop.run_in_executor(
+                            None,
+                            lambda: tracker.process_frame(frame, 0, match_thresh, is_track, render=render)
+                        )
+                    finally:
+                        current_rtsp_data.release_frame(frame)
+                    if render and processed_frame is not None:
+                        # 标注画面是process_frame复制出来的，交给广播编码一次后发给所有订阅者
+                        current_rtsp_data.annotated_hub.publish(processed_frame)
 
                    #processed_frame, info = tracker.process_frame(frame, 0, match_thresh, is_track)
                     # processed_frame, info =  asyncio.run_coroutine_threadsafe(tracker.process_frame(frame, 0, match_thresh, is_track),asyncio.get_event_loop())
@@ -488,6 +517,9 @@ class StreamManager:
                 loop.run_until_complete(_process_video_task(current_rtsp_data))
             finally:
                 loop.close()
+                if self.analysis_stop.get(video_source) is stop_event:
+                    del self.analysis_stop[video_source]
+                self.sources.release(video_source, 'analysis')
 
 
 
@@ -509,6 +541,132 @@ class StreamManager:
         # 返回包含线程信息的字典
         return threading_dict
 
+    async def start_analysis(self, video_source, temp_data={}, match_thresh=None, is_track=True):
+        """按 cfgs.ANALYSIS_MODE 启动一路分析：服务进程内的线程，或单独的分析进程"""
+        if cfgs.ANALYSIS_MODE == 'process':
+            return await self.process_video_in_process(video_source, temp_data, match_thresh, is_track)
+        return await self.process_video_in_thread(video_source, temp_data, match_thresh=match_thresh, is_track=is_track)
+
+    async def process_video_in_process(self, video_source, temp_data={}, match_thresh=None, is_track=True):
+        """
+        进程模式：每路一个分析进程，process_frame/IDDict/TrackManager/绘制不再共用服务进程的GIL
+        - 解码仍在服务进程(每个摄像头一个)，帧环在共享内存里，分析进程按槽位下标直接读，不复制
+        - 槽位在分析进程发回下标之前不会被解码线程覆盖
+        - 统计结果回到服务进程放进process_frame_queue给WebSocket，队列满时丢弃最旧的
+        - /video_feed有订阅时分析进程绘制并编码标注画面，服务进程只负责扇出
+        - 行人库只在服务进程(GalleryService)，分析进程提取特征后发回来匹配/注册，跨摄像头匹配和person_id分配只在一处
+        注意：每个分析进程各自加载检测和特征提取模型
+
+        Returns:
+            thread_info: 包含分析进程pid的字典
+        """
+        current_rtsp_data = self.sources.acquire(video_source, 'analysis')
+        ring = current_rtsp_data.frame_ring
+        if ring.shm_name is None:
+            # 这一路在切换到进程模式前就已打开，帧环不在共享内存里
+            self.sources.release(video_source, 'analysis')
+            print(f"{video_source} 的帧环不在共享内存中，改用线程模式分析")
+            return await self.process_video_in_thread(video_source, temp_data, match_thresh=match_thresh,
+                                                      is_track=is_track)
+        previous = self.analysis_stop.get(video_source)
+        if previous is not None:
+            previous.set()
+        stop_event = self.analysis_stop[video_source] = threading.Event()
+
+        ctx = mp.get_context('spawn')
+        ready_q = ctx.Queue()
+        out_q = ctx.Queue(maxsize=cfgs.ANALYSIS_RESULT_QUEUE)
+        reply_q = ctx.Queue()
+        render_flag = ctx.Value('b', 0, lock=False)
+        worker_stop = ctx.Event()
+        process = ctx.Process(target=run_analysis_worker, name=f'analysis-{current_rtsp_data.stream_id}', daemon=True,
+                              args=(video_source, temp_data, ring.shm_name, ring.shape, len(ring), ready_q, out_q,
+                                    reply_q, render_flag, worker_stop, match_thresh, is_track))
+        process.start()
+        # 已发给分析进程、还没归还的槽位
+        outstanding = Counter()
+        outstanding_lock = threading.Lock()
+
+        def _release_slot(idx):
+            with outstanding_lock:
+                if outstanding[idx] <= 0:
+                    return
+                outstanding[idx] -= 1
+            if idx < len(ring):
+                current_rtsp_data.release_frame(ring.slot(idx))
+
+        # 行人库请求按顺序在单独的线程里执行，不耽误归还槽位
+        gallery_executor = ThreadPoolExecutor(max_workers=1,
+                                              thread_name_prefix=f'analysis-gallery-{current_rtsp_data.stream_id}')
+
+        def _serve_gallery(req_id, method, args):
+            try:
+                result = GalleryService.get_instance().handle(method, args)
+            except Exception as e:
+                print(f"{video_source} 行人库请求 {method} 出错: {e}")
+                result = None
+            if req_id is not None:
+                reply_q.put((req_id, result))
+
+        def _feed():
+            """从origin_frame_queue取帧，只把槽位下标发给分析进程"""
+            while not (stop_event.is_set() or current_rtsp_data.stop_event.is_set()) and process.is_alive():
+                try:
+                    frame = current_rtsp_data.origin_frame_queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                render_flag.value = self.has_subscribers(video_source)
+                idx = ring.slot_index(frame)
+                if idx is None:
+                    # 帧环占满时临时分配的帧不在共享内存里，丢弃
+                    continue
+                with outstanding_lock:
+                    # 分析进程启动中或处理不过来时不再多发，避免占满帧环
+                    if sum(outstanding.values()) >= cfgs.ANALYSIS_IN_FLIGHT:
+                        idx = None
+                    else:
+                        outstanding[idx] += 1
+                if idx is None:
+                    current_rtsp_data.release_frame(frame)
+                    continue
+                ready_q.put(idx)
+            worker_stop.set()
+
+        def _collect():
+            """接收分析进程的归还和结果，进程退出后收回未归还的槽位并释放这一路的引用"""
+            while True:
+                try:
+                    msg = out_q.get(timeout=1)
+                except queue.Empty:
+                    if not process.is_alive():
+                        break
+                    continue
+                if msg[0] == MSG_FREE:
+                    _release_slot(msg[1])
+                    continue
+                if msg[0] == MSG_GALLERY:
+                    gallery_executor.submit(_serve_gallery, *msg[1:])
+                    continue
+                _, result, jpeg = msg
+                current_rtsp_data.mainloop.call_soon_threadsafe(
+                    _put_latest, current_rtsp_data.process_frame_queue, result)
+                if jpeg is not None:
+                    current_rtsp_data.annotated_hub.publish_encoded(jpeg)
+            process.join()
+            gallery_executor.shutdown(wait=True)
+            with outstanding_lock:
+                remaining = list(outstanding.elements())
+            for idx in remaining:
+                _release_slot(idx)
+            if self.analysis_stop.get(video_source) is stop_event:
+                del self.analysis_stop[video_source]
+            self.sources.release(video_source, 'analysis')
+            print(f"{video_source} 分析进程已退出，exitcode={process.exitcode}")
+
+        threading.Thread(target=_feed, name=f'analysis-feed-{current_rtsp_data.stream_id}', daemon=True).start()
+        threading.Thread(target=_collect, name=f'analysis-collect-{current_rtsp_data.stream_id}', daemon=True).start()
+        return {'pid': process.pid}
+
     def clear_queue(self, queue_index):
 
         if queue_index in self.video_thread_info:
@@ -526,8 +684,10 @@ class StreamManager:
 
     def stop_process_video_in_thread(self,rtsp_url):
         try:
-            current_rtsp_data=self.rtsp_datas[rtsp_url]
-            current_rtsp_data.stop_event.set()
+            # 只停分析线程，解码由注册表在没有订阅方时关闭
+            stop_event = self.analysis_stop.get(rtsp_url)
+            if stop_event is not None:
+                stop_event.set()
 
 
             # # 停止线程
@@ -542,50 +702,22 @@ class StreamManager:
 
 
 
-    def _encode_frame(self, frame):
-        """独立编码函数"""
-        # 可在此处添加硬件加速逻辑
-        _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-        return buffer.tobytes()
-
-
     async def consume_frame(self, rtsp_url):
-        # print(threading.current_thread())
-        # video_id=0
+        """/video_feed的MJPEG生成器，连接期间计入标注画面广播的订阅者，分析线程据此决定是否绘制"""
         print("视频流：{}".format(rtsp_url))
+        rtsp_data = self.sources.acquire(rtsp_url, 'preview')
+        try:
+            async for chunk in rtsp_data.annotated_hub.stream():
+                yield chunk
+        finally:
+            self.sources.release(rtsp_url, 'preview')
 
-        loop = asyncio.get_event_loop()
-
-        current_rtsp_data=self.rtsp_datas[rtsp_url]
-        while not current_rtsp_data.stop_event.is_set():
-            print('..1.')
-            print('process',str(current_rtsp_data.process_frame_queue.qsize()))
-            frame = await current_rtsp_data.process_frame_queue.get()
-
-
-            # cv2.imshow('process_frame', frame)
-            # cv2.waitKey(1)
-            # 检查是否支持CUDA
-            if cv2.cuda.getCudaEnabledDeviceCount() > 0:
-                gpu_frame = cv2.cuda_GpuMat()
-                gpu_frame.upload(frame)
-                # 使用GPU编码
-                _, buffer = cv2.imencode('.jpg', gpu_frame.download())
-            else:
-                _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-
-            # 将编码任务提交到线程池
-            _frame_cache = await loop.run_in_executor(
-                encode_executor,
-                self._encode_frame,  # 独立编码函数
-                frame
-            )
 
-            yield (
-                    b'--frame\r\n'
-                    b'Content-Type: image/jpeg\r\n\r\n' +
-                    _frame_cache + b'\r\n'
-            )
+def _put_latest(result_queue, item):
+    """在事件循环线程中放入最新结果，队列满时丢弃最旧的"""
+    if result_queue.full():
+        result_queue.get_nowait()
+    result_queue.put_nowait(item)
 
 
 def clear_database():
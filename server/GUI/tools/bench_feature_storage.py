@@ -0,0 +1,69 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: 检索度量 / 特征存储精度对比
+    以 l2 + float32 的flat精确检索为基准，对比 l2/cosine x float32/float16/int8 的
+    recall@1、单次检索耗时、索引每条特征占用字节数和SQLite中每条特征BLOB的字节数
+    特征为带聚类结构的L2归一化随机向量，查询为库中特征加噪声(模拟同一人不同帧)
+    用法: cd server/GUI && python tools/bench_feature_storage.py --sizes 10000 100000
+'''
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import faiss
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.search.search_engine import SearchEngine, METRICS, STORAGES
+from GUI.libs import reid_sqlV2
+from bench_search_index import make_gallery
+
+
+def index_bytes(engine):
+    return faiss.serialize_index(engine._index).nbytes / max(engine._index.ntotal, 1)
+
+
+def run(metric, storage, index_type, feats, ids, queries, dims):
+    engine = SearchEngine(feats, ids, dims=dims, index_type=index_type, metric=metric, storage=storage)
+    engine.search(queries[0], 1)
+    top1 = np.empty(len(queries), dtype=np.int64)
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        res, _ = engine.search(query, 1)
+        top1[i] = res[0] if len(res) else -1
+    latency = (time.perf_counter() - start) / len(queries) * 1000
+    return engine._active_storage, latency, index_bytes(engine), top1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检索度量 / 特征存储精度对比')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='特征库人数')
+    parser.add_argument('--dims', type=int, default=cfgs.DIMS, help='特征维度')
+    parser.add_argument('--queries', type=int, default=500, help='查询数量')
+    parser.add_argument('--noise', type=float, default=0.02, help='查询噪声标准差')
+    parser.add_argument('--index_type', default='flat', help='索引类型')
+    args = parser.parse_args()
+
+    for num in args.sizes:
+        feats, ids, queries = make_gallery(num, args.dims, args.queries, args.noise)
+        truth = None
+        for metric in METRICS:
+            for storage in STORAGES:
+                active, latency, per_vec, top1 = run(metric, storage, args.index_type, feats, ids, queries, args.dims)
+                if truth is None:
+                    truth = top1
+                # 数据库往返后的精度损失: 编码再解码，与原特征的最大余弦距离
+                blob = reid_sqlV2.encode_feature(feats[0], storage)
+                decoded = reid_sqlV2.decode_features(
+                    [reid_sqlV2.encode_feature(f, storage) for f in feats[:1000]], args.dims)
+                cos_err = float((1 - np.einsum('ij,ij->i', decoded, feats[:1000]) /
+                                 np.linalg.norm(decoded, axis=1)).max())
+                recall = float(np.mean(top1 == truth))
+                print(f'{num:>8} | {metric:>6} {storage:>7} (active {active:>7}) | search {latency:7.3f} ms | '
+                      f'recall@1 {recall:.3f} | index {per_vec:7.0f} B/vec | blob {len(blob):5d} B | '
+                      f'db cos err {cos_err:.2e}')
+
+
+if __name__ == '__main__':
+    main()
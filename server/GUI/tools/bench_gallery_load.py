@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: 特征库加载耗时对比
+    逐行frombuffer + np.array拷贝 (原实现) vs load_gallery (预分配连续数组，按块写入)
+    注意: 1M行 x 1280维 的特征库约5GB，内存/磁盘不足时可用 --dims 减小维度
+    用法: cd server/GUI && python tools/bench_gallery_load.py --sizes 10000 100000 1000000
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import Algorithm.libs.config.model_cfgs as cfgs
+from GUI.libs import reid_sqlV2
+
+
+def prepare_db(db_path, num_rows, dims, chunk=10000):
+    reid_sqlV2.init_db(db_path)
+    with reid_sqlV2._get_connection_context(db_path) as conn:
+        for start in range(0, num_rows, chunk):
+            end = min(start + chunk, num_rows)
+            feats = np.random.rand(end - start, dims).astype(np.float32)
+            conn.executemany(
+                f"INSERT INTO {cfgs.DB_NAME} (person_id, feature_vector, last_used, is_locked) VALUES (?, ?, 0, 0)",
+                ((start + i + 1, feat.tobytes()) for i, feat in enumerate(feats)))
+            conn.commit()
+
+
+def legacy_load(db_path, dims):
+    """原实现: 逐行生成数组，调用方再np.array拷贝一次(不含last_used全表更新)"""
+    with reid_sqlV2._get_connection_context(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT person_id, feature_vector FROM {cfgs.DB_NAME}")
+        feat_list, label_list = [], []
+        for row in cursor.fetchall():
+            label_list.append(row[0])
+            feat_list.append(np.frombuffer(row[1], dtype='float32').reshape(dims))
+    return np.array(feat_list), list(label_list)
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    cost = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, cost, peak / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='特征库加载耗时对比')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='特征库行数')
+    parser.add_argument('--dims', type=int, default=cfgs.DIMS, help='特征维度')
+    args = parser.parse_args()
+
+    for num_rows in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.db')
+            prepare_db(db_path, num_rows, args.dims)
+
+            (old_feats, old_ids), old_cost, old_peak = measure(legacy_load, db_path, args.dims)
+            del old_feats, old_ids
+            (feats, ids), new_cost, new_peak = measure(reid_sqlV2.load_gallery, db_path, cfgs.DB_NAME, args.dims)
+            assert feats.shape == (num_rows, args.dims) and feats.flags['C_CONTIGUOUS']
+            del feats, ids
+            reid_sqlV2.close_all_connections()
+
+        print(f'{num_rows:>8} rows | legacy {old_cost:7.3f}s peak {old_peak:8.1f}MB | '
+              f'load_gallery {new_cost:7.3f}s peak {new_peak:8.1f}MB | x{old_cost / new_cost:.1f}')
+
+
+if __name__ == '__main__':
+    main()
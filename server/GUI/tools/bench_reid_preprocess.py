@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: ReID预处理耗时对比
+    PIL + torchvision (原实现) vs ReidPreprocessor (纯OpenCV/NumPy)
+    输出单个crop的平均耗时以及两者输出的最大/平均绝对误差
+    误差容忍(归一化到[-1,1]后): 最大 0.05 (约6个灰度级，来自两种缩放插值的差别)，平均 0.01；
+    超出时以非0退出，预处理改动后要能通过这里再上线
+    用法: cd server/GUI && python tools/bench_reid_preprocess.py
+'''
+import os
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.extract.reid_preprocess import ReidPreprocessor
+
+
+def make_crops(num, seed=0):
+    """生成不同尺寸的随机crop，覆盖放大和缩小两种情况"""
+    rng = np.random.default_rng(seed)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8), (7, 7), 0)
+    crops = []
+    for _ in range(num):
+        h = int(rng.integers(60, 400))
+        w = int(rng.integers(30, 200))
+        y = int(rng.integers(0, 720 - h))
+        x = int(rng.integers(0, 1280 - w))
+        crops.append(frame[y:y + h, x:x + w])
+    return crops
+
+
+def bench(fn, crops, repeat):
+    fn(crops)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(crops)
+    return (time.perf_counter() - start) / (repeat * len(crops)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ReID预处理耗时对比')
+    parser.add_argument('--num', type=int, default=16, help='每批crop数量')
+    parser.add_argument('--repeat', type=int, default=50, help='重复次数')
+    parser.add_argument('--max-diff', type=float, default=0.05, help='允许的最大绝对误差')
+    parser.add_argument('--mean-diff', type=float, default=0.01, help='允许的平均绝对误差')
+    args = parser.parse_args()
+
+    crops = make_crops(args.num)
+    preprocessor = ReidPreprocessor(cfgs.REID_IN_SIZE)
+    cv_ms = bench(preprocessor, crops, args.repeat)
+    print(f'opencv/numpy : {cv_ms:.3f} ms/crop')
+
+    try:
+        import torch
+        import torchvision.transforms as T
+        from PIL import Image
+    except ImportError:
+        print('未安装torch/torchvision，跳过原实现对比')
+        return
+
+    transform = T.Compose([
+        T.Resize(cfgs.REID_IN_SIZE),
+        T.ToTensor(),
+        T.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+    ])
+
+    def torch_preprocess(batch):
+        imgs = [transform(Image.fromarray(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))) for crop in batch]
+        return torch.stack(imgs, dim=0).numpy()
+
+    torch_ms = bench(torch_preprocess, crops, args.repeat)
+    print(f'pil/torch    : {torch_ms:.3f} ms/crop  (x{torch_ms / cv_ms:.1f})')
+
+    diff = np.abs(torch_preprocess(crops) - preprocessor(crops))
+    print(f'max abs diff : {diff.max():.4f}, mean abs diff: {diff.mean():.5f}  '
+          f'(容忍 {args.max_diff}, {args.mean_diff})')
+    if diff.max() > args.max_diff or diff.mean() > args.mean_diff:
+        print('预处理结果与原实现偏差超出容忍')
+        sys.exit(1)
+    print('通过')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: 检索索引 recall@1 / 耗时对比
+    以flat精确检索为基准，对比 hnsw / ivf_flat / ivf_pq 的建库耗时、单次检索耗时和recall@1
+    特征为带聚类结构的L2归一化随机向量，查询为库中特征加噪声(模拟同一人不同帧)
+    用法: cd server/GUI && python tools/bench_search_index.py --sizes 10000 100000
+'''
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import Algorithm.libs.config.model_cfgs as cfgs
+from Algorithm.libs.search.search_engine import SearchEngine, INDEX_TYPES
+
+
+def l2norm(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def make_gallery(num, dims, num_queries, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(num // 50, 1), dims)).astype(np.float32)
+    feats = centers[rng.integers(0, len(centers), num)] + 0.5 * rng.standard_normal((num, dims)).astype(np.float32)
+    feats = l2norm(feats).astype(np.float32)
+    picks = rng.choice(num, num_queries, replace=False)
+    queries = l2norm(feats[picks] + noise * rng.standard_normal((num_queries, dims)).astype(np.float32))
+    return feats, np.arange(1, num + 1, dtype=np.int64), queries.astype(np.float32)
+
+
+def run(index_type, feats, ids, queries, dims):
+    start = time.perf_counter()
+    engine = SearchEngine(feats, ids, dims=dims, index_type=index_type)
+    build = time.perf_counter() - start
+
+    engine.search(queries[0], 1)
+    top1 = np.empty(len(queries), dtype=np.int64)
+    start = time.perf_counter()
+    for i, query in enumerate(queries):
+        res, _ = engine.search(query, 1)
+        top1[i] = res[0] if len(res) else -1
+    latency = (time.perf_counter() - start) / len(queries) * 1000
+    return engine._active_type, build, latency, top1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检索索引 recall@1 / 耗时对比')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='特征库人数')
+    parser.add_argument('--dims', type=int, default=cfgs.DIMS, help='特征维度')
+    parser.add_argument('--queries', type=int, default=500, help='查询数量')
+    parser.add_argument('--noise', type=float, default=0.02, help='查询噪声标准差')
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), help='对比的索引类型')
+    args = parser.parse_args()
+
+    for num in args.sizes:
+        feats, ids, queries = make_gallery(num, args.dims, args.queries, args.noise)
+        truth = None
+        for index_type in ['flat'] + [t for t in args.types if t != 'flat']:
+            active, build, latency, top1 = run(index_type, feats, ids, queries, args.dims)
+            if truth is None:
+                truth = top1
+            recall = float(np.mean(top1 == truth))
+            print(f'{num:>8} | {index_type:>8} (active {active:>8}) | build {build:7.2f}s | '
+                  f'search {latency:7.3f} ms | recall@1 {recall:.3f}')
+
+
+if __name__ == '__main__':
+    main()
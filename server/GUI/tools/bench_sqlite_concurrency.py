@@ -0,0 +1,90 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: 特征库SQLite并发读写吞吐对比
+    多个线程模拟多路视频同时读写reid.db，每个线程按比例随机执行
+    按person_id读取特征(读) / update_feature同步提交(写)
+    对比 cfgs.DB_PROFILES 中各连接配置在4/8路并发下的读写吞吐
+    用法: cd server/GUI && python tools/bench_sqlite_concurrency.py
+'''
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import Algorithm.libs.config.model_cfgs as cfgs
+from GUI.libs import reid_sqlV2
+
+
+def prepare_db(db_path, num_persons, dims):
+    reid_sqlV2.init_db(db_path)
+    feats = np.random.rand(num_persons, dims).astype(np.float32)
+    reid_sqlV2.save_features_to_sqlite(db_path, feats, list(range(1, num_persons + 1)))
+
+
+def worker(db_path, num_persons, dims, write_ratio, stop, stats, seed):
+    rng = random.Random(seed)
+    feature = np.random.rand(dims).astype(np.float32)
+    reads = writes = errors = 0
+    while not stop.is_set():
+        person_id = rng.randint(1, num_persons)
+        try:
+            if rng.random() < write_ratio:
+                reid_sqlV2.update_feature(db_path, person_id, feature)
+                writes += 1
+            else:
+                with reid_sqlV2._get_connection_context(db_path) as conn:
+                    conn.execute(f"SELECT feature_vector FROM {cfgs.DB_NAME} WHERE person_id=?",
+                                 (person_id,)).fetchone()
+                reads += 1
+        except sqlite3.OperationalError:
+            # database is locked
+            errors += 1
+    stats.append((reads, writes, errors))
+
+
+def run(profile, threads, args):
+    cfgs.DB_CONNECTION_PROFILE = profile
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        prepare_db(db_path, args.persons, args.dims)
+        stop = threading.Event()
+        stats = []
+        workers = [threading.Thread(target=worker, args=(db_path, args.persons, args.dims, args.write_ratio,
+                                                         stop, stats, i)) for i in range(threads)]
+        for t in workers:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in workers:
+            t.join()
+        reid_sqlV2.close_all_connections()
+
+    reads, writes, errors = (sum(col) for col in zip(*stats))
+    print(f'{profile:>8} | {threads} threads | read {reads / args.duration:9.0f}/s | '
+          f'write {writes / args.duration:7.0f}/s | locked {errors}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='特征库SQLite并发读写吞吐对比')
+    parser.add_argument('--persons', type=int, default=2000, help='特征库人数')
+    parser.add_argument('--dims', type=int, default=cfgs.DIMS, help='特征维度')
+    parser.add_argument('--duration', type=float, default=3.0, help='每组测试时长(秒)')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='写操作占比')
+    parser.add_argument('--threads', type=int, nargs='+', default=[4, 8], help='并发线程数')
+    args = parser.parse_args()
+
+    # 测试同步提交的真实开销，不经过write-behind队列
+    cfgs.DB_WRITE_BEHIND = False
+    for threads in args.threads:
+        for profile in cfgs.DB_PROFILES:
+            run(profile, threads, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+'''
+@Describe: 帧路径的内存分配检查(tracemalloc)
+    用合成视频驱动 RTSPData 解码线程 -> origin_frame_queue -> 消费方，统计每帧新分配的字节数
+    - 不标注: 解码写进帧环槽位，消费方只读视图，每帧分配应远小于一帧
+    - 标注(--render): 只允许复制一次整帧再原地画ROI
+    超出预算时以非0退出，可以放进发布前检查
+    用法: cd server/GUI && python tools/check_frame_alloc.py [--render] [--resize]
+'''
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RTSPData import RTSPData
+from libs.roi_render import RoiRenderCache
+
+
+def make_video(path, num, width, height, fps=25):
+    """写一段带移动方块的合成视频，代替RTSP源"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    frame = np.empty((height, width, 3), np.uint8)
+    for i in range(num):
+        frame[:] = (40, 80, 120)
+        x = (i * 13) % max(width - 100, 1)
+        frame[100:300, x:x + 100] = (200, 200, 200)
+        writer.write(frame)
+    writer.release()
+
+
+def measure(rtsp_data, num, render, roi_render):
+    """逐帧取出并处理，返回相邻两次取帧之间(含解码线程)的峰值新增分配字节数"""
+    per_frame = []
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    for _ in range(num):
+        frame = rtsp_data.origin_frame_queue.get(timeout=5)
+        # 分析阶段只读视图
+        cv2.mean(frame)
+        if render:
+            output = frame.copy()
+            roi_render.draw(output)
+            del output
+        rtsp_data.release_frame(frame)
+        current, peak = tracemalloc.get_traced_memory()
+        per_frame.append(peak - base)
+        tracemalloc.reset_peak()
+        base = current
+    return per_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description='帧路径内存分配检查')
+    parser.add_argument('--frames', type=int, default=120, help='统计的帧数')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--resize', action='store_true', help='源宽度超过1280，走解码后resize的路径')
+    parser.add_argument('--render', action='store_true', help='每帧生成标注画面')
+    parser.add_argument('--budget-kb', type=float, default=64, help='不标注时每帧允许的分配(KB)')
+    args = parser.parse_args()
+
+    width, height = (1920, 1080) if args.resize else (args.width, args.height)
+    video_path = os.path.join(tempfile.mkdtemp(), 'frames.avi')
+    # 文件解码比实时流快，多写一些帧，避免统计完之前视频就读完
+    make_video(video_path, args.frames * 4, width, height)
+
+    rtsp_data = RTSPData(video_path, max_num=4)
+    h, w = rtsp_data.height, rtsp_data.width
+    frame_bytes = h * w * 3
+    roi_render = RoiRenderCache([[w // 4, h // 4], [w * 3 // 4, h // 4], [w * 3 // 4, h * 3 // 4], [w // 4, h * 3 // 4]],
+                                line=[[w // 4, h // 4], [w * 3 // 4, h // 4]])
+
+    tracemalloc.start()
+    per_frame = measure(rtsp_data, args.frames, args.render, roi_render)
+    tracemalloc.stop()
+    rtsp_data.stop_event.set()
+    time.sleep(0.5)  # 等解码线程退出并释放VideoCapture
+
+    per_frame = np.array(per_frame[10:], dtype=np.float64)  # 跳过预热
+    budget = args.budget_kb * 1024 + (frame_bytes * 1.5 if args.render else 0)
+    print(f'分辨率 {w}x{h}，一帧 {frame_bytes / 1024:.0f} KB，帧环 {len(rtsp_data.frame_ring)} 槽，'
+          f'未命中 {rtsp_data.frame_ring.misses} 次')
+    print(f'每帧分配: 平均 {per_frame.mean() / 1024:.1f} KB，最大 {per_frame.max() / 1024:.1f} KB，'
+          f'预算 {budget / 1024:.1f} KB')
+    if per_frame.max() > budget:
+        print('超出预算')
+        sys.exit(1)
+    print('通过')
+
+
+if __name__ == '__main__':
+    main()
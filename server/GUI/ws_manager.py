@@ -17,11 +17,12 @@ app = FastAPI()
 
 
 class ConnectionManager:
-    def __init__(self,rtsp_datas={}):
+    def __init__(self,sources):
         # 存储活跃连接及其对应的发送任务
         self.active_connections: Dict[str, WebSocket] = {}
         self.tasks: Dict[str, asyncio.Task] = {}
-        self.rtsp_datas = rtsp_datas
+        # SourceRegistry，按rtsp_url取分析结果队列(分析未开始或源已重开时队列也一直有效)
+        self.sources = sources
 
 
     async def connect(self, websocket: WebSocket, rtsp_url: str):
@@ -37,9 +38,9 @@ class ConnectionManager:
     async def _send_data_loop(self, websocket: WebSocket, rtsp_url: str):
         """独立数据发送循环"""
         try:
-            print(self.rtsp_datas)
+            result_queue = self.sources.result_queue(rtsp_url)
             while True:
-                data = await self.rtsp_datas[rtsp_url].process_frame_queue.get()
+                data = await result_queue.get()
                 await websocket.send_json(data)
               #  await asyncio.sleep(0.05)  # 50ms间隔
         except WebSocketDisconnect: